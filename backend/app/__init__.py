@@ -1,6 +1,10 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from .core.config import get_settings
+from .utils.comfyui_pool import get_comfyui_registry
+from .utils.comfyui_backends import get_backend_pool
+from .utils.workflow_templates import get_workflow_registry
+from .services.job_manager import get_job_manager
 
 settings = get_settings()
 
@@ -20,9 +24,29 @@ app.add_middleware(
 )
 
 # 导入路由
-from .routers import auth, images, users
+from .routers import auth, images, users, comfyui, jobs
 
 # 注册路由
 app.include_router(auth.router, prefix="/api/auth", tags=["认证"])
 app.include_router(images.router, prefix="/api/images", tags=["图片"])
-app.include_router(users.router, prefix="/api/users", tags=["用户"]) 
\ No newline at end of file
+app.include_router(users.router, prefix="/api/users", tags=["用户"])
+app.include_router(comfyui.router, prefix="/api/comfyui", tags=["ComfyUI"])
+app.include_router(jobs.router, prefix="/api/jobs", tags=["任务"])
+
+@app.on_event("startup")
+async def startup_comfyui():
+    # 创建进程级ComfyUI连接池，并开始跟踪各后端负载
+    await get_comfyui_registry().start()
+    get_backend_pool().start()
+    # 启动时解析并校验全部工作流模板
+    get_workflow_registry().load_all()
+    # 启动异步任务worker，恢复重启前未结束的任务并接管其已提交的prompt
+    get_job_manager().recover()
+
+@app.on_event("shutdown")
+async def shutdown_comfyui():
+    # 正在执行的prompt留在ComfyUI上，重启后由 recover() 接管
+    get_comfyui_registry().detach()
+    await get_job_manager().close()
+    await get_backend_pool().close()
+    await get_comfyui_registry().close() 
\ No newline at end of file
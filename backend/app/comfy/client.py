@@ -4,11 +4,13 @@ import base64
 from io import BytesIO
 from PIL import Image
 import time
+from ..core.config import get_settings
 
 class ComfyUIClient:
-    def __init__(self, base_url="http://223.104.3.2:8188"):
-        self.base_url = base_url
-        self.api_url = f"{base_url}/api"
+    def __init__(self, base_url=None):
+        # 默认使用配置中的第一个ComfyUI后端
+        self.base_url = base_url or f"http://{get_settings().COMFYUI_BACKENDS[0]}"
+        self.api_url = f"{self.base_url}/api"
         self.timeout = 30  # 设置超时时间为30秒
 
     def _encode_image(self, image):
@@ -16,6 +16,105 @@ class Settings(BaseSettings):
     # CORS配置
     CORS_ORIGINS: list = ["*"]
     
+    # ComfyUI后端配置（"host:port"列表，任务按负载路由到各后端）
+    COMFYUI_BACKENDS: list = ["101.126.152.137:8188"]
+    # 每个后端同时执行的最大任务数，可按 "host:port" 单独覆盖
+    COMFYUI_BACKEND_CONCURRENCY: int = 2
+    COMFYUI_BACKEND_CONCURRENCY_OVERRIDES: dict = {}
+    # 后端满载时本地公平队列中各优先级类别的权重（interactive / bulk）
+    SCHEDULER_PRIORITY_WEIGHTS: dict = {"interactive": 4.0, "bulk": 1.0}
+    # 排队策略：fair（按用户加权公平）或 sjf（按预测执行时间短作业优先，等待越久越靠前）
+    SCHEDULER_POLICY: str = "fair"
+    # 按缓存分组的窗口：公平顺序靠前的多少个请求可以为复用ComfyUI节点缓存（相同模型、提示词、分辨率）
+    # 提前执行，也是每个请求最多被越过的次数；0表示关闭
+    SCHEDULER_CACHE_WINDOW: int = 4
+    # 模型亲和路由：优先已加载所需模型的后端，其负载比最空闲的后端多出该值以上时按负载选择；
+    # 每个后端认为仍在显存中的最近使用模型文件数
+    SCHEDULER_AFFINITY_MAX_EXTRA_LOAD: int = 1
+    COMFYUI_RESIDENT_MODELS: int = 8
+    
+    # 执行时间预测：没有历史数据时 1024x1024、20步、单张的预计秒数；
+    # 执行期限 = 预测时间 × 倍数 + 余量；无消息超时 = 预测时间 × 比例，限制在上下限之间（秒）
+    RUNTIME_DEFAULT_SECONDS: float = 20
+    RUNTIME_DEADLINE_FACTOR: float = 3
+    RUNTIME_DEADLINE_GRACE: float = 30
+    RUNTIME_INACTIVITY_RATIO: float = 0.5
+    RUNTIME_INACTIVITY_MIN: float = 15
+    RUNTIME_INACTIVITY_MAX: float = 300
+    # 提交后等待开始执行的最长时间（秒），超过时从ComfyUI队列删除，防止丢失的prompt一直占用名额
+    COMFYUI_QUEUE_TIMEOUT: float = 1800
+    # 单次提交的最大batch_size，更大的批量拆分为子批次分发到多个后端；子批次失败时换后端重试的次数
+    COMFYUI_MAX_BATCH_SIZE: int = 4
+    COMFYUI_SUBBATCH_RETRIES: int = 1
+    # 后端健康检查及队列、显存状态刷新间隔（秒）
+    COMFYUI_BACKEND_REFRESH_INTERVAL: float = 5
+    # 健康检查超时（秒）；连续失败达到阈值后熔断，熔断持续一段时间后半开探测
+    COMFYUI_HEALTH_CHECK_TIMEOUT: float = 5
+    COMFYUI_CIRCUIT_FAILURE_THRESHOLD: int = 3
+    COMFYUI_CIRCUIT_RECOVERY_TIMEOUT: float = 30
+    # 预热：启动、熔断恢复和后端重启后，用各模板（为空表示全部模板）的极小分辨率、极少步数版本
+    # 提前加载模型，完成后才标记为已预热；超时为加载模型期间允许的无消息时间（秒），
+    # 也用于分配到未预热或未加载所需模型的后端的任务；所有模板都失败时隔一段时间（秒）重试
+    COMFYUI_WARMUP_ENABLED: bool = True
+    COMFYUI_WARMUP_TEMPLATES: list = []
+    COMFYUI_WARMUP_SIZE: int = 64
+    COMFYUI_WARMUP_STEPS: int = 1
+    COMFYUI_WARMUP_TIMEOUT: float = 300
+    COMFYUI_WARMUP_RETRY_INTERVAL: float = 60
+    # 对冲提交（默认关闭）：提交后超过开始执行等待时间的分位数（样本不足时为默认值，不低于下限，秒）
+    # 仍未开始执行时，在另一个后端提交副本；每个请求积累 BUDGET 个对冲令牌，最多积累 BURST 个
+    HEDGING_ENABLED: bool = False
+    HEDGING_QUANTILE: float = 0.95
+    HEDGING_MIN_DELAY: float = 2
+    HEDGING_DEFAULT_DELAY: float = 30
+    HEDGING_MIN_SAMPLES: int = 20
+    HEDGING_BUDGET: float = 0.1
+    HEDGING_BURST: float = 5
+    
+    # ComfyUI连接池配置
+    COMFYUI_POOL_LIMIT: int = 100
+    COMFYUI_POOL_LIMIT_PER_HOST: int = 16
+    COMFYUI_KEEPALIVE_TIMEOUT: float = 60
+    COMFYUI_DNS_CACHE_TTL: int = 300
+    COMFYUI_CONNECT_TIMEOUT: float = 10
+    COMFYUI_READ_TIMEOUT: float = 60
+    COMFYUI_WS_HEARTBEAT: float = 30
+    # 流式下载块大小及内存缓冲落盘阈值（字节）
+    COMFYUI_DOWNLOAD_CHUNK_SIZE: int = 65536
+    IMAGE_SPOOL_MAX_MEMORY: int = 4194304
+    # 通过WebSocket直接回传生成的图像（需后端安装SaveImageWebsocket节点）
+    COMFYUI_WS_OUTPUT: bool = False
+    
+    # ComfyUI历史记录清理配置（保留时间单位：秒）
+    COMFYUI_HISTORY_RETENTION: float = 60
+    COMFYUI_HISTORY_PRUNE_INTERVAL: float = 10
+    COMFYUI_HISTORY_PRUNE_BATCH: int = 50
+    
+    # 异步任务配置：同时执行的任务数、完成后结果保留时间（秒）
+    JOB_WORKERS: int = 4
+    JOB_RESULT_TTL: float = 3600
+    # 每个观察者每秒最多收到的进度推送次数，期间的多次变化合并为最新状态
+    JOB_EVENTS_MAX_RATE: float = 4
+    
+    # 准入控制：预计排队时间超过预算（秒）时返回503，同步接口和异步任务分别设置；
+    # 还没有执行记录时单个prompt的预计执行时间（秒）
+    ADMISSION_LATENCY_BUDGET: float = 60
+    ADMISSION_JOB_LATENCY_BUDGET: float = 900
+    ADMISSION_DEFAULT_PROMPT_SECONDS: float = 20
+    # 每个用户的图像配额（令牌桶）：每秒补充数及上限，超出时返回429
+    USER_RATE_LIMIT: float = 0.5
+    USER_RATE_BURST: int = 64
+    
+    # 采样预览帧配置：最长边（像素，0表示不缩小）、重新编码格式（WEBP/JPEG/PNG）及质量
+    PREVIEW_MAX_SIZE: int = 512
+    PREVIEW_FORMAT: str = "WEBP"
+    PREVIEW_QUALITY: int = 75
+    
+    # 生成结果缓存配置（按工作流内容寻址，大小上限单位：字节）
+    RESULT_CACHE_ENABLED: bool = True
+    RESULT_CACHE_DIR: str = "cache/results"
+    RESULT_CACHE_MAX_BYTES: int = 1073741824
+    
     class Config:
         env_file = ".env"
 
@@ -14,7 +14,9 @@ import uuid
 import time
 import asyncio
 from pathlib import Path
+from typing import List, Optional
 from ..services.image_generator import ImageGenerator
+from ..utils.image_sinks import SpooledSink
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -23,10 +25,10 @@ logger = logging.getLogger(__name__)
 settings = get_settings()
 openai.api_key = settings.OPENAI_API_KEY
 
-# ComfyUI API 地址
-COMFYUI_API_URL = "http://101.126.152.137:8188"
+# 共享的图像生成服务，按负载在配置的ComfyUI后端之间路由
+generator = ImageGenerator()
 
-async def generate_text_to_image(prompt: str, model: str = "flux-t2v") -> str:
+async def generate_text_to_image(prompt: str, model: str = "flux-t2v", user_id: Optional[int] = None) -> str:
     """文生图功能，支持多种模型"""
     try:
         # 验证提示词不为空
@@ -34,23 +36,15 @@ async def generate_text_to_image(prompt: str, model: str = "flux-t2v") -> str:
             raise Exception("提示词不能为空")
             
         if model.lower() == "flux-t2v":
-            # 使用新的图像生成服务
-            generator = ImageGenerator(host="101.126.152.137", port=8188)
-            
-            # 创建临时文件路径
-            temp_dir = Path("temp")
-            temp_dir.mkdir(exist_ok=True)
-            output_path = temp_dir / f"{uuid.uuid4()}.png"
-            
-            # 生成图像
-            await generator.generate_image(prompt, output_path)
-            
-            # 将图像转换为base64
-            with open(output_path, "rb") as f:
-                image_data = base64.b64encode(f.read()).decode()
-            
-            # 删除临时文件
-            os.remove(output_path)
+            # 图像流式写入内存缓冲，超过阈值自动落盘，无需临时文件
+            sink = SpooledSink(max_memory=settings.IMAGE_SPOOL_MAX_MEMORY)
+            try:
+                await generator.generate_image(prompt, sink=sink, user_id=user_id)
+                
+                # 将图像转换为base64
+                image_data = sink.to_base64()
+            finally:
+                sink.release()
             
             # 返回base64编码的图像数据
             return f"data:image/png;base64,{image_data}"
@@ -61,7 +55,33 @@ async def generate_text_to_image(prompt: str, model: str = "flux-t2v") -> str:
         logger.error(f"生成图片失败: {str(e)}")
         raise
 
-async def generate_image_to_image(prompt: str, image_data: str, model: str = "flux-t2v") -> str:
+async def generate_text_to_images(prompt: str, model: str = "flux-t2v", n: int = 1,
+                                  user_id: Optional[int] = None) -> List[str]:
+    """批量文生图，一次执行生成n张候选图像"""
+    try:
+        # 验证提示词不为空
+        if not prompt or prompt.strip() == "":
+            raise Exception("提示词不能为空")
+            
+        if model.lower() == "flux-t2v":
+            results = await generator.generate_batch(prompt, n=n, user_id=user_id)
+            image_urls = []
+            try:
+                for result in results:
+                    image_urls.append(f"data:image/png;base64,{result['sink'].to_base64()}")
+            finally:
+                for result in results:
+                    result["sink"].release()
+            return image_urls
+        else:
+            raise Exception(f"不支持的模型: {model}")
+            
+    except Exception as e:
+        logger.error(f"批量生成图片失败: {str(e)}")
+        raise
+
+async def generate_image_to_image(prompt: str, image_data: str, model: str = "flux-t2v",
+                                  user_id: Optional[int] = None) -> str:
     """图生图功能，支持多种模型"""
     try:
         # 验证提示词不为空
@@ -73,14 +93,10 @@ async def generate_image_to_image(prompt: str, image_data: str, model: str = "fl
             raise Exception("图像数据不能为空")
             
         if model.lower() == "flux-t2v":
-            # 使用新的图像生成服务
-            generator = ImageGenerator(host="101.126.152.137", port=8188)
-            
             # 创建临时文件路径
             temp_dir = Path("temp")
             temp_dir.mkdir(exist_ok=True)
             input_path = temp_dir / f"input_{uuid.uuid4()}.png"
-            output_path = temp_dir / f"output_{uuid.uuid4()}.png"
             
             # 保存上传的图像
             image_bytes = base64.b64decode(image_data)
@@ -90,15 +106,17 @@ async def generate_image_to_image(prompt: str, image_data: str, model: str = "fl
             # 生成图像变体
             # 注意：目前我们的图像生成服务不支持图生图，这里只是模拟
             # 实际应用中需要扩展图像生成服务以支持图生图
-            await generator.generate_image(prompt, output_path)
-            
-            # 将图像转换为base64
-            with open(output_path, "rb") as f:
-                result_image_data = base64.b64encode(f.read()).decode()
+            sink = SpooledSink(max_memory=settings.IMAGE_SPOOL_MAX_MEMORY)
+            try:
+                await generator.generate_image(prompt, sink=sink, user_id=user_id)
+                
+                # 将图像转换为base64
+                result_image_data = sink.to_base64()
+            finally:
+                sink.release()
             
             # 删除临时文件
             os.remove(input_path)
-            os.remove(output_path)
             
             # 返回base64编码的图像数据
             return f"data:image/png;base64,{result_image_data}"
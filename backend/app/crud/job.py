@@ -0,0 +1,48 @@
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+from typing import Any, List, Set
+from ..models.job import JobRecord
+
+# 已确认存在jobs表的数据库连接
+_ready_binds: Set[Any] = set()
+
+def ensure_jobs_table(db: Session):
+    """
+    按需创建jobs表
+
+    main.py 之外的入口（脚本、其他ASGI入口）不会执行 create_all，首次读写任务记录时创建
+    """
+    bind = db.get_bind()
+    if bind not in _ready_binds:
+        JobRecord.__table__.create(bind=bind, checkfirst=True)
+        _ready_binds.add(bind)
+
+def save_job(db: Session, job_id: str, **fields: Any):
+    """创建或更新任务记录"""
+    ensure_jobs_table(db)
+    db_job = db.query(JobRecord).filter(JobRecord.id == job_id).first()
+    if db_job is None:
+        db_job = JobRecord(id=job_id)
+        db.add(db_job)
+    for name, value in fields.items():
+        setattr(db_job, name, value)
+    db.commit()
+    return db_job
+
+def get_unfinished_jobs(db: Session, finished_states: List[str]) -> List[JobRecord]:
+    """获取尚未结束的任务，按创建时间排序"""
+    ensure_jobs_table(db)
+    return (db.query(JobRecord)
+            # NULL NOT IN (...) 不成立，状态缺失的记录按未结束处理
+            .filter(or_(JobRecord.state.is_(None), JobRecord.state.notin_(finished_states)))
+            .order_by(JobRecord.created_at)
+            .all())
+
+def delete_jobs_before(db: Session, finished_before: float) -> int:
+    """删除在指定时间之前结束的任务记录"""
+    ensure_jobs_table(db)
+    count = (db.query(JobRecord)
+             .filter(JobRecord.finished_at.isnot(None), JobRecord.finished_at < finished_before)
+             .delete(synchronize_session=False))
+    db.commit()
+    return count
@@ -3,6 +3,7 @@ import json
 from pathlib import Path
 import sys
 sys.path.append(str(Path(__file__).parent.parent.parent))
+from app.core.config import get_settings
 from app.utils.comfyui_client import ComfyUIClient
 
 async def main():
@@ -102,22 +103,23 @@ async def main():
         }
     }
     
-    # 使用异步上下文管理器，指定服务器地址
-    async with ComfyUIClient(host="223.104.3.2", port=8188) as client:
+    # 使用异步上下文管理器，连接配置中的第一个后端
+    host, port = get_settings().COMFYUI_BACKENDS[0].rsplit(":", 1)
+    async with ComfyUIClient(host=host, port=int(port)) as client:
         try:
             # 提交工作流
             prompt_id = await client.submit_prompt(workflow)
             print(f"工作流已提交，ID: {prompt_id}")
             
-            # 连接WebSocket并等待结果
-            await client.connect_websocket()
-            result = await client.listen_websocket()
+            # 通过WebSocket等待执行完成
+            images = await client.wait_for_images(prompt_id)
             
-            if "image" in result:
+            if images:
                 # 保存生成的图像
+                image_data = await client.get_image(images[0]["filename"], images[0]["subfolder"], images[0]["type"])
                 output_path = Path("output.png")
                 with open(output_path, "wb") as f:
-                    f.write(result["image"])
+                    f.write(image_data)
                 print(f"图像已保存到: {output_path}")
             else:
                 print("生成图像失败")
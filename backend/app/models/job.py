@@ -0,0 +1,18 @@
+from sqlalchemy import Column, Integer, String, Text, Float, ForeignKey
+from ..database import Base
+
+class JobRecord(Base):
+    """异步任务的持久化状态，应用重启后据此接管仍在ComfyUI上执行的prompt"""
+    __tablename__ = "jobs"
+
+    id = Column(String, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    params = Column(Text)  # 生成参数（JSON）
+    priority = Column(String)
+    state = Column(String, index=True, default="queued")
+    error = Column(String, nullable=True)
+    submissions = Column(Text, default="{}")  # 子批次起始序号 -> [[后端, prompt_id], ...]（JSON）
+    predicted_seconds = Column(Float, nullable=True)
+    created_at = Column(Float)
+    started_at = Column(Float, nullable=True)
+    finished_at = Column(Float, nullable=True)
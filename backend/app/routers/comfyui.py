@@ -0,0 +1,63 @@
+from fastapi import APIRouter
+from ..utils.comfyui_pool import get_comfyui_registry
+from ..utils.comfyui_backends import get_backend_pool
+from ..utils.result_cache import get_result_cache
+from ..utils.single_flight import get_single_flight
+from ..services.admission import get_admission_controller
+from ..utils.runtime_model import get_runtime_model
+from ..utils.hedging import get_hedging_policy
+
+router = APIRouter()
+
+@router.get("/pool")
+async def get_pool_stats():
+    """获取ComfyUI连接池复用统计及各后端的预热状态"""
+    stats = get_comfyui_registry().get_stats()
+    for backend, warmup in get_backend_pool().get_warmup_stats().items():
+        stats.setdefault(backend, {}).update(warmup)
+    return stats
+
+@router.get("/backends")
+async def get_backend_stats():
+    """获取各ComfyUI后端的负载信息"""
+    return get_backend_pool().get_stats()
+
+@router.get("/scheduler")
+async def get_scheduler_stats():
+    """获取本地公平队列中按优先级和用户统计的等待请求数"""
+    return get_backend_pool().get_scheduler_stats()
+
+@router.get("/health")
+async def get_backend_health():
+    """获取各ComfyUI后端的熔断状态、错误率和健康检查延迟"""
+    return get_backend_pool().get_health()
+
+@router.get("/cache")
+async def get_cache_stats():
+    """获取生成结果缓存的命中、未命中和淘汰统计"""
+    return get_result_cache().get_stats()
+
+@router.get("/coalescing")
+async def get_coalescing_stats():
+    """获取相同任务合并执行的统计"""
+    return get_single_flight().get_stats()
+
+@router.get("/cancellations")
+async def get_cancellation_stats():
+    """获取因调用方断开、超时或取消而删除/中断的ComfyUI任务数及节省的GPU时间"""
+    return get_comfyui_registry().get_cancel_stats()
+
+@router.get("/admission")
+async def get_admission_stats():
+    """获取准入控制统计：积压、预计排队时间及拒绝次数"""
+    return get_admission_controller().get_stats()
+
+@router.get("/runtime")
+async def get_runtime_stats():
+    """获取执行时间模型：各后端、各模型的固定开销和单位工作量耗时"""
+    return get_runtime_model().get_stats()
+
+@router.get("/hedging")
+async def get_hedging_stats():
+    """获取对冲提交统计：当前阈值、对冲次数、副本胜出次数及预算"""
+    return get_hedging_policy().get_stats()
@@ -1,41 +1,81 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+import asyncio
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from sqlalchemy.orm import Session
 from ..core import security
 from ..schemas import image as image_schemas
 from ..crud import image as image_crud
+from ..core.config import get_settings
+from ..services.admission import get_admission_controller
 from ..database import get_db
 from typing import List
 from ..schemas.user import User
 
 router = APIRouter()
+settings = get_settings()
+
+# 生成期间检查客户端是否断开的间隔（秒）
+DISCONNECT_POLL_INTERVAL = 1
+
+async def cancel_on_disconnect(request: Request, coro):
+    """
+    执行生成任务，客户端在完成前断开时取消任务
+
+    取消会一直传递到等待ComfyUI结果的地方，由它从队列删除或中断对应的prompt，
+    不再为已经离开的用户占用GPU。
+    """
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                raise HTTPException(status_code=499, detail="客户端已断开")
+    finally:
+        task.cancel()
 
 @router.post("/text-to-image", response_model=image_schemas.ImageResponse)
 async def text_to_image(
+    request: Request,
     prompt: image_schemas.ImagePrompt,
     current_user: User = Depends(security.get_current_user),
     db: Session = Depends(get_db)
 ):
-    """文生图接口"""
+    """文生图接口，n>1 时一次执行生成多张候选图像；服务繁忙或超出用户配额时返回503/429"""
+    get_admission_controller().admit(current_user.id, prompt.n, settings.ADMISSION_LATENCY_BUDGET)
     try:
         # 生成图片
-        image_url = await image_crud.generate_text_to_image(
-            prompt=prompt.prompt,
-            model=prompt.model
-        )
+        if prompt.n > 1:
+            image_urls = await cancel_on_disconnect(request, image_crud.generate_text_to_images(
+                prompt=prompt.prompt,
+                model=prompt.model,
+                n=prompt.n,
+                user_id=current_user.id
+            ))
+        else:
+            image_urls = [await cancel_on_disconnect(request, image_crud.generate_text_to_image(
+                prompt=prompt.prompt,
+                model=prompt.model,
+                user_id=current_user.id
+            ))]
         
         # 保存到数据库
-        image = image_crud.create_image(
-            db=db,
-            user_id=current_user.id,
-            prompt=prompt.prompt,
-            image_url=image_url
-        )
+        for image_url in image_urls:
+            image_crud.create_image(
+                db=db,
+                user_id=current_user.id,
+                prompt=prompt.prompt,
+                image_url=image_url
+            )
         
         return image_schemas.ImageResponse(
             success=True,
             message="图片生成成功",
-            image_url=image_url
+            image_url=image_urls[0],
+            image_urls=image_urls
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -44,18 +84,21 @@ async def text_to_image(
 
 @router.post("/image-to-image", response_model=image_schemas.ImageResponse)
 async def image_to_image(
+    request: Request,
     prompt: image_schemas.ImageToImagePrompt,
     current_user: User = Depends(security.get_current_user),
     db: Session = Depends(get_db)
 ):
     """图生图接口"""
+    get_admission_controller().admit(current_user.id, 1, settings.ADMISSION_LATENCY_BUDGET)
     try:
         # 生成图片
-        image_url = await image_crud.generate_image_to_image(
+        image_url = await cancel_on_disconnect(request, image_crud.generate_image_to_image(
             prompt=prompt.prompt,
             image_data=prompt.image_data,
-            model=prompt.model
-        )
+            model=prompt.model,
+            user_id=current_user.id
+        ))
         
         # 保存到数据库
         image = image_crud.create_image(
@@ -71,6 +114,8 @@ async def image_to_image(
             message="图片生成成功",
             image_url=image_url
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -0,0 +1,174 @@
+import asyncio
+import base64
+import json
+from fastapi import APIRouter, Depends, HTTPException, Query, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import Response, StreamingResponse
+from sqlalchemy.orm import Session
+from ..core import security
+from ..core.config import get_settings
+from ..database import get_db
+from ..schemas import job as job_schemas
+from ..schemas.user import User
+from ..services.admission import get_admission_controller
+from ..services.job_manager import Job, JobState, get_job_manager
+
+router = APIRouter()
+settings = get_settings()
+
+# SSE保活注释的发送间隔（秒），避免代理断开空闲连接
+KEEPALIVE_INTERVAL = 15
+
+def get_user_job(job_id: str, current_user: User) -> Job:
+    """获取当前用户的任务，不存在或属于其他用户时返回404"""
+    job = get_job_manager().get(job_id)
+    if job is None or job.user_id != current_user.id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="任务不存在")
+    return job
+
+@router.post("", response_model=job_schemas.JobInfo, status_code=status.HTTP_202_ACCEPTED)
+async def create_job(
+    request: job_schemas.JobCreate,
+    current_user: User = Depends(security.get_current_user)
+):
+    """提交生成任务，立即返回任务ID；预计排队超过 ADMISSION_JOB_LATENCY_BUDGET 或超出用户配额时返回503/429"""
+    get_admission_controller().admit(current_user.id, request.n, settings.ADMISSION_JOB_LATENCY_BUDGET)
+    job = get_job_manager().submit(current_user.id, request.model_dump(exclude={"priority"}), request.priority)
+    return job.to_dict()
+
+@router.get("/{job_id}", response_model=job_schemas.JobInfo)
+async def get_job(
+    job_id: str,
+    current_user: User = Depends(security.get_current_user)
+):
+    """查询任务状态、进度和预计剩余时间"""
+    return get_user_job(job_id, current_user).to_dict()
+
+@router.delete("/{job_id}", response_model=job_schemas.JobInfo)
+async def cancel_job(
+    job_id: str,
+    current_user: User = Depends(security.get_current_user)
+):
+    """取消任务，已提交到ComfyUI的部分会从队列删除或中断；任务已结束时返回409"""
+    job = get_user_job(job_id, current_user)
+    task = job.task
+    if not get_job_manager().cancel(job):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"任务已结束，当前状态: {job.state}")
+    if task:
+        # 等待执行中的任务处理取消，返回最终状态
+        await asyncio.wait({task})
+    return job.to_dict()
+
+@router.get("/{job_id}/events")
+async def stream_job_events(
+    job_id: str,
+    current_user: User = Depends(security.get_current_user)
+):
+    """
+    以Server-Sent Events推送任务进度（进度、排队位置、正在执行的节点等），任务结束后关闭
+
+    每个连接每秒最多推送 JOB_EVENTS_MAX_RATE 次，期间的多次变化只推送最新状态。
+    收到新的采样预览帧时额外推送 preview 事件（data为 {"version", "image"}，image是data URL）。
+    """
+    job = get_user_job(job_id, current_user)
+
+    async def events():
+        sent = 0
+        async for snapshot in job.watch(settings.JOB_EVENTS_MAX_RATE, KEEPALIVE_INTERVAL):
+            if snapshot is None:
+                yield ": keep-alive\n\n"
+                continue
+            yield f"event: {snapshot['state']}\ndata: {json.dumps(snapshot)}\n\n"
+            if (snapshot["preview_version"] or 0) > sent:
+                frame = await job.preview.get()
+                if frame:
+                    sent, image = frame
+                    data = {
+                        "version": sent,
+                        "image": f"data:{job.preview.media_type};base64,{base64.b64encode(image).decode()}",
+                    }
+                    yield f"event: preview\ndata: {json.dumps(data)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@router.websocket("/{job_id}/ws")
+async def job_events_websocket(
+    websocket: WebSocket,
+    job_id: str,
+    token: str = Query(...),
+    db: Session = Depends(get_db)
+):
+    """
+    WebSocket版本的进度推送，浏览器无法为WebSocket设置请求头，令牌通过 token 查询参数传递
+
+    状态快照以JSON文本消息发送，采样预览帧以二进制消息发送（格式见 PREVIEW_FORMAT）。
+    """
+    try:
+        current_user = await security.get_current_user(token=token, db=db)
+        job = get_user_job(job_id, current_user)
+    except HTTPException as e:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=str(e.detail))
+        return
+    await websocket.accept()
+    try:
+        sent = 0
+        async for snapshot in job.watch(settings.JOB_EVENTS_MAX_RATE, KEEPALIVE_INTERVAL):
+            if snapshot is None:
+                continue
+            await websocket.send_json(snapshot)
+            if (snapshot["preview_version"] or 0) > sent:
+                frame = await job.preview.get()
+                if frame:
+                    sent, image = frame
+                    await websocket.send_bytes(image)
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+
+@router.get("/{job_id}/preview")
+async def get_job_preview(
+    job_id: str,
+    current_user: User = Depends(security.get_current_user)
+):
+    """获取任务最新的采样预览帧，还没有预览帧或任务已结束时返回404"""
+    job = get_user_job(job_id, current_user)
+    frame = await job.preview.get()
+    if frame is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="暂无预览")
+    version, image = frame
+    return Response(content=image, media_type=job.preview.media_type,
+                    headers={"Cache-Control": "no-store", "X-Preview-Version": str(version)})
+
+def get_finished_job(job_id: str, current_user: User) -> Job:
+    job = get_user_job(job_id, current_user)
+    if job.state != JobState.SUCCEEDED:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=job.error if job.finished else f"任务尚未完成，当前状态: {job.state}"
+        )
+    return job
+
+@router.get("/{job_id}/result", response_model=job_schemas.JobResult)
+async def get_job_result(
+    job_id: str,
+    current_user: User = Depends(security.get_current_user)
+):
+    """获取任务生成的全部图像"""
+    job = get_finished_job(job_id, current_user)
+    return job_schemas.JobResult(
+        id=job.id,
+        images=[f"data:image/png;base64,{result['sink'].to_base64()}" for result in job.sorted_results()]
+    )
+
+@router.get("/{job_id}/result/{index}")
+async def get_job_image(
+    job_id: str,
+    index: int,
+    current_user: User = Depends(security.get_current_user)
+):
+    """以PNG流的形式下载任务的第index张图像"""
+    job = get_finished_job(job_id, current_user)
+    results = job.sorted_results()
+    if not 0 <= index < len(results):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="图像不存在")
+    return StreamingResponse(results[index]["sink"].iter_chunks(), media_type="image/png")
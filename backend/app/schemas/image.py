@@ -1,9 +1,11 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
+from typing import List
 
 class ImagePrompt(BaseModel):
     prompt: str
     model: str = "dall-e"  # 默认使用 DALL-E 模型
+    n: int = Field(1, ge=1, le=64)  # 生成的图像数量，大批量自动拆分到多个后端并发执行
 
 class ImageToImagePrompt(BaseModel):
     prompt: str
@@ -11,7 +13,10 @@ class ImageToImagePrompt(BaseModel):
     model: str = "dall-e"  # 默认使用 DALL-E 模型
 
 class ImageResponse(BaseModel):
-    url: str
+    success: bool = True
+    message: str = ""
+    image_url: str
+    image_urls: List[str] = []  # 批量生成时的全部图像，第一张与 image_url 相同
 
 class ImageHistory(BaseModel):
     id: int
@@ -0,0 +1,35 @@
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
+
+class JobCreate(BaseModel):
+    prompt: str = Field(..., min_length=1)
+    n: int = Field(1, ge=1, le=64)  # 生成的图像数量
+    width: int = Field(1024, ge=64, le=2048)
+    height: int = Field(1024, ge=64, le=2048)
+    seed: int = Field(782619153058034, ge=0)
+    steps: int = Field(20, ge=1, le=100)
+    # 优先级类别，不指定时超过一个子批次的任务按 bulk 处理
+    priority: Optional[Literal["interactive", "bulk"]] = None
+
+class JobInfo(BaseModel):
+    id: str
+    state: str  # queued / running / succeeded / failed / cancelled
+    progress: float
+    eta: Optional[float] = None  # 预计剩余秒数
+    predicted_seconds: Optional[float] = None  # 提交时预测的执行秒数
+    n: int
+    priority: str  # interactive / bulk
+    completed: int  # 已完成的图像数
+    queue_position: Optional[int] = None  # 前面还有多少个任务（执行中为等待后端名额的位置），0表示下一个执行
+    phase: Optional[str] = None  # queued / submitted / executing
+    current_node: Optional[str] = None
+    class_type: Optional[str] = None  # 正在执行的节点类型
+    preview_version: Optional[int] = None  # 最新预览帧的版本号，通过 /preview 获取
+    error: Optional[str] = None
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+class JobResult(BaseModel):
+    id: str
+    images: List[str]  # base64编码的图像（data URL）
@@ -0,0 +1,173 @@
+import logging
+import math
+import time
+from functools import lru_cache
+from typing import Dict, Any
+from fastapi import HTTPException, status
+from app.core.config import get_settings
+from app.services.job_manager import get_job_manager
+from app.utils.comfyui_backends import ComfyUIBackendPool, get_backend_pool
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(HTTPException):
+    """请求被准入控制拒绝，带 Retry-After 响应头"""
+
+    def __init__(self, status_code: int, detail: str, retry_after: float):
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(status_code=status_code, detail=detail, headers={"Retry-After": str(self.retry_after)})
+
+
+class TokenBucket:
+    """令牌桶：按固定速率补充令牌，允许不超过容量的突发"""
+
+    def __init__(self, rate: float, capacity: float):
+        """
+        Args:
+            rate: 每秒补充的令牌数
+            capacity: 桶容量
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def take(self, cost: float) -> float:
+        """
+        取出cost个令牌
+
+        Returns:
+            float: 0表示成功；否则为令牌足够前需要等待的秒数（不扣除令牌）
+        """
+        self._refill()
+        cost = min(cost, self.capacity)
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate if self.rate > 0 else math.inf
+
+    @property
+    def idle(self) -> bool:
+        """桶已经补满，丢弃后重建没有区别"""
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+class AdmissionController:
+    """准入控制
+
+    按积压的prompt数（任务队列 + 后端池公平队列 + 各后端队列和执行中的任务）
+    乘以平均执行时间、除以健康后端数估算新请求的排队时间，超过延迟预算时直接返回503，
+    而不是让请求在队列里等到超时；Retry-After 为积压降到预算以内所需的时间。
+    每个用户另有按图像数计费的令牌桶，超出时返回429，防止单个用户占满共享算力。
+    """
+
+    def __init__(self, pool: ComfyUIBackendPool, user_rate: float = 0.5, user_burst: float = 64,
+                 default_prompt_seconds: float = 20):
+        """
+        Args:
+            pool: ComfyUI后端池
+            user_rate: 每个用户每秒补充的图像配额
+            user_burst: 每个用户的配额上限
+            default_prompt_seconds: 还没有执行记录时单个prompt的预计执行时间（秒）
+        """
+        self.pool = pool
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.default_prompt_seconds = default_prompt_seconds
+        self.buckets: Dict[int, TokenBucket] = {}
+        self.admitted = 0
+        self.rejected_overload = 0
+        self.rejected_rate = 0
+
+    @classmethod
+    def from_settings(cls) -> "AdmissionController":
+        settings = get_settings()
+        return cls(get_backend_pool(), settings.USER_RATE_LIMIT, settings.USER_RATE_BURST,
+                   settings.ADMISSION_DEFAULT_PROMPT_SECONDS)
+
+    def prompt_seconds(self) -> float:
+        """各后端最近的平均prompt执行时间"""
+        durations = []
+        for backend in self.pool.backends:
+            stream = backend.registry.event_streams.get(backend.key)
+            if stream and stream.avg_duration is not None:
+                durations.append(stream.avg_duration)
+        return sum(durations) / len(durations) if durations else self.default_prompt_seconds
+
+    def backlog(self) -> int:
+        """尚未执行完的prompt数"""
+        job_manager = get_job_manager()
+        queued_jobs = sum(job.total_parts for job in job_manager.queue)
+        return queued_jobs + len(self.pool.waiting) + sum(backend.load for backend in self.pool.candidates())
+
+    def estimate_wait(self) -> float:
+        """新请求开始执行前预计需要等待的秒数，没有健康后端时为无穷大"""
+        backends = len(self.pool.candidates())
+        if not backends:
+            return math.inf
+        return self.backlog() * self.prompt_seconds() / backends
+
+    def _recovery_seconds(self) -> float:
+        """熔断的后端最快多久后重新试探"""
+        remaining = [
+            backend.health.recovery_timeout - (time.monotonic() - backend.health.opened_at)
+            for backend in self.pool.backends if backend.health.opened_at is not None
+        ]
+        return max(min(remaining), 0) + self.pool.refresh_interval if remaining else self.pool.refresh_interval
+
+    def admit(self, user_id: int, cost: float = 1, latency_budget: float = 60):
+        """
+        检查是否接受请求，接受时扣除用户配额
+
+        Args:
+            user_id: 提交请求的用户
+            cost: 请求生成的图像数
+            latency_budget: 允许的最长预计排队时间（秒）
+
+        Raises:
+            AdmissionRejected: 503（积压超过预算或没有可用后端）或 429（用户配额不足）
+        """
+        wait = self.estimate_wait()
+        if math.isinf(wait):
+            self.rejected_overload += 1
+            raise AdmissionRejected(status.HTTP_503_SERVICE_UNAVAILABLE, "没有可用的ComfyUI后端",
+                                    self._recovery_seconds())
+        if wait > latency_budget:
+            self.rejected_overload += 1
+            logger.warning(f"预计排队 {wait:.0f} 秒，超过预算 {latency_budget:.0f} 秒，拒绝请求")
+            raise AdmissionRejected(status.HTTP_503_SERVICE_UNAVAILABLE,
+                                    f"服务繁忙，预计排队 {wait:.0f} 秒", wait - latency_budget)
+
+        self.buckets = {uid: bucket for uid, bucket in self.buckets.items() if not bucket.idle}
+        bucket = self.buckets.get(user_id)
+        if bucket is None:
+            bucket = self.buckets[user_id] = TokenBucket(self.user_rate, self.user_burst)
+        retry_after = bucket.take(cost)
+        if retry_after:
+            self.rejected_rate += 1
+            raise AdmissionRejected(status.HTTP_429_TOO_MANY_REQUESTS, "请求过于频繁，请稍后再试", retry_after)
+        self.admitted += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        wait = self.estimate_wait()
+        return {
+            "admitted": self.admitted,
+            "rejected_overload": self.rejected_overload,
+            "rejected_rate_limit": self.rejected_rate,
+            "backlog": self.backlog(),
+            "prompt_seconds": round(self.prompt_seconds(), 2),
+            "estimated_wait": None if math.isinf(wait) else round(wait, 1),
+            "limited_users": len(self.buckets),
+        }
+
+
+@lru_cache()
+def get_admission_controller() -> AdmissionController:
+    return AdmissionController.from_settings()
@@ -1,74 +1,103 @@
-import json
+import asyncio
+import time
 from pathlib import Path
-from typing import Optional, Dict, Any
-from app.utils.comfyui_client import ComfyUIClient
+from typing import Optional, Dict, Any, List, Callable, AsyncIterator, Tuple
+from app.core.config import get_settings
+from app.utils.cache_affinity import cache_signature
+from app.utils.comfyui_backends import ComfyUIBackend, ComfyUIBackendPool, get_backend_pool
+from app.utils.comfyui_client import BackendUnavailableError
+from app.utils.fair_queue import Priority
+from app.utils.hedging import get_hedging_policy
+from app.utils.image_sinks import ImageSink, FileSink, SpooledSink, TeeSink
+from app.utils.result_cache import ResultCache, get_result_cache
+from app.utils.runtime_model import get_runtime_model
+from app.utils.single_flight import get_single_flight
+from app.utils.workflow_templates import get_workflow_registry
+
+# ComfyUI种子的取值范围
+SEED_LIMIT = 2 ** 64
+
+
+class _Race:
+    """同一个工作流的主请求和对冲副本"""
+
+    def __init__(self):
+        # 最先开始执行的一方，只转发它的执行事件
+        self.leader: Optional["_Attempt"] = None
+        self.result: Optional[List[SpooledSink]] = None
+
+
+class _Attempt:
+    """主请求或对冲副本的一次提交"""
+
+    def __init__(self, race: _Race, hedge: bool = False):
+        self.race = race
+        self.hedge = hedge
+        self.backend: Optional[str] = None
+        self.submitted = asyncio.Event()
+        self.started = asyncio.Event()
+
+    def mark_started(self):
+        if self.race.leader is None:
+            self.race.leader = self
+        self.started.set()
+
+    def forward(self) -> bool:
+        """是否转发本次提交的执行事件：有一方开始执行前只转发主请求的"""
+        leader = self.race.leader
+        return leader is self if leader else not self.hedge
+
 
 class ImageGenerator:
     """图像生成服务类"""
     
-    def __init__(self, host: str = "223.104.3.2", port: int = 8188):
+    def __init__(self, host: Optional[str] = None, port: int = 8188):
         """
         初始化图像生成器
         
         Args:
-            host: ComfyUI服务器地址
+            host: ComfyUI服务器地址，为None时按负载在 COMFYUI_BACKENDS 中路由
             port: ComfyUI服务器端口
         """
         self.host = host
         self.port = port
-        self.workflow_path = Path(__file__).parent.parent / "config" / "workflows" / "txt2img.json"
+        self.settings = get_settings()
+        if host is None:
+            self.backend_pool = get_backend_pool()
+        else:
+            self.backend_pool = ComfyUIBackendPool(
+                [ComfyUIBackend(host, port, self.settings.COMFYUI_BACKEND_CONCURRENCY)]
+            )
+        self.templates = get_workflow_registry()
+        self.cache = get_result_cache() if self.settings.RESULT_CACHE_ENABLED else None
+        # 进程内共享，不同调用方提交的相同工作流只执行一次
+        self.flights = get_single_flight()
+        # 按已完成任务学习的执行时间模型，用于调度代价、超时和ETA
+        self.runtime = get_runtime_model()
+        # 后端迟迟不开始执行时在另一个后端上提交副本
+        self.hedging = get_hedging_policy()
+        self.workflow_name = "txt2img"
         
-    async def generate_image(self, prompt: str, output_path: Optional[Path] = None) -> Path:
+    async def generate_image(self, prompt: str, output_path: Optional[Path] = None,
+                             sink: Optional[ImageSink] = None, user_id: Optional[int] = None):
         """
         生成图像
         
         Args:
             prompt: 图像生成提示词
             output_path: 输出路径，如果为None则使用默认路径
+            sink: 图像写入目标，指定时图像流式写入sink而不是output_path
+            user_id: 请求所属的用户，后端满载时按用户公平排队
             
         Returns:
-            Path: 生成的图像路径
+            Path: 生成的图像路径；指定sink时返回该sink
         """
-        # 加载工作流配置
-        with open(self.workflow_path) as f:
-            workflow = json.load(f)
-            
-        # 设置提示词
-        inputs = {
-            "6": {  # CLIPTextEncode节点
-                "inputs": {
-                    "text": prompt
-                }
-            }
-        }
+        # 模板只解析一次，这里只复制被修改的节点
+        workflow = self.templates.render(self.workflow_name, prompt=prompt)
         
         print(f"开始生成图像，提示词: {prompt}")
         
-        # 使用异步上下文管理器
-        async with ComfyUIClient(host=self.host, port=self.port) as client:
-            try:
-                # 提交工作流
-                prompt_id = await client.submit_prompt(workflow, inputs)
-                print(f"工作流已提交，ID: {prompt_id}")
-                
-                # 连接WebSocket并等待结果
-                await client.connect_websocket()
-                result = await client.listen_websocket()
-                
-                if "image" in result:
-                    # 保存生成的图像
-                    if output_path is None:
-                        output_path = Path("output.png")
-                    with open(output_path, "wb") as f:
-                        f.write(result["image"])
-                    print(f"图像已保存到: {output_path}")
-                    return output_path
-                else:
-                    raise Exception("生成图像失败")
-                    
-            except Exception as e:
-                print(f"发生错误: {str(e)}")
-                raise
+        return await self._generate(workflow, output_path, sink, user_id)
                 
     async def generate_image_with_params(self, 
                                        prompt: str,
@@ -76,7 +105,9 @@ class ImageGenerator:
                                        height: int = 1024,
                                        seed: int = 782619153058034,
                                        steps: int = 20,
-                                       output_path: Optional[Path] = None) -> Path:
+                                       output_path: Optional[Path] = None,
+                                       sink: Optional[ImageSink] = None,
+                                       user_id: Optional[int] = None):
         """
         使用自定义参数生成图像
         
@@ -87,65 +118,456 @@ class ImageGenerator:
             seed: 随机种子
             steps: 生成步数
             output_path: 输出路径
+            sink: 图像写入目标，指定时图像流式写入sink而不是output_path
+            user_id: 请求所属的用户，后端满载时按用户公平排队
             
         Returns:
-            Path: 生成的图像路径
+            Path: 生成的图像路径；指定sink时返回该sink
         """
-        # 加载工作流配置
-        with open(self.workflow_path) as f:
-            workflow = json.load(f)
-            
         # 设置自定义参数
-        inputs = {
-            "5": {  # EmptyLatentImage节点
-                "inputs": {
-                    "width": width,
-                    "height": height,
-                    "batch_size": 1
-                }
-            },
-            "6": {  # CLIPTextEncode节点
-                "inputs": {
-                    "text": prompt
-                }
-            },
-            "17": {  # BasicScheduler节点
-                "inputs": {
-                    "steps": steps
-                }
-            },
-            "25": {  # RandomNoise节点
-                "inputs": {
-                    "noise_seed": seed
-                }
-            }
-        }
+        workflow = self.templates.render(
+            self.workflow_name,
+            prompt=prompt,
+            width=width,
+            height=height,
+            batch_size=1,
+            seed=seed,
+            steps=steps,
+        )
         
         print(f"开始生成图像，提示词: {prompt}")
         print(f"参数: 宽度={width}, 高度={height}, 步数={steps}, 种子={seed}")
         
-        # 使用异步上下文管理器
-        async with ComfyUIClient(host=self.host, port=self.port) as client:
+        return await self._generate(workflow, output_path, sink, user_id)
+
+    async def generate_batch(self,
+                             prompt: str,
+                             n: int = 4,
+                             width: int = 1024,
+                             height: int = 1024,
+                             seed: int = 782619153058034,
+                             steps: int = 20,
+                             sink_factory: Optional[Callable[[], ImageSink]] = None,
+                             on_event: Optional[Callable[[Dict[str, Any]], None]] = None,
+                             user_id: Optional[int] = None,
+                             priority: str = Priority.INTERACTIVE) -> List[Dict[str, Any]]:
+        """
+        生成多张候选图像
+
+        通过 EmptyLatentImage 的 batch_size 让GPU并行生成，模型和提示词编码只计算一次；
+        数量超过 COMFYUI_MAX_BATCH_SIZE 时拆分成多个子批次并发分发到不同后端（见 iter_batch）。
+        
+        Args:
+            prompt: 图像生成提示词
+            n: 生成的图像数量
+            width: 图像宽度
+            height: 图像高度
+            seed: 随机种子
+            steps: 生成步数
+            sink_factory: 为每张图像创建写入目标，默认写入内存缓冲（SpooledSink）
+            on_event: 接收执行过程事件（scheduled、submitted 及ComfyUI的 progress、executing 等消息）
+            user_id: 请求所属的用户，后端满载时按用户公平排队
+            priority: 优先级类别（interactive / bulk）
+            
+        Returns:
+            List[Dict]: 按序号排列的 {"index", "sink", "seed", "batch_index"}
+        """
+        results = []
+        async for part in self.iter_batch(prompt, n, width, height, seed, steps, sink_factory, on_event,
+                                          user_id, priority):
+            results.extend(part)
+        return sorted(results, key=lambda result: result["index"])
+
+    async def iter_batch(self,
+                         prompt: str,
+                         n: int = 4,
+                         width: int = 1024,
+                         height: int = 1024,
+                         seed: int = 782619153058034,
+                         steps: int = 20,
+                         sink_factory: Optional[Callable[[], ImageSink]] = None,
+                         on_event: Optional[Callable[[Dict[str, Any]], None]] = None,
+                         user_id: Optional[int] = None,
+                         priority: str = Priority.INTERACTIVE,
+                         submissions: Optional[Dict[int, List[Tuple[str, str]]]] = None
+                         ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        把大批量任务拆分为子批次并发执行，按完成顺序逐个返回子批次的结果
+
+        子批次通过后端池按负载分发，多个GPU同时工作；某个子批次失败时换一个后端重试
+        （最多 COMFYUI_SUBBATCH_RETRIES 次）。第k个子批次使用种子 seed+k，
+        ComfyUI用同一个种子为整个batch生成噪声，每张图像由 (seed, batch_index) 唯一确定。
+        停止迭代时取消尚未完成的子批次。
+        submitted 事件的data中带有子批次的起始序号 part。
+        
+        Args:
+            参数同 generate_batch
+            submissions: 子批次起始序号 -> 之前提交过的 [(后端, prompt_id)]，应用重启后用于接管而不是重新生成
+            
+        Yields:
+            List[Dict]: 一个子批次的 {"index", "sink", "seed", "batch_index"}，index为在整个请求中的序号
+        """
+        if sink_factory is None:
+            sink_factory = lambda: SpooledSink(max_memory=self.settings.IMAGE_SPOOL_MAX_MEMORY)
+        
+        async def run(start: int, size: int, sub_seed: int) -> List[Dict[str, Any]]:
+            workflow = self.templates.render(
+                self.workflow_name,
+                prompt=prompt,
+                width=width,
+                height=height,
+                batch_size=size,
+                seed=sub_seed,
+                steps=steps,
+            )
+            sinks = [sink_factory() for _ in range(size)]
+            
+            def on_part_event(event: Dict[str, Any]):
+                if event.get("type") == "submitted":
+                    event = {**event, "data": {**event["data"], "part": start}}
+                on_event(event)
+            
+            await self._produce(workflow, sinks, retries=self.settings.COMFYUI_SUBBATCH_RETRIES,
+                                on_event=on_part_event if on_event else None, user_id=user_id, priority=priority,
+                                submissions=(submissions or {}).get(start))
+            print(f"子批次完成: 第 {start + 1}-{start + size} 张")
+            return [
+                {"index": start + i, "sink": sink, "seed": sub_seed, "batch_index": i}
+                for i, sink in enumerate(sinks)
+            ]
+        
+        parts = self.split_batch(n, seed)
+        print(f"开始批量生成图像，提示词: {prompt}，数量: {n}，子批次: {len(parts)}")
+        tasks = [asyncio.ensure_future(run(*part)) for part in parts]
+        try:
+            for future in asyncio.as_completed(tasks):
+                yield await future
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def predict_batch(self, prompt: str, n: int = 4, width: int = 1024, height: int = 1024,
+                      seed: int = 782619153058034, steps: int = 20, **_) -> List[float]:
+        """预测 iter_batch 各子批次的执行秒数"""
+        return [
+            self.runtime.predict(self.templates.render(
+                self.workflow_name, prompt=prompt, width=width, height=height,
+                batch_size=size, seed=sub_seed, steps=steps,
+            ))
+            for _, size, sub_seed in self.split_batch(n, seed)
+        ]
+
+    def split_batch(self, n: int, seed: int) -> List[Tuple[int, int, int]]:
+        """拆分为 (起始序号, 数量, 种子) 的子批次"""
+        size = max(1, self.settings.COMFYUI_MAX_BATCH_SIZE)
+        return [
+            (start, min(size, n - start), (seed + k) % SEED_LIMIT)
+            for k, start in enumerate(range(0, n, size))
+        ]
+
+    async def _generate(self, workflow: Dict[str, Any], output_path: Optional[Path],
+                        sink: Optional[ImageSink] = None, user_id: Optional[int] = None):
+        """执行工作流，把第一张图像写入sink或output_path"""
+        if output_path is None and sink is None:
+            output_path = Path("output.png")
+        await self._produce(workflow, [FileSink(output_path) if sink is None else sink], user_id=user_id)
+        if sink is None:
+            print(f"图像已保存到: {output_path}")
+            return output_path
+        return sink
+
+    async def _produce(self, workflow: Dict[str, Any], targets: List[ImageSink], retries: int = 0,
+                       on_event: Optional[Callable[[Dict[str, Any]], None]] = None,
+                       user_id: Optional[int] = None,
+                       priority: str = Priority.INTERACTIVE,
+                       submissions: Optional[List[Tuple[str, str]]] = None) -> List[ImageSink]:
+        """
+        执行工作流，把输出的前 len(targets) 张图像依次写入targets
+
+        相同的工作流已经生成过时直接返回缓存的结果，不提交到后端；
+        相同的工作流正在排队或执行时等待同一次执行的结果。
+        submissions 为之前（应用重启前）提交过的 (后端, prompt_id)，优先接管而不是重新生成。
+        """
+        key = ResultCache.key_for(workflow)
+        chunk_size = self.settings.COMFYUI_DOWNLOAD_CHUNK_SIZE
+        if self.cache:
+            cached = await self.cache.get(key)
+            if cached and len(cached) >= len(targets):
+                print(f"命中结果缓存: {key[:12]}")
+                for path, target in zip(cached, targets):
+                    await self.cache.deliver(path, target, chunk_size)
+                return targets
+        
+        if submissions:
+            factory = lambda: self._resume_or_execute(workflow, key, submissions, retries, user_id, priority)
+        else:
+            factory = lambda: self._execute(workflow, key, retries, user_id, priority, self.runtime.predict(workflow))
+        async with self.flights.join(key, factory, release=self._release, listener=on_event) as buffers:
+            if len(buffers) < len(targets):
+                raise Exception(f"生成图像数量不足：需要 {len(targets)} 张，实际 {len(buffers)} 张")
+            # 共享的图像数据复制到各调用方自己的目标
+            for buffer, target in zip(buffers, targets):
+                try:
+                    for chunk in buffer.iter_chunks(chunk_size):
+                        target.write(chunk)
+                finally:
+                    target.close()
+        return targets
+
+    @staticmethod
+    def _release(buffers: List[SpooledSink]):
+        for buffer in buffers:
+            buffer.release()
+
+    async def _resume_or_execute(self, workflow: Dict[str, Any], key: str, submissions: List[Tuple[str, str]],
+                                 retries: int = 0, user_id: Optional[int] = None,
+                                 priority: str = Priority.INTERACTIVE) -> List[SpooledSink]:
+        """依次尝试接管之前提交的prompt（后端, prompt_id），都已丢失时重新执行"""
+        for backend_key, prompt_id in submissions:
+            buffers = await self._reattach(workflow, key, backend_key, prompt_id)
+            if buffers is not None:
+                return buffers
+        return await self._execute(workflow, key, retries, user_id, priority, self.runtime.predict(workflow))
+
+    async def _reattach(self, workflow: Dict[str, Any], key: str, backend_key: str,
+                        prompt_id: str) -> Optional[List[SpooledSink]]:
+        """
+        接管应用重启前提交的prompt：已完成的从 /history 取回结果，仍在执行的继续等待
+
+        Returns:
+            Optional[List[SpooledSink]]: prompt已丢失、执行失败或没有输出时返回None
+        """
+        backend = next((backend for backend in self.backend_pool.backends if backend.key == backend_key), None)
+        if backend is None:
+            return None
+        async with backend.client() as client:
             try:
-                # 提交工作流
-                prompt_id = await client.submit_prompt(workflow, inputs)
-                print(f"工作流已提交，ID: {prompt_id}")
-                
-                # 连接WebSocket并等待结果
-                await client.connect_websocket()
-                result = await client.listen_websocket()
-                
-                if "image" in result:
-                    # 保存生成的图像
-                    if output_path is None:
-                        output_path = Path("output.png")
-                    with open(output_path, "wb") as f:
-                        f.write(result["image"])
-                    print(f"图像已保存到: {output_path}")
-                    return output_path
-                else:
-                    raise Exception("生成图像失败")
-                    
+                if await client.reattach(prompt_id) is None:
+                    return None
+                print(f"重新接管ComfyUI任务: {prompt_id}")
+                self.flights.emit(key, {"type": "submitted", "data": {"prompt_id": prompt_id, "backend": backend_key}})
+                inactivity_timeout, execution_timeout = self.runtime.timeouts(workflow, backend_key)
+                # 收不到接管的prompt的执行消息，它一直处于“未开始”状态，排队期限要包含执行时间
+                images = await client.wait_for_images(
+                    prompt_id, inactivity_timeout, execution_timeout=execution_timeout,
+                    on_event=lambda event: self.flights.emit(key, self._annotate(workflow, event)),
+                    queue_timeout=self.settings.COMFYUI_QUEUE_TIMEOUT + execution_timeout,
+                )
+                if not images:
+                    client.release_prompt(prompt_id)
+                    return None
+                return await self._download(client, images, key, prompt_id)
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
-                print(f"发生错误: {str(e)}")
-                raise 
\ No newline at end of file
+                print(f"接管ComfyUI任务失败 {prompt_id}: {str(e)}，重新提交")
+                return None
+
+    async def _execute(self, workflow: Dict[str, Any], key: str, retries: int = 0,
+                       user_id: Optional[int] = None, priority: str = Priority.INTERACTIVE,
+                       cost: float = 1) -> List[SpooledSink]:
+        """
+        选择负载最低的健康后端执行工作流，返回缓存了各张图像数据的buffer
+
+        后端都满载时在后端池的公平队列中等待，排队位置以 scheduled 事件通知等待者。
+        后端不可达（提交时连接失败或执行中被熔断）时换一个后端重新提交，
+        所有后端都不可用时抛出 NoBackendAvailableError。
+        启用对冲时，提交后超过对冲阈值仍未开始执行，在另一个后端上提交副本，先完成的胜出。
+        
+        Args:
+            retries: 执行失败（超时、执行出错）时换其他后端重试的次数
+            user_id: 请求所属的用户
+            priority: 优先级类别
+            cost: 预测的执行秒数，作为公平排队的代价
+        """
+        failed = []
+        if not self.hedging.enabled:
+            return await self._execute_once(workflow, key, retries, user_id, priority, cost, failed)
+        self.hedging.record_request()
+        race = _Race()
+        primary = _Attempt(race)
+        tasks = {asyncio.ensure_future(self._execute_once(workflow, key, retries, user_id, priority, cost,
+                                                          failed, primary)): primary}
+        try:
+            return await self._hedge(tasks, workflow, key, user_id, priority, cost, failed)
+        finally:
+            for task in tasks:
+                task.cancel()
+            for task in tasks:
+                try:
+                    result = await task
+                except BaseException:
+                    continue
+                # 输家在取消前恰好完成
+                if result is not race.result:
+                    self._release(result)
+
+    async def _hedge(self, tasks: Dict[asyncio.Future, "_Attempt"], workflow: Dict[str, Any], key: str,
+                     user_id: Optional[int], priority: str, cost: float, failed: List[str]) -> List[SpooledSink]:
+        """等待主请求，超过阈值仍未开始执行时发起对冲，返回先成功的结果"""
+        (task, primary), = tasks.items()
+        race = primary.race
+        # 在后端池中排队不算后端卡住，从提交到ComfyUI开始计时
+        waiter = asyncio.ensure_future(primary.submitted.wait())
+        try:
+            await asyncio.wait({task, waiter}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            waiter.cancel()
+        if not task.done():
+            delay = self.hedging.delay()
+            waiter = asyncio.ensure_future(primary.started.wait())
+            try:
+                await asyncio.wait({task, waiter}, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                waiter.cancel()
+            exclude = failed + [primary.backend]
+            if not task.done() and not primary.started.is_set() and self.backend_pool.candidates(exclude) \
+                    and self.hedging.try_hedge():
+                print(f"后端 {primary.backend} 超过 {delay:.1f} 秒未开始执行，在其他后端提交副本")
+                hedge = _Attempt(race, hedge=True)
+                tasks[asyncio.ensure_future(self._execute_once(workflow, key, 0, user_id, priority, cost,
+                                                                list(exclude), hedge))] = hedge
+
+        error = None
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for finished in done:
+                if finished.cancelled():
+                    continue
+                if finished.exception() is not None:
+                    # 对冲副本失败不影响主请求；都失败时抛出主请求的错误
+                    if tasks[finished] is primary or error is None:
+                        error = finished.exception()
+                    continue
+                race.result = finished.result()
+                if len(tasks) > 1:
+                    self.hedging.record_win(tasks[finished].hedge)
+                return race.result
+        raise error
+
+    async def _execute_once(self, workflow: Dict[str, Any], key: str, retries: int,
+                            user_id: Optional[int], priority: str, cost: float, failed: List[str],
+                            attempt: Optional["_Attempt"] = None) -> List[SpooledSink]:
+        """在一个后端上执行工作流，失败时按 retries 换后端重试；failed 记录不可用的后端"""
+        signature = cache_signature(workflow)
+        on_position = None
+        if attempt is None or not attempt.hedge:
+            on_position = lambda position: self.flights.emit(
+                key, {"type": "scheduled", "data": {"key": key, "position": position}})
+        while True:
+            assignment = {"model_load": False}
+            async with self.backend_pool.acquire(exclude=failed, user_id=user_id, priority=priority,
+                                                 cost=cost, on_position=on_position, signature=signature,
+                                                 on_assigned=lambda model_load: assignment.update(
+                                                     model_load=model_load)) as backend:
+                async with backend.client() as client:
+                    try:
+                        # 后端未预热，或所需模型可能不在显存中时，开始执行后要先加载模型
+                        warm = self.backend_pool.is_warm(backend) and not assignment["model_load"]
+                        result = await self._run_workflow(client, workflow, key, warm, attempt)
+                        backend.record_success()
+                        return result
+                    except BackendUnavailableError as e:
+                        print(f"后端 {backend.key} 不可用，尝试其他后端: {str(e)}")
+                        backend.record_failure()
+                        failed.append(backend.key)
+                        continue
+                    except Exception as e:
+                        if isinstance(e, asyncio.TimeoutError):
+                            print(f"后端 {backend.key} 执行超时")
+                            backend.record_failure()
+                        else:
+                            print(f"发生错误: {str(e)}")
+                        if retries <= 0 or not self.backend_pool.candidates(failed + [backend.key]):
+                            raise
+                        retries -= 1
+                        failed.append(backend.key)
+                        print(f"后端 {backend.key} 执行失败，在其他后端重试")
+
+    @staticmethod
+    def _annotate(workflow: Dict[str, Any], event: Dict[str, Any]) -> Dict[str, Any]:
+        """给带节点ID的消息补充节点的 class_type，便于客户端显示正在执行的步骤"""
+        data = event.get("data", {})
+        node = workflow.get(data.get("node") or "")
+        if node is None:
+            return event
+        return {**event, "data": {**data, "class_type": node["class_type"]}}
+
+    async def _run_workflow(self, client, workflow: Dict[str, Any], key: str,
+                            warm: bool = True, attempt: Optional["_Attempt"] = None) -> List[SpooledSink]:
+        """
+        提交工作流，通过共享WebSocket等待完成并把各张图像流式写入buffer（同时写入结果缓存）
+
+        Args:
+            warm: 后端是否已预热且已加载所需模型；否则开始执行后要先加载模型，超时相应放宽
+            attempt: 启用对冲时本次提交的状态，只转发领先一方的执行事件
+        """
+        output_nodes = None
+        if self.settings.COMFYUI_WS_OUTPUT:
+            # 图像通过WebSocket直接回传，省去服务器写盘和 /view 下载
+            workflow, output_nodes = await client.apply_websocket_output(workflow)
+        
+        prompt_id = await client.submit_prompt(workflow)
+        if not prompt_id:
+            raise Exception("提交工作流失败")
+        print(f"工作流已提交，ID: {prompt_id}")
+        backend = f"{client.host}:{client.port}"
+        submitted_at = time.monotonic()
+        if attempt:
+            attempt.backend = backend
+            attempt.submitted.set()
+        self.flights.emit(key, {"type": "submitted", "data": {"prompt_id": prompt_id, "backend": backend}})
+        
+        # 超时按预测的执行时间设置：大图、多步数的任务允许更久，卡住的小任务更早放弃
+        inactivity_timeout, execution_timeout = self.runtime.timeouts(workflow, backend)
+        if not warm:
+            inactivity_timeout = max(inactivity_timeout, self.settings.COMFYUI_WARMUP_TIMEOUT)
+            execution_timeout += self.settings.COMFYUI_WARMUP_TIMEOUT
+        started = {}
+        
+        def on_event(event: Dict[str, Any]):
+            if event.get("type") in ("execution_start", "progress"):
+                started.setdefault(event["type"], time.monotonic())
+            if event.get("type") == "execution_start":
+                self.hedging.observe_start(started["execution_start"] - submitted_at)
+                if attempt:
+                    attempt.mark_started()
+            if attempt is None or attempt.forward():
+                self.flights.emit(key, self._annotate(workflow, event))
+        
+        # 等待本任务执行完成，按prompt_id取回它自己的输出，执行事件转发给所有等待者
+        images = await client.wait_for_images(prompt_id, inactivity_timeout, output_nodes=output_nodes,
+                                              on_event=on_event, execution_timeout=execution_timeout,
+                                              queue_timeout=self.settings.COMFYUI_QUEUE_TIMEOUT)
+        if not images:
+            client.release_prompt(prompt_id)
+            raise Exception("生成图像失败")
+        # 完全命中ComfyUI节点缓存（没有采样进度）或包含模型加载的执行不代表真实耗时，不计入模型
+        if warm and "execution_start" in started and "progress" in started:
+            self.runtime.observe(workflow, backend, time.monotonic() - started["execution_start"])
+        return await self._download(client, images, key, prompt_id)
+
+    async def _download(self, client, images: List[Dict[str, Any]], key: str, prompt_id: str) -> List[SpooledSink]:
+        """把prompt的输出图像流式写入buffer（同时写入结果缓存）"""
+        buffers = []
+        entries = []
+        try:
+            for index, image in enumerate(images):
+                buffer = SpooledSink(max_memory=self.settings.IMAGE_SPOOL_MAX_MEMORY)
+                buffers.append(buffer)
+                target = buffer
+                if self.cache:
+                    entry = await self.cache.open_entry(key, index)
+                    entries.append(entry)
+                    target = TeeSink(buffer, entry)
+                await client.stream_image(image, target, self.settings.COMFYUI_DOWNLOAD_CHUNK_SIZE)
+        except BaseException:
+            self._release(buffers)
+            for entry in entries:
+                self.cache.discard(entry)
+            raise
+        if entries:
+            await self.cache.commit(entries)
+        client.release_prompt(prompt_id)
+        return buffers
@@ -0,0 +1,546 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, Any, Optional, List, AsyncIterator, Tuple
+from app.core.config import get_settings
+from app.crud.image import create_image
+from app.crud.job import save_job, get_unfinished_jobs, delete_jobs_before
+from app.database import SessionLocal
+from app.services.image_generator import ImageGenerator
+from app.utils.fair_queue import FairQueue, Priority
+from app.utils.previews import PreviewBuffer
+
+logger = logging.getLogger(__name__)
+
+
+class JobState:
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+    FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class Job:
+    """一个异步生成任务及其进度和结果"""
+
+    def __init__(self, user_id: int, params: Dict[str, Any], total_parts: int = 1,
+                 priority: str = Priority.INTERACTIVE):
+        """
+        Args:
+            user_id: 提交任务的用户
+            params: 生成参数（prompt、n、width、height、seed、steps）
+            total_parts: 拆分的子批次数，用于估算整体进度
+            priority: 优先级类别（interactive / bulk）
+        """
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.params = params
+        self.priority = priority
+        self.n = params.get("n", 1)
+        self.state = JobState.QUEUED
+        self.progress = 0.0
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        # {"index", "sink", "seed", "batch_index"}，按完成顺序追加
+        self.results: List[Dict[str, Any]] = []
+        self.prompt_ids: List[str] = []
+        self.backends: List[str] = []
+        # 各子批次（按起始序号）提交过的 (后端, prompt_id)，持久化后用于重启后接管
+        self.submissions: Dict[int, List[Tuple[str, str]]] = {}
+        self.total_parts = total_parts
+        self.finished_parts = 0
+        # 排队位置（0表示下一个执行）：开始前是在任务队列中的位置，
+        # 开始后是子批次在后端池公平队列中等待名额的位置，分配到后端后为None
+        self.queue_position: Optional[int] = None
+        # 等待后端名额的子批次 {工作流键: 位置}
+        self._positions: Dict[str, int] = {}
+        # queued -> submitted（已提交到ComfyUI，等待执行）-> executing
+        self.phase = "queued"
+        self.current_node: Optional[str] = None
+        self.current_class_type: Optional[str] = None
+        # 各prompt的采样进度 {prompt_id: 0~1}
+        self._fractions: Dict[str, float] = {}
+        # 最新的采样预览帧
+        self.preview = PreviewBuffer.from_settings()
+        # 状态版本号，每次变化加1；观察者按版本号拉取最新快照，不为每次变化排队
+        self.version = 0
+        self._snapshot: Optional[Dict[str, Any]] = None
+        self._changed = asyncio.Event()
+        # 执行中的任务及是否由用户取消
+        self.task: Optional[asyncio.Task] = None
+        self.cancel_requested = False
+        # 按执行时间模型预测的整个任务执行秒数，None表示没有预测
+        self.predicted_seconds: Optional[float] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.state in JobState.FINISHED
+
+    @property
+    def eta(self) -> Optional[float]:
+        """
+        预计剩余秒数
+
+        刚开始执行时进度很少，线性外推误差很大，主要依据预测的执行时间；
+        进度越多，越相信按实际进度线性估算的结果。
+        """
+        if self.state != JobState.RUNNING:
+            return None
+        elapsed = time.time() - self.started_at
+        predicted = max(self.predicted_seconds - elapsed, 0) if self.predicted_seconds is not None else None
+        if self.progress <= 0:
+            return round(predicted, 1) if predicted is not None else None
+        linear = elapsed * (1 - self.progress) / self.progress
+        if predicted is None:
+            return round(linear, 1)
+        return round(self.progress * linear + (1 - self.progress) * predicted, 1)
+
+    def start(self):
+        self.state = JobState.RUNNING
+        self.started_at = time.time()
+        self.queue_position = None
+        self.publish()
+
+    def finish(self, state: str, error: Optional[str] = None):
+        self.state = state
+        self.error = error
+        self.finished_at = time.time()
+        if state == JobState.SUCCEEDED:
+            self.progress = 1.0
+        self.preview.clear()
+        self.publish()
+
+    def handle_event(self, event: Dict[str, Any]):
+        """接收 ImageGenerator 转发的执行事件并更新进度"""
+        msg_type = event.get("type")
+        data = event.get("data", {})
+        prompt_id = data.get("prompt_id")
+        if msg_type == "scheduled":
+            if data["position"] is None:
+                self._positions.pop(data["key"], None)
+            else:
+                self._positions[data["key"]] = data["position"]
+            self.queue_position = min(self._positions.values()) if self._positions else None
+            self.publish()
+            return
+        elif msg_type == "submitted":
+            self.prompt_ids.append(prompt_id)
+            self.backends.append(data.get("backend"))
+            submission = (data.get("backend"), prompt_id)
+            if "part" in data and submission not in self.submissions.get(data["part"], []):
+                self.submissions.setdefault(data["part"], []).append(submission)
+            if self.phase == "queued":
+                self.phase = "submitted"
+        elif msg_type == "progress" and data.get("max"):
+            self._fractions[prompt_id] = data.get("value", 0) / data["max"]
+        elif msg_type == "executing":
+            if data.get("node") is None:
+                self._fractions[prompt_id] = 1.0
+            else:
+                self.phase = "executing"
+                self.current_node = data["node"]
+                self.current_class_type = data.get("class_type")
+        elif msg_type == "execution_start":
+            self.phase = "executing"
+        elif msg_type == "preview":
+            # 只记录最新一帧，解码和编码推迟到有观察者读取时
+            self.preview.update(data["image"])
+            self.publish()
+            return
+        else:
+            return
+        self._update_progress()
+
+    def add_results(self, part: List[Dict[str, Any]]):
+        """一个子批次完成"""
+        self.results.extend(part)
+        self.finished_parts += 1
+        self._update_progress()
+
+    def _update_progress(self):
+        done = max(self.finished_parts, sum(self._fractions.values()))
+        # 结果全部写入前不显示100%
+        self.progress = round(min(done / self.total_parts, 0.99), 4)
+        self.publish()
+
+    def publish(self):
+        """标记状态已变化并唤醒等待中的观察者"""
+        self.version += 1
+        self._snapshot = None
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait_changed(self, version: int, timeout: Optional[float] = None) -> bool:
+        """
+        等待状态版本号超过version
+
+        Returns:
+            bool: 超时返回False
+        """
+        if self.version != version:
+            return True
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def snapshot(self) -> Dict[str, Any]:
+        """当前状态，同一版本的快照在所有观察者之间共享"""
+        if self._snapshot is None:
+            self._snapshot = self.to_dict()
+        return self._snapshot
+
+    async def watch(self, max_rate: float = 4, keepalive: float = 15) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """
+        逐个产出状态快照，直到任务结束
+
+        两次产出至少间隔 1/max_rate 秒，期间的多次变化合并为最新的一次，
+        观察者再多也不会让每条ComfyUI消息都触发推送。超过keepalive秒没有变化时产出None。
+        """
+        interval = 1 / max_rate if max_rate > 0 else 0
+        version = -1
+        while True:
+            if not await self.wait_changed(version, keepalive):
+                yield None
+                continue
+            version = self.version
+            snapshot = self.snapshot()
+            yield snapshot
+            if snapshot["state"] in JobState.FINISHED:
+                return
+            await asyncio.sleep(interval)
+
+    def sorted_results(self) -> List[Dict[str, Any]]:
+        return sorted(self.results, key=lambda result: result["index"])
+
+    def release(self):
+        """释放结果占用的内存缓冲"""
+        for result in self.results:
+            result["sink"].release()
+        self.results = []
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "state": self.state,
+            "progress": self.progress,
+            "eta": self.eta,
+            "predicted_seconds": round(self.predicted_seconds, 1) if self.predicted_seconds is not None else None,
+            "n": self.n,
+            "priority": self.priority,
+            "completed": len(self.results),
+            "queue_position": self.queue_position,
+            "phase": self.phase if not self.finished else None,
+            "current_node": self.current_node,
+            "class_type": self.current_class_type,
+            "preview_version": self.preview.version if not self.finished else None,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobManager:
+    """异步任务管理
+
+    任务提交后立即返回任务ID，由固定数量的后台worker执行，
+    HTTP请求不再在整个生成过程中保持打开。完成的任务保留 result_ttl 秒供查询结果。
+    排队中的任务按用户和优先级加权公平出队，一个用户提交大量任务不会挡住其他用户。
+    任务状态及已提交到ComfyUI的prompt记录在 jobs 表中，应用重启后 recover() 恢复未结束的任务，
+    已提交的子批次接管原来的prompt（仍在执行的继续等待，已完成的从历史记录取回），不重新生成。
+    只在状态变化（提交、开始、提交prompt、结束）时写记录，写入在单独的线程中按顺序执行，不阻塞事件循环。
+    """
+
+    def __init__(self, generator: Optional[ImageGenerator] = None, workers: int = 4, result_ttl: float = 3600,
+                 priority_weights: Optional[Dict[str, float]] = None, policy: str = FairQueue.FAIR):
+        """
+        Args:
+            generator: 图像生成服务
+            workers: 同时执行的任务数
+            result_ttl: 完成的任务及结果保留时间（秒）
+            priority_weights: 各优先级类别的权重
+            policy: 排队策略（fair / sjf）
+        """
+        self.generator = generator or ImageGenerator()
+        self.workers = workers
+        self.result_ttl = result_ttl
+        self.jobs: Dict[str, Job] = {}
+        # 排队中的任务
+        self.queue = FairQueue(priority_weights, policy)
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        # 应用关闭中：被中断的任务保持未结束状态，重启后恢复
+        self._closing = False
+        # 任务记录的写入线程，单线程保证同一任务的记录按调用顺序写入
+        self._records = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-records")
+
+    @classmethod
+    def from_settings(cls) -> "JobManager":
+        settings = get_settings()
+        return cls(workers=settings.JOB_WORKERS, result_ttl=settings.JOB_RESULT_TTL,
+                   priority_weights=settings.SCHEDULER_PRIORITY_WEIGHTS, policy=settings.SCHEDULER_POLICY)
+
+    def start(self):
+        """启动worker（FastAPI启动时调用，首次提交任务时也会按需启动）"""
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        self._tasks = [task for task in self._tasks if not task.done()]
+        loop = asyncio.get_running_loop()
+        while len(self._tasks) < self.workers:
+            self._tasks.append(loop.create_task(self._worker()))
+
+    async def close(self):
+        self._closing = True
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        await self._flush_records()
+
+    def submit(self, user_id: int, params: Dict[str, Any], priority: Optional[str] = None) -> Job:
+        """
+        提交任务
+
+        Args:
+            user_id: 提交任务的用户
+            params: 生成参数（prompt、n、width、height、seed、steps）
+            priority: 优先级类别，None时超过一个子批次的任务视为 bulk
+
+        Returns:
+            Job: 排队中的任务
+        """
+        self.start()
+        self._purge()
+        n = params.get("n", 1)
+        total_parts = len(self.generator.split_batch(n, 0))
+        if priority is None:
+            priority = Priority.BULK if total_parts > 1 else Priority.INTERACTIVE
+        job = Job(user_id, params, total_parts, priority)
+        job.predicted_seconds = self.predict(params)
+        self.jobs[job.id] = job
+        self._persist(job, user_id=user_id, params=json.dumps(params), priority=priority, state=job.state,
+                      predicted_seconds=job.predicted_seconds, created_at=job.created_at)
+        self.queue.push(job, user_id, priority, job.predicted_seconds)
+        self._update_positions()
+        self._wakeup.set()
+        logger.info(f"任务已提交: {job.id}")
+        return job
+
+    def recover(self):
+        """
+        恢复应用重启前未结束的任务（FastAPI启动时调用）
+
+        已开始执行的任务排在最前面，其已提交的子批次接管原来的prompt；
+        同时清理超过保留时间的已结束任务记录。
+        """
+        self.start()
+        db = SessionLocal()
+        try:
+            delete_jobs_before(db, time.time() - self.result_ttl)
+            records = get_unfinished_jobs(db, list(JobState.FINISHED))
+        except Exception as e:
+            logger.error(f"读取任务记录失败: {str(e)}")
+            return
+        finally:
+            db.close()
+        # 已开始执行的先入队：同一个用户的流里也排在重启前仍在排队的任务前面
+        for record in sorted(records, key=lambda record: record.state != JobState.RUNNING):
+            params = json.loads(record.params)
+            job = Job(record.user_id, params, len(self.generator.split_batch(params.get("n", 1), 0)), record.priority)
+            job.id = record.id
+            job.created_at = record.created_at
+            job.predicted_seconds = record.predicted_seconds
+            job.submissions = {int(start): [tuple(submission) for submission in submissions]
+                               for start, submissions in json.loads(record.submissions or "{}").items()}
+            self.jobs[job.id] = job
+            # 已经在执行的任务不再重新排队等待
+            started = record.state == JobState.RUNNING
+            self.queue.push(job, job.user_id, job.priority, 0 if started else job.predicted_seconds or 1)
+            logger.info(f"恢复任务: {job.id}（已提交 {sum(map(len, job.submissions.values()))} 个prompt）")
+        if records:
+            self._update_positions()
+            self._wakeup.set()
+
+    def predict(self, params: Dict[str, Any]) -> float:
+        """预测任务的执行秒数：子批次分发到各健康后端并行执行，每个后端依次执行分到的子批次"""
+        parts = self.generator.predict_batch(**params)
+        backends = len(self.generator.backend_pool.candidates())
+        return max(max(parts), sum(parts) / max(1, min(backends, len(parts))))
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    def _purge(self):
+        """清理超过保留时间的已完成任务"""
+        now = time.time()
+        purged = False
+        for job_id, job in list(self.jobs.items()):
+            if job.finished and now - job.finished_at > self.result_ttl:
+                job.release()
+                del self.jobs[job_id]
+                purged = True
+        if purged:
+            self._write(self._clean_records, now - self.result_ttl)
+
+    def cancel(self, job: Job) -> bool:
+        """
+        取消任务：排队中的直接标记为已取消，执行中的取消其执行，
+        由等待ComfyUI结果的地方删除或中断已提交的prompt
+
+        Returns:
+            bool: 任务已经结束时返回False
+        """
+        if job.finished:
+            return False
+        job.cancel_requested = True
+        if job.state == JobState.QUEUED:
+            self.queue.remove(job)
+            self._update_positions()
+            job.finish(JobState.CANCELLED, "任务已取消")
+            self._persist_finish(job)
+        elif job.task:
+            job.task.cancel()
+        logger.info(f"任务已取消: {job.id}")
+        return True
+
+    async def _worker(self):
+        while True:
+            job = await self._next_job()
+            job.task = asyncio.ensure_future(self._run(job))
+            try:
+                await job.task
+            except asyncio.CancelledError:
+                # 用户取消单个任务时worker继续处理下一个；worker自身被取消时退出
+                if not job.cancel_requested:
+                    raise
+            finally:
+                job.task = None
+
+    async def _next_job(self) -> Job:
+        """按公平顺序取出下一个任务，队列为空时等待"""
+        while not self.queue:
+            self._wakeup.clear()
+            await self._wakeup.wait()
+        job = self.queue.first()
+        self.queue.take(job)
+        self._update_positions()
+        return job
+
+    def _update_positions(self):
+        """队列变化后更新各排队任务的位置"""
+        for position, job in enumerate(self.queue):
+            if job.queue_position != position:
+                job.queue_position = position
+                job.publish()
+
+    async def _run(self, job: Job):
+        job.start()
+        self._persist(job, state=job.state, started_at=job.started_at)
+        
+        def on_event(event: Dict[str, Any]):
+            job.handle_event(event)
+            if event.get("type") == "submitted":
+                # 提交后立即记录，应用随时重启都能找回这个prompt
+                self._persist(job, submissions=json.dumps({start: submissions for start, submissions
+                                                           in job.submissions.items()}))
+        
+        try:
+            async for part in self.generator.iter_batch(**job.params, on_event=on_event, user_id=job.user_id,
+                                                        priority=job.priority, submissions=job.submissions):
+                job.add_results(part)
+            await self._write(self._save, job)
+            job.finish(JobState.SUCCEEDED)
+            logger.info(f"任务完成: {job.id}")
+        except asyncio.CancelledError:
+            if self._closing and not job.cancel_requested:
+                # 应用关闭：保留未结束的记录和ComfyUI上的prompt，重启后接管
+                raise
+            job.finish(JobState.CANCELLED, "任务已取消")
+            self._persist_finish(job)
+            raise
+        except Exception as e:
+            logger.error(f"任务执行失败 {job.id}: {str(e)}")
+            job.finish(JobState.FAILED, str(e))
+        self._persist_finish(job)
+
+    def _write(self, func, *args: Any) -> asyncio.Future:
+        """在任务记录的写入线程中执行数据库操作"""
+        return asyncio.get_running_loop().run_in_executor(self._records, func, *args)
+
+    async def _flush_records(self):
+        """等待已排队的记录写入完成"""
+        await self._write(lambda: None)
+
+    def _persist(self, job: Job, **fields: Any) -> asyncio.Future:
+        """更新任务记录（不等待写入完成），数据库不可用时只记录日志，不影响任务执行"""
+        return self._write(self._save_record, job.id, fields)
+
+    @staticmethod
+    def _save_record(job_id: str, fields: Dict[str, Any]):
+        db = SessionLocal()
+        try:
+            save_job(db, job_id, **fields)
+        except Exception as e:
+            logger.error(f"保存任务状态失败 {job_id}: {str(e)}")
+        finally:
+            db.close()
+
+    def _persist_finish(self, job: Job):
+        self._persist(job, state=job.state, error=job.error, finished_at=job.finished_at)
+
+    @staticmethod
+    def _clean_records(finished_before: float):
+        """删除超过保留时间的已结束任务记录"""
+        db = SessionLocal()
+        try:
+            delete_jobs_before(db, finished_before)
+        except Exception as e:
+            logger.error(f"清理任务记录失败: {str(e)}")
+        finally:
+            db.close()
+
+    def _save(self, job: Job):
+        """与同步接口一致，把生成的图像记录到用户的作品列表"""
+        db = SessionLocal()
+        try:
+            for result in job.sorted_results():
+                create_image(
+                    db=db,
+                    user_id=job.user_id,
+                    prompt=job.params["prompt"],
+                    image_url=f"data:image/png;base64,{result['sink'].to_base64()}",
+                )
+        except Exception as e:
+            logger.error(f"保存任务结果失败 {job.id}: {str(e)}")
+        finally:
+            db.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        states: Dict[str, int] = {}
+        for job in self.jobs.values():
+            states[job.state] = states.get(job.state, 0) + 1
+        return {
+            "workers": self.workers,
+            "queued": len(self.queue),
+            "jobs": states,
+            "scheduler": self.queue.get_stats(),
+        }
+
+
+@lru_cache()
+def get_job_manager() -> JobManager:
+    return JobManager.from_settings()
@@ -0,0 +1,65 @@
+from typing import Dict, Any, Optional, List, NamedTuple, Tuple
+from app.utils.workflow_templates import PARAMETER_ROLES, PROMPT_NODES
+
+# 加载模型文件的节点及其文件名输入
+MODEL_FILE_INPUTS: Dict[str, Tuple[str, ...]] = {
+    "UNETLoader": ("unet_name",),
+    "CheckpointLoaderSimple": ("ckpt_name",),
+    "DualCLIPLoader": ("clip_name1", "clip_name2"),
+    "CLIPLoader": ("clip_name",),
+    "VAELoader": ("vae_name",),
+    "LoraLoader": ("lora_name",),
+}
+
+# ComfyUI可以复用上一个prompt节点输出的部分及其价值：
+# 模型文件相同时跳过UNET/CLIP/VAE加载；在此基础上提示词相同时跳过文本编码，分辨率相同时跳过空latent
+REUSE_WEIGHTS = {"models": 4, "prompt": 2, "resolution": 1}
+
+
+class CacheSignature(NamedTuple):
+    """决定ComfyUI节点缓存能否命中的工作流特征"""
+    models: Tuple[Tuple[str, str], ...]
+    prompt: Tuple[str, ...]
+    resolution: Optional[Tuple[int, int]]
+
+
+def cache_signature(workflow: Dict[str, Any]) -> CacheSignature:
+    """提取工作流的模型文件、提示词文本和分辨率"""
+    models = set()
+    texts = []
+    size: Dict[str, Any] = {}
+    for node in workflow.values():
+        class_type, inputs = node["class_type"], node["inputs"]
+        for input_name in MODEL_FILE_INPUTS.get(class_type, ()):
+            if isinstance(inputs.get(input_name), str):
+                models.add((input_name, inputs[input_name]))
+        input_name = PROMPT_NODES.get(class_type)
+        if input_name and isinstance(inputs.get(input_name), str):
+            texts.append(inputs[input_name])
+        for role in ("width", "height"):
+            if (class_type, role) in PARAMETER_ROLES[role] and isinstance(inputs.get(role), int):
+                size.setdefault(role, inputs[role])
+    resolution = (size["width"], size["height"]) if len(size) == 2 else None
+    return CacheSignature(tuple(sorted(models)), tuple(sorted(texts)), resolution)
+
+
+def model_files(signature: Optional[CacheSignature]) -> List[str]:
+    """工作流用到的模型文件名"""
+    return sorted({file for _, file in signature.models}) if signature else []
+
+
+def reused_parts(signature: Optional[CacheSignature], previous: Optional[CacheSignature]) -> List[str]:
+    """紧接在previous之后执行时可以复用的部分（REUSE_WEIGHTS 的键）"""
+    if signature is None or previous is None or not signature.models or signature.models != previous.models:
+        return []
+    parts = ["models"]
+    if signature.prompt == previous.prompt:
+        parts.append("prompt")
+    if signature.resolution is not None and signature.resolution == previous.resolution:
+        parts.append("resolution")
+    return parts
+
+
+def cache_affinity(signature: Optional[CacheSignature], previous: Optional[CacheSignature]) -> int:
+    """紧接在previous之后执行的收益，0表示无法复用"""
+    return sum(REUSE_WEIGHTS[part] for part in reused_parts(signature, previous))
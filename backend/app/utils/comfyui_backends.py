@@ -0,0 +1,694 @@
+import asyncio
+import logging
+import time
+from collections import deque, OrderedDict
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import Dict, Any, Optional, List, AsyncIterator, Callable
+from app.core.config import get_settings
+from app.utils.cache_affinity import CacheSignature, cache_affinity, cache_signature, model_files, reused_parts, \
+    REUSE_WEIGHTS
+from app.utils.comfyui_client import ComfyUIClient, BackendUnavailableError
+from app.utils.comfyui_pool import get_comfyui_registry
+from app.utils.fair_queue import FairQueue, Priority
+from app.utils.warmup import warmup_workflow
+from app.utils.workflow_templates import WorkflowTemplateError, get_workflow_registry
+
+logger = logging.getLogger(__name__)
+
+
+class NoBackendAvailableError(Exception):
+    """没有可用的ComfyUI后端"""
+
+
+class CircuitBreaker:
+    """后端熔断器
+
+    closed: 正常路由；连续失败达到阈值后进入 open，不再向该后端路由任务；
+    open 持续 recovery_timeout 秒后进入 half_open，由下一次健康检查试探，
+    成功则恢复 closed，失败则重新 open。
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 3, recovery_timeout: float = 30, window: int = 20):
+        """
+        Args:
+            failure_threshold: 触发熔断的连续失败次数
+            recovery_timeout: 熔断后多久进入半开状态（秒）
+            window: 统计错误率的最近结果个数
+        """
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.results = deque(maxlen=window)
+        # 健康检查延迟（秒）：最近一次及指数移动平均
+        self.latency: Optional[float] = None
+        self.latency_avg: Optional[float] = None
+
+    @property
+    def error_rate(self) -> float:
+        if not self.results:
+            return 0.0
+        return self.results.count(False) / len(self.results)
+
+    def allow_request(self) -> bool:
+        """是否可以向该后端路由任务；open 超时后转为 half_open 等待健康检查试探"""
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.recovery_timeout:
+            self.state = self.HALF_OPEN
+        return self.state == self.CLOSED
+
+    def record_success(self, latency: Optional[float] = None) -> bool:
+        """
+        记录一次成功
+
+        Returns:
+            bool: 熔断是否因此恢复
+        """
+        self.allow_request()
+        self.results.append(True)
+        self.consecutive_failures = 0
+        if latency is not None:
+            self.latency = latency
+            self.latency_avg = latency if self.latency_avg is None else 0.8 * self.latency_avg + 0.2 * latency
+        # open 期间的成功不提前恢复，等到 half_open 试探
+        if self.state == self.HALF_OPEN:
+            self.state = self.CLOSED
+            self.opened_at = None
+            return True
+        return False
+
+    def record_failure(self) -> bool:
+        """
+        记录一次失败
+
+        Returns:
+            bool: 熔断是否因此打开
+        """
+        self.allow_request()
+        self.results.append(False)
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN or (
+                self.state == self.CLOSED and self.consecutive_failures >= self.failure_threshold):
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            return True
+        return False
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "error_rate": round(self.error_rate, 4),
+            "latency": round(self.latency, 4) if self.latency is not None else None,
+            "latency_avg": round(self.latency_avg, 4) if self.latency_avg is not None else None,
+            "open_for": round(time.monotonic() - self.opened_at, 1) if self.opened_at else None,
+        }
+
+
+class ComfyUIBackend:
+    """单个ComfyUI后端及其实时负载信息"""
+
+    # 空闲显存超过总显存的这个比例时认为模型已全部卸载（重启或 /free 之后）
+    UNLOADED_VRAM_RATIO = 0.95
+    # 之后每执行一个用不到该模型的任务，它仍在显存中的可能性按此比例降低
+    RESIDENCY_DECAY = 0.5
+
+    def __init__(self, host: str, port: int, max_concurrency: int, max_resident_models: int = 8):
+        """
+        Args:
+            host: 后端地址
+            port: 后端端口
+            max_concurrency: 同时执行的最大任务数
+            max_resident_models: 认为仍加载在后端上的最近使用模型文件数
+        """
+        self.host = host
+        self.port = port
+        self.key = f"{host}:{port}"
+        self.max_concurrency = max_concurrency
+        # 本进程提交到该后端、尚未结束的任务数
+        self.in_flight = 0
+        # 最近一次 /queue 查询到的排队+执行中任务数
+        self.queue_size = 0
+        self.vram_free: Optional[int] = None
+        self.vram_total: Optional[int] = None
+        # 最近执行的工作流用到的模型文件 -> 最后一次使用时的分配序号（按使用顺序），
+        # 推测仍加载在后端上，新任务用到的模型都在其中时不需要换模型
+        self.max_resident_models = max_resident_models
+        self.resident_models: "OrderedDict[str, int]" = OrderedDict()
+        self._assignments = 0
+        self._reconnects = 0
+        # 是否已经通过预热工作流加载了模型；启动、熔断恢复或后端重启后需要重新预热
+        self.warm = False
+        self.warmed_at: Optional[float] = None
+        self.warmup_seconds: Optional[float] = None
+        self.warmup_errors: Dict[str, str] = {}
+        # 最近分配到该后端的工作流特征，ComfyUI的节点缓存保留的是它的输出
+        self.last_signature: Optional[CacheSignature] = None
+        self.registry = get_comfyui_registry()
+        settings = self.registry.settings
+        self.health = CircuitBreaker(
+            failure_threshold=settings.COMFYUI_CIRCUIT_FAILURE_THRESHOLD,
+            recovery_timeout=settings.COMFYUI_CIRCUIT_RECOVERY_TIMEOUT,
+        )
+
+    @classmethod
+    def parse(cls, address: str, max_concurrency: int, max_resident_models: int = 8) -> "ComfyUIBackend":
+        """解析 "host:port" 形式的后端地址"""
+        host, _, port = address.rpartition(":")
+        if not host:
+            host, port = address, "8188"
+        return cls(host, int(port), max_concurrency, max_resident_models)
+
+    def client(self) -> ComfyUIClient:
+        """借用该后端的客户端（共享连接池和WebSocket）"""
+        return self.registry.get_client(self.host, self.port)
+
+    @property
+    def queue_remaining(self) -> int:
+        """后端队列长度，优先使用WebSocket status 消息中的实时值"""
+        stream = self.registry.event_streams.get(self.key)
+        if stream and stream.status:
+            return stream.status.get("exec_info", {}).get("queue_remaining", self.queue_size)
+        return self.queue_size
+
+    @property
+    def load(self) -> int:
+        # 服务器队列中包含本进程已提交的任务，取两者较大值避免重复计算
+        return max(self.queue_remaining, self.in_flight)
+
+    @property
+    def has_capacity(self) -> bool:
+        return self.in_flight < self.max_concurrency
+
+    def model_affinity(self, models: List[str]) -> float:
+        """
+        任务用到的模型文件已经加载在该后端上的程度
+
+        Returns:
+            float: 0~1，1表示全部是上一个任务用过的模型；更早用过的模型可能已被换出，按间隔的任务数衰减
+        """
+        if not models:
+            return 0.0
+        return sum(
+            self.RESIDENCY_DECAY ** (self._assignments - self.resident_models[model])
+            for model in models if model in self.resident_models
+        ) / len(models)
+
+    def note_models(self, models: List[str]):
+        """记录分配到该后端的任务用到的模型文件，超出上限时淘汰最久未用的"""
+        if not models:
+            return
+        self._assignments += 1
+        for model in models:
+            self.resident_models.pop(model, None)
+            self.resident_models[model] = self._assignments
+        while len(self.resident_models) > self.max_resident_models:
+            self.resident_models.popitem(last=False)
+
+    @property
+    def available(self) -> bool:
+        """熔断器是否允许向该后端路由任务"""
+        return self.health.allow_request()
+
+    async def refresh(self):
+        """查询 /queue 和 /system_stats 更新负载信息"""
+        client = self.client()
+        queue = await client.get_queue()
+        self.queue_size = len(queue.get("queue_running", [])) + len(queue.get("queue_pending", []))
+        stats = await client.get_system_stats()
+        devices = stats.get("devices", [])
+        self.vram_free = sum(device.get("vram_free", 0) for device in devices) if devices else None
+        self.vram_total = sum(device.get("vram_total", 0) for device in devices) if devices else None
+        self._check_unloaded()
+
+    def _check_unloaded(self):
+        """后端重启（WebSocket重连）或显存几乎全空且没有任务时，之前加载的模型已不在显存中"""
+        stream = self.registry.event_streams.get(self.key)
+        reconnects = stream.reconnects if stream else 0
+        idle = self.in_flight == 0 and self.queue_size == 0
+        unloaded = idle and self.vram_total and self.vram_free is not None \
+            and self.vram_free >= self.vram_total * self.UNLOADED_VRAM_RATIO
+        if self.resident_models and (reconnects != self._reconnects or unloaded):
+            logger.info(f"后端模型已卸载: {self.key}")
+            self.resident_models.clear()
+            self.last_signature = None
+        if reconnects != self._reconnects:
+            # 可能是ComfyUI重启，重新预热
+            self.warm = False
+        self._reconnects = reconnects
+
+    async def warm_up(self, workflows: Dict[str, Dict[str, Any]], timeout: float = 300) -> bool:
+        """
+        依次执行各模板的预热工作流，让后端提前加载模型，全部结束且至少一个模板成功后才标记为已预热
+
+        Args:
+            workflows: 模板名 -> 预热工作流
+            timeout: 开始执行后无消息的超时（秒），加载模型期间ComfyUI不发送消息
+
+        Returns:
+            bool: 是否完成预热；后端不可达或所有模板都失败时返回False，由后端池稍后重试
+        """
+        started = time.monotonic()
+        client = self.client()
+        errors = {}
+        for name, workflow in workflows.items():
+            prompt_id = None
+            try:
+                prompt_id = await client.submit_prompt(workflow)
+                if not prompt_id:
+                    raise Exception("提交工作流失败")
+                await client.wait_for_prompt(prompt_id, timeout)
+            except BackendUnavailableError as e:
+                logger.warning(f"后端预热中断 {self.key}: {str(e)}")
+                return False
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # 模板在该后端上无法执行（缺少模型或节点、超时）不影响其他模板
+                if prompt_id and isinstance(e, asyncio.TimeoutError):
+                    await client.cancel_prompt(prompt_id)
+                errors[name] = str(e) or type(e).__name__
+                logger.error(f"后端预热失败 {self.key} {name}: {errors[name]}")
+                continue
+            finally:
+                if prompt_id:
+                    client.release_prompt(prompt_id)
+            signature = cache_signature(workflow)
+            self.note_models(model_files(signature))
+            self.last_signature = signature
+        self.warmup_seconds = time.monotonic() - started
+        self.warmup_errors = errors
+        if workflows and len(errors) == len(workflows):
+            # 没有加载任何模型，保持未预热
+            logger.error(f"后端预热失败: {self.key}，所有模板都无法执行")
+            return False
+        self.warm = True
+        self.warmed_at = time.time()
+        logger.info(f"后端预热完成: {self.key}，耗时 {self.warmup_seconds:.1f} 秒")
+        return True
+
+    async def probe(self, timeout: float = 5) -> bool:
+        """
+        健康检查：在超时时间内完成 /system_stats 和 /queue 查询即视为健康
+
+        Returns:
+            bool: 后端是否健康
+        """
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(self.refresh(), timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"后端健康检查失败 {self.key}: {str(e) or type(e).__name__}")
+            self.record_failure()
+            return False
+        self.record_success(time.monotonic() - started)
+        return True
+
+    def record_success(self, latency: Optional[float] = None):
+        if self.health.record_success(latency):
+            logger.info(f"后端已恢复，重新参与路由: {self.key}")
+
+    def record_failure(self):
+        if self.health.record_failure():
+            logger.error(f"后端连续失败，已熔断: {self.key}")
+            # 恢复后重新预热
+            self.warm = False
+            # 等待中的任务立即失败，由调用方换后端重试，而不是等到超时
+            stream = self.registry.event_streams.get(self.key)
+            if stream:
+                stream.fail_pending(BackendUnavailableError(f"ComfyUI后端不可用: {self.key}"))
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "queue_remaining": self.queue_remaining,
+            "vram_free": self.vram_free,
+            "resident_models": list(self.resident_models),
+            "warm": self.warm,
+            "warmup_seconds": round(self.warmup_seconds, 2) if self.warmup_seconds is not None else None,
+            "warmup_errors": self.warmup_errors,
+            "circuit": self.health.state,
+        }
+
+
+class _Ticket:
+    """等待执行名额的请求"""
+
+    def __init__(self, exclude: List[str], on_position: Optional[Callable[[Optional[int]], None]] = None,
+                 signature: Optional[CacheSignature] = None,
+                 on_assigned: Optional[Callable[[bool], None]] = None):
+        self.exclude = exclude
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.on_position = on_position
+        self.on_assigned = on_assigned
+        self.position: Optional[int] = None
+        self.signature = signature
+        # 为了复用节点缓存被后面的请求越过的次数
+        self.overtaken = 0
+
+    def update_position(self, position: Optional[int]):
+        if position != self.position:
+            self.position = position
+            if self.on_position:
+                self.on_position(position)
+
+
+class ComfyUIBackendPool:
+    """ComfyUI后端池
+
+    每个任务按后端的实时负载（WebSocket status 中的 queue_remaining、
+    /queue、/system_stats）选择后端，并限制每个后端同时执行的任务数。
+    后端都满载时请求在本地的加权公平队列中等待（按用户和优先级分流），
+    名额空出时按公平顺序分配，ComfyUI自己的FIFO队列里始终只有少量任务。
+    公平顺序靠前的 cache_window 个请求中，如果有与某个后端上一个任务模型文件、
+    提示词或分辨率相同的，优先接在它后面执行以复用ComfyUI的节点缓存；
+    每个请求最多被越过 cache_window 次，公平性的偏差有上限。
+    选择后端时优先已经加载了任务所需模型的后端，避免换模型；这样的后端负载比
+    最空闲的后端多出 affinity_max_extra_load 以上时退回到按负载选择。
+    后台任务定期对各后端做健康检查，熔断的后端不参与路由；启动时、熔断恢复后以及
+    后端重启后，先用各工作流模板的极小版本预热（加载模型），已预热的后端优先参与路由。
+    增加GPU服务器只需修改 COMFYUI_BACKENDS 配置。
+    """
+
+    def __init__(self, backends: List[ComfyUIBackend], refresh_interval: float = 5,
+                 health_check_timeout: float = 5, priority_weights: Optional[Dict[str, float]] = None,
+                 policy: str = FairQueue.FAIR, cache_window: int = 4, affinity_max_extra_load: int = 1,
+                 warmup: bool = True, warmup_templates: Optional[List[str]] = None, warmup_size: int = 64,
+                 warmup_steps: int = 1, warmup_timeout: float = 300, warmup_retry_interval: float = 60):
+        if not backends:
+            raise NoBackendAvailableError("未配置ComfyUI后端")
+        self.backends = backends
+        self.refresh_interval = refresh_interval
+        self.health_check_timeout = health_check_timeout
+        self.waiting = FairQueue(priority_weights, policy)
+        self.cache_window = cache_window
+        self.affinity_max_extra_load = affinity_max_extra_load
+        # 预热：模板名为空表示全部模板
+        self.warmup = warmup
+        self.warmup_templates = warmup_templates or []
+        self.warmup_size = warmup_size
+        self.warmup_steps = warmup_steps
+        self.warmup_timeout = warmup_timeout
+        self.warmup_retry_interval = warmup_retry_interval
+        self._warmups: Dict[str, asyncio.Task] = {}
+        # 预热失败的后端 -> 最早的重试时间
+        self._warmup_retry_at: Dict[str, float] = {}
+        # 分配的名额数、为复用缓存越过公平顺序的次数、各部分可复用的分配数
+        self.assigned = 0
+        self.grouped = 0
+        self.reused = {part: 0 for part in REUSE_WEIGHTS}
+        # 所需模型都是该后端上一个任务用过的分配数、因模型亲和或缓存分组没有选最空闲后端的次数
+        self.model_hits = 0
+        self.affinity_routed = 0
+        self._task: Optional[asyncio.Task] = None
+        self._next = 0
+
+    @classmethod
+    def from_settings(cls) -> "ComfyUIBackendPool":
+        settings = get_settings()
+        overrides = settings.COMFYUI_BACKEND_CONCURRENCY_OVERRIDES
+        backends = [
+            ComfyUIBackend.parse(address, overrides.get(address, settings.COMFYUI_BACKEND_CONCURRENCY),
+                                 settings.COMFYUI_RESIDENT_MODELS)
+            for address in settings.COMFYUI_BACKENDS
+        ]
+        return cls(backends, settings.COMFYUI_BACKEND_REFRESH_INTERVAL, settings.COMFYUI_HEALTH_CHECK_TIMEOUT,
+                   settings.SCHEDULER_PRIORITY_WEIGHTS, settings.SCHEDULER_POLICY, settings.SCHEDULER_CACHE_WINDOW,
+                   settings.SCHEDULER_AFFINITY_MAX_EXTRA_LOAD, settings.COMFYUI_WARMUP_ENABLED,
+                   settings.COMFYUI_WARMUP_TEMPLATES, settings.COMFYUI_WARMUP_SIZE, settings.COMFYUI_WARMUP_STEPS,
+                   settings.COMFYUI_WARMUP_TIMEOUT, settings.COMFYUI_WARMUP_RETRY_INTERVAL)
+
+    def start(self):
+        """建立各后端的WebSocket并启动健康检查任务"""
+        for backend in self.backends:
+            backend.registry.get_event_stream(backend.host, backend.port)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self):
+        for task in [self._task, *self._warmups.values()]:
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = None
+        self._warmups.clear()
+
+    async def _run(self):
+        while True:
+            # 并发检查，单个后端超时不会拖慢其他后端的状态更新
+            await asyncio.gather(*(backend.probe(self.health_check_timeout) for backend in self.backends))
+            self._start_warmups()
+            # 熔断状态可能变化，重新为等待中的请求分配
+            self._dispatch()
+            await asyncio.sleep(self.refresh_interval)
+
+    def _start_warmups(self):
+        """为健康、尚未预热且有空闲名额的后端启动预热，满载的后端等下一轮健康检查"""
+        if not self.warmup:
+            return
+        now = time.monotonic()
+        for backend in self.backends:
+            task = self._warmups.get(backend.key)
+            if backend.warm or not backend.available or not backend.has_capacity or (task and not task.done()):
+                continue
+            if now < self._warmup_retry_at.get(backend.key, 0):
+                continue
+            self._warmups[backend.key] = asyncio.get_running_loop().create_task(self._warm_up(backend))
+
+    async def _warm_up(self, backend: ComfyUIBackend):
+        """预热期间占用一个执行名额，后端并发为1时用户请求不会排在预热后面"""
+        if not backend.has_capacity:
+            # 任务启动前名额已被用户请求占满
+            return
+        registry = get_workflow_registry()
+        workflows = {}
+        for name in self.warmup_templates or registry.names():
+            try:
+                workflows[name] = warmup_workflow(registry.get(name), self.warmup_size, self.warmup_steps)
+            except WorkflowTemplateError as e:
+                logger.error(f"生成预热工作流失败: {str(e)}")
+        # 检查名额到占用之间没有await，不会超出并发上限
+        backend.in_flight += 1
+        try:
+            if await backend.warm_up(workflows, self.warmup_timeout):
+                self._warmup_retry_at.pop(backend.key, None)
+            elif workflows and set(workflows) <= set(backend.warmup_errors):
+                # 所有模板都失败（例如缺少模型）时隔一段时间再试；后端不可达时随健康检查重试
+                self._warmup_retry_at[backend.key] = time.monotonic() + self.warmup_retry_interval
+        finally:
+            self._release(backend)
+
+    def is_warm(self, backend: ComfyUIBackend) -> bool:
+        """后端是否已加载模型（关闭预热时总是视为已预热）"""
+        return backend.warm or not self.warmup
+
+    def candidates(self, exclude: Optional[List[str]] = None) -> List[ComfyUIBackend]:
+        """可参与路由的后端（未排除且未熔断）"""
+        exclude = exclude or []
+        return [backend for backend in self.backends if backend.key not in exclude and backend.available]
+
+    def select(self, exclude: Optional[List[str]] = None,
+               models: Optional[List[str]] = None) -> Optional[ComfyUIBackend]:
+        """
+        选择还有并发余量的后端
+
+        优先已预热的后端，其次已加载models中更多模型的后端（负载不超过最低负载 + affinity_max_extra_load），
+        再次负载最低的，负载相同时优先空闲显存更多的后端，再相同则轮询。
+        """
+        available = [backend for backend in self.candidates(exclude) if backend.has_capacity]
+        if not available:
+            return None
+        self._next += 1
+        count = len(self.backends)
+        least = min(backend.load for backend in available)
+
+        def affinity(backend: ComfyUIBackend) -> float:
+            if not models or backend.load > least + self.affinity_max_extra_load:
+                return 0.0
+            return backend.model_affinity(models)
+
+        return min(
+            available,
+            key=lambda b: (not self.is_warm(b), -affinity(b), b.load, -(b.vram_free or 0),
+                           (self.backends.index(b) - self._next) % count),
+        )
+
+    @asynccontextmanager
+    async def acquire(self, exclude: Optional[List[str]] = None, user_id: Optional[int] = None,
+                      priority: str = Priority.INTERACTIVE, cost: float = 1,
+                      on_position: Optional[Callable[[Optional[int]], None]] = None,
+                      signature: Optional[CacheSignature] = None,
+                      on_assigned: Optional[Callable[[bool], None]] = None) -> AsyncIterator[ComfyUIBackend]:
+        """
+        占用一个后端的执行名额，所有后端都满载时在公平队列中等待
+
+        Args:
+            exclude: 不参与选择的后端（"host:port"）
+            user_id: 请求所属的用户，用于公平排队
+            priority: 优先级类别（interactive / bulk）
+            cost: 请求的代价（预测的执行秒数）
+            on_position: 排队位置变化时的回调，分配到名额时收到None
+            signature: 工作流的缓存特征（cache_signature），用于把可以复用节点缓存的请求排在一起
+            on_assigned: 分配到后端时的回调，参数为所需模型是否可能不在该后端显存中（需要先加载）
+
+        Raises:
+            NoBackendAvailableError: 排除后没有任何后端，或剩余后端全部熔断
+        """
+        self.start()
+        ticket = _Ticket(exclude or [], on_position, signature, on_assigned)
+        self.waiting.push(ticket, user_id, priority, cost)
+        self._dispatch()
+        try:
+            backend = await ticket.future
+        except BaseException:
+            if self.waiting.remove(ticket):
+                # 后面的请求位置前移
+                self._dispatch()
+            elif ticket.future.done() and not ticket.future.cancelled() and ticket.future.exception() is None:
+                # 已经分配了名额但调用方同时被取消
+                self._release(ticket.future.result())
+            raise
+        try:
+            yield backend
+        finally:
+            self._release(backend)
+
+    def _release(self, backend: ComfyUIBackend):
+        backend.in_flight -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        """把空闲名额分配给等待中的请求，并更新其余请求的排队位置"""
+        while self._assign_next():
+            pass
+        position = 0
+        for ticket in self.waiting:
+            if not ticket.future.done():
+                ticket.update_position(position)
+                position += 1
+
+    def _assign_next(self) -> bool:
+        """
+        分配一个名额
+
+        Returns:
+            bool: 没有可以分配的请求时返回False
+        """
+        pending = []
+        for ticket in self.waiting:
+            if ticket.future.done():
+                # 调用方已取消，等它自己撤回
+                continue
+            if not self.candidates(ticket.exclude):
+                # 没有健康的后端时立即失败，而不是一直等待
+                self.waiting.remove(ticket)
+                ticket.future.set_exception(NoBackendAvailableError("没有可用的ComfyUI后端"))
+                continue
+            pending.append(ticket)
+        # 按公平顺序第一个能分配到后端的请求
+        for index, ticket in enumerate(pending):
+            backend = self.select(ticket.exclude, model_files(ticket.signature))
+            if backend is not None:
+                break
+        else:
+            return False
+
+        # 窗口内的后续请求如果能更多地复用某个空闲后端的节点缓存，提前执行
+        window = pending[index:index + 1 + self.cache_window]
+        best = cache_affinity(ticket.signature, backend.last_signature)
+        chosen = 0
+        for offset in range(1, len(window)):
+            if window[offset - 1].overtaken >= self.cache_window:
+                break
+            candidate = window[offset]
+            for other in self.candidates(candidate.exclude):
+                score = cache_affinity(candidate.signature, other.last_signature) if other.has_capacity else 0
+                if score > best:
+                    best, chosen, backend = score, offset, other
+        if chosen:
+            for skipped in window[:chosen]:
+                skipped.overtaken += 1
+            self.grouped += 1
+        self._assign(window[chosen], backend)
+        return True
+
+    def _assign(self, ticket: _Ticket, backend: ComfyUIBackend):
+        models = model_files(ticket.signature)
+        # 分配之前计算，note_models 之后该任务的模型总是视为已驻留
+        model_load = bool(models) and backend.model_affinity(models) < 1
+        if models:
+            if not model_load:
+                self.model_hits += 1
+            least = min(other.load for other in self.candidates(ticket.exclude) if other.has_capacity)
+            if backend.load > least:
+                self.affinity_routed += 1
+        self.waiting.take(ticket)
+        backend.in_flight += 1
+        self.assigned += 1
+        for part in reused_parts(ticket.signature, backend.last_signature):
+            self.reused[part] += 1
+        backend.last_signature = ticket.signature
+        backend.note_models(models)
+        ticket.update_position(None)
+        if ticket.on_assigned:
+            ticket.on_assigned(model_load)
+        ticket.future.set_result(backend)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {backend.key: backend.get_stats() for backend in self.backends}
+
+    def get_warmup_stats(self) -> Dict[str, Any]:
+        """各后端的预热状态、耗时及失败的模板"""
+        return {
+            backend.key: {
+                "warm": self.is_warm(backend),
+                "warmed_at": backend.warmed_at,
+                "warmup_seconds": round(backend.warmup_seconds, 2) if backend.warmup_seconds is not None else None,
+                "warmup_errors": backend.warmup_errors,
+            }
+            for backend in self.backends
+        }
+
+    def get_scheduler_stats(self) -> Dict[str, Any]:
+        """本地公平队列中等待名额的请求，以及按缓存分组的效果"""
+        return {
+            **self.waiting.get_stats(),
+            "cache_grouping": {
+                "window": self.cache_window,
+                "assigned": self.assigned,
+                "grouped": self.grouped,
+                # 分配时与该后端上一个任务相同的比例（按调度预期）
+                "reuse_ratio": {
+                    part: round(count / self.assigned, 4) if self.assigned else 0.0
+                    for part, count in self.reused.items()
+                },
+                # ComfyUI实际报告的缓存命中节点比例
+                "node_cache": get_comfyui_registry().get_node_cache_stats([backend.key for backend in self.backends]),
+            },
+            "model_affinity": {
+                "max_extra_load": self.affinity_max_extra_load,
+                # 分配时所需模型都是该后端上一个任务用过的（不需要换模型）比例
+                "hit_ratio": round(self.model_hits / self.assigned, 4) if self.assigned else 0.0,
+                "affinity_routed": self.affinity_routed,
+            },
+        }
+
+    def get_health(self) -> Dict[str, Any]:
+        """各后端的熔断状态、错误率和健康检查延迟"""
+        return {backend.key: backend.health.get_stats() for backend in self.backends}
+
+
+@lru_cache()
+def get_backend_pool() -> ComfyUIBackendPool:
+    return ComfyUIBackendPool.from_settings()
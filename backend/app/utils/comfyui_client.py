@@ -1,8 +1,13 @@
 import aiohttp
 import asyncio
+import copy
 import json
+import struct
+import urllib.parse
 import urllib.request
-from typing import Dict, Any, Optional
+import uuid
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List, AsyncIterator, Tuple, Callable, Set
 import logging
 import time
 
@@ -10,99 +15,934 @@ import time
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# WebSocket二进制消息类型（与ComfyUI server.BinaryEventTypes一致）
+BINARY_PREVIEW_IMAGE = 1
+# 二进制图像格式编号
+BINARY_IMAGE_FORMATS = {1: "JPEG", 2: "PNG"}
+
+
+
+def parse_binary_message(payload: bytes) -> Optional[Tuple[str, bytes]]:
+    """
+    解析WebSocket二进制帧（8字节头：事件类型、图像格式，均为大端uint32）
+
+    Returns:
+        Optional[Tuple[str, bytes]]: (图像格式, 图像数据)，不是图像帧时返回None
+    """
+    if len(payload) < 8:
+        return None
+    event_type, format_id = struct.unpack(">II", payload[:8])
+    if event_type != BINARY_PREVIEW_IMAGE:
+        return None
+    return BINARY_IMAGE_FORMATS.get(format_id, "PNG"), payload[8:]
+
+# 直接通过WebSocket回传图像的输出节点
+WEBSOCKET_OUTPUT_NODE = "SaveImageWebsocket"
+
+# 流式下载图像时每次读取的字节数
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# prompt开始执行前默认最多等待的秒数：prompt随ComfyUI重启丢失时等待者不会一直挂起
+DEFAULT_QUEUE_TIMEOUT = 1800
+
+
+class PromptExecutionError(Exception):
+    """ComfyUI执行prompt失败"""
+
+
+class BackendUnavailableError(PromptExecutionError):
+    """ComfyUI后端不可达，任务可以换一个后端重新提交"""
+
+
+def use_websocket_output(workflow: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    把工作流中的 SaveImage 节点改写为 SaveImageWebsocket
+
+    图像不再由ComfyUI编码写入服务器磁盘，而是以二进制帧通过WebSocket直接推送。
+
+    Args:
+        workflow: 原始工作流（不会被修改）
+
+    Returns:
+        Tuple: (改写后的工作流, 被改写的输出节点ID列表)
+    """
+    workflow = dict(workflow)
+    output_nodes = []
+    for node_id, node in workflow.items():
+        if node.get("class_type") == "SaveImage":
+            node = copy.deepcopy(node)
+            node["class_type"] = WEBSOCKET_OUTPUT_NODE
+            node["inputs"] = {"images": node["inputs"]["images"]}
+            workflow[node_id] = node
+            output_nodes.append(node_id)
+    return workflow, output_nodes
+
+
+class PromptWatcher:
+    """单个prompt的事件订阅，由 ComfyUIEventStream 按 prompt_id 投递事件"""
+
+    def __init__(self, prompt_id: str, output_nodes: Optional[List[str]] = None):
+        self.prompt_id = prompt_id
+        self.events: asyncio.Queue = asyncio.Queue()
+        self.done: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.outputs: Dict[str, Any] = {}
+        # 通过WebSocket直接回传图像的输出节点及收到的图像
+        self.output_nodes = set(output_nodes or [])
+        self.binary_images: List[Dict[str, Any]] = []
+        self.started = False
+        self.started_at: Optional[float] = None
+        # 订阅（提交）时间及最近一条属于本prompt的消息的时间，用于计算超时；
+        # 广播的队列状态消息不算本prompt的活动
+        self.created_at = time.monotonic()
+        self.last_activity = self.created_at
+
+    def feed(self, message: Dict[str, Any]):
+        """接收一条属于本prompt的消息"""
+        if self.done.done():
+            return
+        self.last_activity = time.monotonic()
+        msg_type = message.get("type")
+        data = message.get("data", {})
+        if msg_type == "binary_image":
+            if data.get("node") in self.output_nodes:
+                self.binary_images.append({"node": data["node"], "format": data["format"], "data": data["image"]})
+            else:
+                # 其他节点（采样器）回传的是采样过程中的预览帧
+                self.events.put_nowait({"type": "preview", "data": data})
+            return
+        if msg_type in ("execution_start", "execution_cached", "executing", "progress") and not self.started:
+            self.started = True
+            self.started_at = time.monotonic()
+        if msg_type == "executed" and data.get("output"):
+            self.outputs[data.get("node")] = data["output"]
+        self.events.put_nowait(message)
+
+        if msg_type == "executing" and data.get("node") is None:
+            self.finish()
+        elif msg_type == "execution_success":
+            self.finish()
+        elif msg_type == "execution_error":
+            self.finish(PromptExecutionError(data.get("exception_message", "执行出错")))
+        elif msg_type == "execution_interrupted":
+            self.finish(PromptExecutionError("执行被中断"))
+
+    def finish(self, error: Optional[Exception] = None):
+        """结束订阅，唤醒所有等待者"""
+        if self.done.done():
+            return
+        if error:
+            self.done.set_exception(error)
+        else:
+            self.done.set_result(self.outputs)
+        # None 作为事件流结束标记
+        self.events.put_nowait(None)
+
+    async def iter_events(self, inactivity_timeout: float = 30,
+                          queue_timeout: Optional[float] = DEFAULT_QUEUE_TIMEOUT,
+                          execution_timeout: Optional[float] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        逐条产出本prompt的消息，直到执行结束
+
+        超时都按绝对期限计算：其他prompt引起的队列状态广播会投递到这里，但不会推迟期限。
+
+        Args:
+            inactivity_timeout: 开始执行后两条本prompt的消息之间允许的最长间隔（秒）
+            queue_timeout: 从订阅起等待开始执行的最长时间，None表示不限制（仅用于确认prompt不会丢失的场景）
+            execution_timeout: 开始执行后允许的最长执行时间，None表示不限制
+
+        Raises:
+            asyncio.TimeoutError: 等待消息超时或超过执行期限
+            PromptExecutionError: ComfyUI报告执行失败
+        """
+        while True:
+            if self.started:
+                deadline = self.last_activity + inactivity_timeout
+                if execution_timeout is not None:
+                    deadline = min(deadline, self.started_at + execution_timeout)
+            else:
+                deadline = self.created_at + queue_timeout if queue_timeout is not None else None
+            if not self.events.empty():
+                event = self.events.get_nowait()
+            elif deadline is None:
+                event = await self.events.get()
+            else:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                event = await asyncio.wait_for(self.events.get(), remaining)
+            if event is None:
+                self.done.result()
+                return
+            yield event
+
+    async def wait(self, inactivity_timeout: float = 30,
+                   queue_timeout: Optional[float] = DEFAULT_QUEUE_TIMEOUT,
+                   execution_timeout: Optional[float] = None) -> Dict[str, Any]:
+        """等待执行结束并返回各输出节点的结果"""
+        async for _ in self.iter_events(inactivity_timeout, queue_timeout, execution_timeout):
+            pass
+        return self.done.result()
+
+
+class ComfyUIEventStream:
+    """单个ComfyUI后端的常驻WebSocket
+
+    整个进程对每个后端只保持一条WebSocket连接，后台任务读取消息并按 prompt_id
+    分发给对应的 PromptWatcher。断线后自动重连，并通过 /history/{prompt_id}
+    补齐断线期间已经完成的任务。
+    """
+
+    # 未注册prompt的消息最多缓存多少个prompt
+    MAX_ORPHANS = 256
+
+    def __init__(self, host: str, port: int, session: aiohttp.ClientSession,
+                 heartbeat: float = 30, max_reconnect_delay: float = 30):
+        self.host = host
+        self.port = port
+        self.base_url = f"http://{host}:{port}"
+        self.client_id = f"pegaai_{uuid.uuid4().hex}"
+        self.ws_url = f"ws://{host}:{port}/ws?clientId={self.client_id}"
+        self.session = session
+        self.heartbeat = heartbeat
+        self.max_reconnect_delay = max_reconnect_delay
+        self.ws = None
+        self.watchers: Dict[str, PromptWatcher] = {}
+        # 在 watch() 之前就到达的消息，注册时回放
+        self._orphans: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+        self.status: Dict[str, Any] = {}
+        self.current_prompt_id: Optional[str] = None
+        self.current_node: Optional[str] = None
+        # 后端是否提供某个节点类型 {class_type: bool}
+        self.node_support: Dict[str, bool] = {}
+        self.connected = asyncio.Event()
+        self.reconnects = 0
+        self._task: Optional[asyncio.Task] = None
+        # 当前prompt的开始时间和采样进度，以及prompt执行时长的指数移动平均（秒），用于估算取消节省的GPU时间
+        self.current_started_at: Optional[float] = None
+        self.current_fraction = 0.0
+        self.avg_duration: Optional[float] = None
+        # 已请求取消的prompt：从队列删除时可能恰好开始执行，开始后再中断
+        self._cancelled: "OrderedDict[str, None]" = OrderedDict()
+        self.dequeued = 0
+        self.interrupted = 0
+        self.gpu_seconds_saved = 0.0
+        # ComfyUI复用缓存输出的节点数和实际执行的节点数
+        self.cached_nodes = 0
+        self.executed_nodes = 0
+        # 应用关闭时置为True：等待者被取消也不再删除或中断prompt，留给重启后接管
+        self.detached = False
+        # 重新接管的prompt：执行消息只发给提交时的client_id，这里收不到，队列状态变化时查询历史记录
+        self._reattached: Set[str] = set()
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """启动后台读取任务"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self):
+        """停止后台任务并关闭连接"""
+        if self._refresh_task:
+            self._refresh_task.cancel()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.ws:
+            await self.ws.close()
+            self.ws = None
+        self.connected.clear()
+        for watcher in list(self.watchers.values()):
+            watcher.finish(PromptExecutionError("WebSocket已关闭"))
+        self.watchers.clear()
+
+    async def wait_connected(self, timeout: float = 10) -> bool:
+        """等待WebSocket连接就绪"""
+        self.start()
+        try:
+            await asyncio.wait_for(self.connected.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def watch(self, prompt_id: str, output_nodes: Optional[List[str]] = None) -> PromptWatcher:
+        """订阅某个prompt的事件"""
+        watcher = self.watchers.get(prompt_id)
+        if watcher is None:
+            watcher = PromptWatcher(prompt_id, output_nodes)
+            self.watchers[prompt_id] = watcher
+            for message in self._orphans.pop(prompt_id, []):
+                watcher.feed(message)
+        return watcher
+
+    def unwatch(self, prompt_id: str):
+        """取消订阅"""
+        self.watchers.pop(prompt_id, None)
+
+    def fail_pending(self, error: Exception):
+        """让所有等待中的prompt立即以error结束（后端被判定为不可用时调用）"""
+        for watcher in list(self.watchers.values()):
+            watcher.finish(error)
+
+    async def _run(self):
+        delay = 1
+        while True:
+            try:
+                self.ws = await self.session.ws_connect(self.ws_url, heartbeat=self.heartbeat)
+                logger.info(f"ComfyUI WebSocket已连接: {self.base_url}")
+                self.connected.set()
+                delay = 1
+                await self._recover_pending()
+                await self._read(self.ws)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"ComfyUI WebSocket异常 {self.base_url}: {str(e)}")
+            self.connected.clear()
+            self.reconnects += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    async def _read(self, ws):
+        async for msg in ws:
+            if msg.type == aiohttp.WSMsgType.TEXT:
+                try:
+                    self._dispatch(json.loads(msg.data))
+                except Exception as e:
+                    logger.error(f"处理WebSocket消息时出错: {str(e)}")
+            elif msg.type == aiohttp.WSMsgType.BINARY:
+                self._dispatch_binary(msg.data)
+            elif msg.type == aiohttp.WSMsgType.ERROR:
+                logger.error(f"WebSocket错误: {ws.exception()}")
+                break
+        logger.warning(f"ComfyUI WebSocket已断开: {self.base_url}")
+
+    def _dispatch(self, message: Dict[str, Any]):
+        msg_type = message.get("type")
+        data = message.get("data", {})
+
+        if msg_type == "status":
+            self.status = data.get("status", {})
+            # 队列状态对所有等待中的任务都有意义
+            for watcher in list(self.watchers.values()):
+                watcher.events.put_nowait(message)
+            if self._reattached and (self._refresh_task is None or self._refresh_task.done()):
+                self._refresh_task = asyncio.ensure_future(self._refresh_reattached())
+            return
+
+        prompt_id = data.get("prompt_id")
+        if not prompt_id:
+            return
+        if msg_type == "execution_start":
+            self._start_prompt(prompt_id)
+        elif msg_type == "execution_cached":
+            self.cached_nodes += len(data.get("nodes") or [])
+        elif msg_type == "executing":
+            if data.get("node"):
+                if prompt_id != self.current_prompt_id:
+                    self._start_prompt(prompt_id)
+                self.executed_nodes += 1
+            else:
+                self._finish_prompt()
+            self.current_node = data.get("node")
+        elif msg_type == "progress" and data.get("max"):
+            self.current_fraction = data.get("value", 0) / data["max"]
+        elif msg_type in ("execution_error", "execution_interrupted"):
+            self.current_prompt_id = None
+        self._route(prompt_id, message)
+
+    def _start_prompt(self, prompt_id: str):
+        self.current_prompt_id = prompt_id
+        self.current_started_at = time.monotonic()
+        self.current_fraction = 0.0
+        if prompt_id in self._cancelled:
+            # 取消请求到达时还在排队，删除前已经开始执行
+            asyncio.get_running_loop().create_task(self._interrupt(prompt_id))
+
+    def _finish_prompt(self):
+        """当前prompt正常执行完毕，更新平均执行时长"""
+        if self.current_prompt_id and self.current_started_at is not None \
+                and self.current_prompt_id not in self._cancelled:
+            duration = time.monotonic() - self.current_started_at
+            self.avg_duration = duration if self.avg_duration is None else 0.8 * self.avg_duration + 0.2 * duration
+        self.current_prompt_id = None
+        self.current_started_at = None
+
+    def _dispatch_binary(self, payload: bytes):
+        """二进制帧不带prompt_id，归属到当前正在执行的prompt和节点"""
+        frame = parse_binary_message(payload) if self.current_prompt_id else None
+        if frame is None:
+            return
+        image_format, image = frame
+        self._route(self.current_prompt_id, {
+            "type": "binary_image",
+            "data": {
+                "prompt_id": self.current_prompt_id,
+                "node": self.current_node,
+                "format": image_format,
+                "image": image,
+            },
+        })
+
+    def _route(self, prompt_id: str, message: Dict[str, Any]):
+        watcher = self.watchers.get(prompt_id)
+        if watcher:
+            watcher.feed(message)
+        else:
+            self._orphans.setdefault(prompt_id, []).append(message)
+            while len(self._orphans) > self.MAX_ORPHANS:
+                self._orphans.popitem(last=False)
+
+    def _remaining_seconds(self) -> float:
+        """估算当前prompt剩余的执行时间"""
+        if self.current_started_at is None:
+            return 0.0
+        elapsed = time.monotonic() - self.current_started_at
+        if self.current_fraction > 0:
+            return elapsed * (1 - self.current_fraction) / self.current_fraction
+        return max((self.avg_duration or 0.0) - elapsed, 0.0)
+
+    async def cancel(self, prompt_id: str) -> Optional[str]:
+        """
+        取消prompt：正在执行时 POST /interrupt，还在排队时 POST /queue 删除
+
+        Returns:
+            Optional[str]: "interrupted" 或 "dequeued"，请求失败时返回None
+        """
+        self._cancelled[prompt_id] = None
+        while len(self._cancelled) > self.MAX_ORPHANS:
+            self._cancelled.popitem(last=False)
+        try:
+            if prompt_id == self.current_prompt_id:
+                await self._interrupt(prompt_id)
+                return "interrupted"
+            async with self.session.post(f"{self.base_url}/queue", json={"delete": [prompt_id]}) as response:
+                if response.status != 200:
+                    raise Exception(f"状态码: {response.status}")
+        except Exception as e:
+            logger.error(f"取消prompt失败 {prompt_id}: {str(e)}")
+            return None
+        if prompt_id == self.current_prompt_id:
+            # 删除请求在途时开始执行，_start_prompt 已经发起中断
+            return "interrupted"
+        self.dequeued += 1
+        self.gpu_seconds_saved += self.avg_duration or 0.0
+        logger.info(f"已从ComfyUI队列删除: {prompt_id}")
+        return "dequeued"
+
+    async def _interrupt(self, prompt_id: str):
+        if prompt_id != self.current_prompt_id:
+            return
+        saved = self._remaining_seconds()
+        try:
+            # 新版ComfyUI按prompt_id中断，只在该prompt仍在执行时生效
+            async with self.session.post(f"{self.base_url}/interrupt", json={"prompt_id": prompt_id}) as response:
+                if response.status != 200:
+                    raise Exception(f"状态码: {response.status}")
+        except Exception as e:
+            logger.error(f"中断prompt失败 {prompt_id}: {str(e)}")
+            return
+        self.interrupted += 1
+        self.gpu_seconds_saved += saved
+        logger.info(f"已中断ComfyUI任务: {prompt_id}，预计节省 {saved:.1f} GPU秒")
+
+    def get_cancel_stats(self) -> Dict[str, Any]:
+        return {
+            "dequeued": self.dequeued,
+            "interrupted": self.interrupted,
+            "gpu_seconds_saved": round(self.gpu_seconds_saved, 1),
+            "avg_duration": round(self.avg_duration, 2) if self.avg_duration is not None else None,
+        }
+
+    def get_cache_stats(self) -> Dict[str, Any]:
+        total = self.cached_nodes + self.executed_nodes
+        return {
+            "cached_nodes": self.cached_nodes,
+            "executed_nodes": self.executed_nodes,
+            "hit_ratio": round(self.cached_nodes / total, 4) if total else 0.0,
+        }
+
+    async def supports_node(self, class_type: str) -> bool:
+        """查询后端是否安装了某个节点类型，结果按后端缓存"""
+        if class_type not in self.node_support:
+            try:
+                async with self.session.get(f"{self.base_url}/object_info/{class_type}") as response:
+                    info = await response.json() if response.status == 200 else {}
+                self.node_support[class_type] = class_type in info
+            except Exception as e:
+                logger.error(f"查询节点信息失败 {class_type}: {str(e)}")
+                return False
+        return self.node_support[class_type]
+
+    async def _recover_pending(self):
+        """
+        重连后通过 /history/{prompt_id} 补齐断线期间结束的任务
+
+        历史记录和队列中都没有的prompt（例如随ComfyUI重启丢失）以 BackendUnavailableError 结束，
+        由调用方换一个后端重新提交，不会一直等待下去。
+        """
+        missing = []
+        for prompt_id, watcher in list(self.watchers.items()):
+            try:
+                if not await self._apply_history(watcher):
+                    missing.append(watcher)
+            except Exception as e:
+                logger.error(f"查询历史记录失败 {prompt_id}: {str(e)}")
+        if not missing:
+            return
+        try:
+            queued = await self._queued_prompt_ids()
+            for watcher in missing:
+                # 两次查询之间恰好执行完的不算丢失
+                if watcher.prompt_id not in queued and not await self._apply_history(watcher):
+                    logger.warning(f"prompt已不在ComfyUI队列中: {watcher.prompt_id}")
+                    watcher.finish(BackendUnavailableError(f"prompt已丢失: {watcher.prompt_id}"))
+        except Exception as e:
+            logger.error(f"查询队列失败 {self.base_url}: {str(e)}")
+
+    async def _queued_prompt_ids(self) -> Set[str]:
+        """ComfyUI队列中正在执行和等待执行的prompt"""
+        async with self.session.get(f"{self.base_url}/queue") as response:
+            if response.status != 200:
+                raise Exception(f"获取队列失败，状态码: {response.status}")
+            queue = await response.json()
+        queued = queue.get("queue_running", []) + queue.get("queue_pending", [])
+        return {item[1] for item in queued if len(item) > 1}
+
+    async def _refresh_reattached(self):
+        """查询重新接管的prompt是否已经执行完"""
+        for prompt_id in list(self._reattached):
+            watcher = self.watchers.get(prompt_id)
+            try:
+                if watcher is None or watcher.done.done() or await self._apply_history(watcher):
+                    self._reattached.discard(prompt_id)
+            except Exception as e:
+                logger.error(f"查询历史记录失败 {prompt_id}: {str(e)}")
+
+    async def _apply_history(self, watcher: PromptWatcher) -> bool:
+        """
+        按 /history/{prompt_id} 结束已经执行完的任务
+
+        Returns:
+            bool: 历史记录中是否有该prompt
+        """
+        prompt_id = watcher.prompt_id
+        async with self.session.get(f"{self.base_url}/history/{prompt_id}") as response:
+            if response.status != 200:
+                return False
+            history = await response.json()
+        entry = history.get(prompt_id)
+        if not entry:
+            return False
+        status = entry.get("status", {})
+        if status.get("status_str") == "error":
+            watcher.finish(PromptExecutionError("执行出错"))
+        elif status.get("completed", True):
+            watcher.outputs.update(entry.get("outputs", {}))
+            watcher.finish()
+        return True
+
+    async def reattach(self, prompt_id: str, output_nodes: Optional[List[str]] = None) -> Optional[PromptWatcher]:
+        """
+        重新订阅之前（例如应用重启前）提交的prompt
+
+        已经执行完的从历史记录取回输出；仍在队列中或正在执行的，ComfyUI只把执行消息发给
+        原来的client_id，收不到进度，每次队列状态变化时查询历史记录判断是否执行完。
+
+        Returns:
+            Optional[PromptWatcher]: 历史记录和队列中都没有该prompt（后端重启或记录已清理）时返回None
+        """
+        # 先订阅再查询，查询期间到达的消息不会丢失
+        watcher = self.watch(prompt_id, output_nodes)
+        try:
+            if await self._apply_history(watcher):
+                return watcher
+            if prompt_id in await self._queued_prompt_ids():
+                self._reattached.add(prompt_id)
+                return watcher
+            # 两次查询之间恰好执行完
+            if await self._apply_history(watcher):
+                return watcher
+        except BaseException:
+            self.unwatch(prompt_id)
+            raise
+        self.unwatch(prompt_id)
+        return None
+
+
+class ComfyUIHistoryJanitor:
+    """后台清理ComfyUI服务器历史记录
+
+    prompt不再需要（结果已取回、执行失败、超时或被取消）时登记 prompt_id，超过保留时间后批量调用
+    POST /history {"delete": [...]} 删除，防止 /history 和ComfyUI进程内存无限增长。
+    关闭时不等保留期，立即删除全部已登记的记录，重启后不会遗留。
+    """
+
+    def __init__(self, host: str, port: int, session: aiohttp.ClientSession,
+                 retention: float = 60, interval: float = 10, batch_size: int = 50):
+        """
+        Args:
+            host: ComfyUI服务器地址
+            port: 服务器端口
+            session: 共享的aiohttp会话
+            retention: prompt不再需要后在服务器上保留的秒数，便于排查问题
+            interval: 清理检查间隔（秒）
+            batch_size: 每次请求最多删除的记录数
+        """
+        self.base_url = f"http://{host}:{port}"
+        self.session = session
+        self.retention = retention
+        self.interval = interval
+        self.batch_size = batch_size
+        # prompt_id -> 不再需要的时间
+        self.prunable: "OrderedDict[str, float]" = OrderedDict()
+        self.pruned = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """启动后台清理任务"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self):
+        """停止后台清理任务，并立即删除全部已登记的历史记录"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.prunable and not self.session.closed:
+            try:
+                await self.prune(force=True)
+            except Exception as e:
+                logger.error(f"清理ComfyUI历史记录失败 {self.base_url}: {str(e)}")
+
+    def mark_prunable(self, prompt_id: str):
+        """登记不再需要的prompt"""
+        self.prunable[prompt_id] = time.time()
+        self.start()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "history_pruned": self.pruned,
+            "history_pending_prune": len(self.prunable),
+        }
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.prune()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"清理ComfyUI历史记录失败 {self.base_url}: {str(e)}")
+
+    async def prune(self, force: bool = False) -> int:
+        """
+        删除已过保留期的历史记录，返回删除的条数
+
+        Args:
+            force: 不等保留期，删除全部已登记的记录
+        """
+        deadline = float("inf") if force else time.time() - self.retention
+        due = [prompt_id for prompt_id, marked_at in self.prunable.items() if marked_at <= deadline]
+        if not due:
+            return 0
+        pruned = 0
+        for i in range(0, len(due), self.batch_size):
+            batch = due[i:i + self.batch_size]
+            async with self.session.post(f"{self.base_url}/history", json={"delete": batch}) as response:
+                if response.status != 200:
+                    raise Exception(f"删除历史记录失败，状态码: {response.status}")
+            for prompt_id in batch:
+                self.prunable.pop(prompt_id, None)
+            pruned += len(batch)
+        self.pruned += pruned
+        logger.info(f"已清理ComfyUI历史记录 {pruned} 条: {self.base_url}")
+        return pruned
+
+
 class ComfyUIClient:
     """ComfyUI API客户端"""
     
-    def __init__(self, host="127.0.0.1", port=8188):
+    def __init__(self, host="127.0.0.1", port=8188, session: Optional[aiohttp.ClientSession] = None,
+                 events: Optional[ComfyUIEventStream] = None,
+                 janitor: Optional[ComfyUIHistoryJanitor] = None):
         """
         初始化ComfyUI客户端
         
         Args:
             host: ComfyUI服务器地址
             port: 服务器端口
+            session: 共享的aiohttp会话，为None时由客户端自行创建并在退出时关闭
+            events: 共享的WebSocket事件流，为None时由客户端按需创建并在退出时关闭
+            janitor: 历史记录清理器，为None时不清理服务器历史记录
         """
         self.host = host
         self.port = port
         self.base_url = f"http://{host}:{port}"
         self.ws_url = f"ws://{host}:{port}/ws"
-        self.session = None
+        self.session = session
+        self.owns_session = session is None
+        self.events = events
+        self.owns_events = events is None
+        self.janitor = janitor
         self.ws = None
         self.client_id = None
         
     async def __aenter__(self):
-        self.session = aiohttp.ClientSession()
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+            self.owns_session = True
         return self
         
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         if self.ws:
             await self.ws.close()
-        if self.session:
+            self.ws = None
+        # 借用的共享事件流和会话由注册表统一关闭
+        if self.events and self.owns_events:
+            await self.events.close()
+            self.events = None
+        if self.session and self.owns_session:
             await self.session.close()
+            self.session = None
+
+    def _get_events(self) -> ComfyUIEventStream:
+        if self.events is None:
+            if not self.session:
+                self.session = aiohttp.ClientSession()
+                self.owns_session = True
+            self.events = ComfyUIEventStream(self.host, self.port, self.session)
+            self.owns_events = True
+        self.events.start()
+        return self.events
+
+    def watch(self, prompt_id: str, output_nodes: Optional[List[str]] = None) -> PromptWatcher:
+        """订阅prompt的执行事件（进度、节点执行、完成与错误）"""
+        return self._get_events().watch(prompt_id, output_nodes)
+
+    async def apply_websocket_output(self, workflow: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[List[str]]]:
+        """
+        后端支持时把工作流改为通过WebSocket直接回传图像
+        
+        Returns:
+            Tuple: (工作流, WebSocket输出节点ID列表)；后端不支持时返回原工作流和None，
+            结果仍走 SaveImage + /view 下载
+        """
+        if not await self._get_events().supports_node(WEBSOCKET_OUTPUT_NODE):
+            logger.warning(f"后端未安装 {WEBSOCKET_OUTPUT_NODE} 节点，使用 /view 下载结果")
+            return workflow, None
+        workflow, output_nodes = use_websocket_output(workflow)
+        return workflow, output_nodes or None
+
+    def unwatch(self, prompt_id: str):
+        """取消对prompt的订阅"""
+        if self.events:
+            self.events.unwatch(prompt_id)
+
+    async def reattach(self, prompt_id: str, output_nodes: Optional[List[str]] = None) -> Optional[PromptWatcher]:
+        """重新订阅之前提交的prompt（见 ComfyUIEventStream.reattach）"""
+        events = self._get_events()
+        await events.wait_connected()
+        return await events.reattach(prompt_id, output_nodes)
+
+    async def cancel_prompt(self, prompt_id: str) -> Optional[str]:
+        """
+        取消不再需要的prompt，释放GPU（见 ComfyUIEventStream.cancel）
+
+        Returns:
+            Optional[str]: "interrupted"、"dequeued"，失败时为None
+        """
+        try:
+            return await self._get_events().cancel(prompt_id)
+        finally:
+            # 被中断的prompt同样留有历史记录
+            self.release_prompt(prompt_id)
+
+    def release_prompt(self, prompt_id: str):
+        """prompt不再需要（结果已取回、执行失败或已取消），交给清理器在保留期后删除服务器上的历史记录"""
+        if self.janitor:
+            self.janitor.mark_prunable(prompt_id)
+
+    async def delete_history(self, prompt_ids: List[str]):
+        """删除指定prompt的历史记录"""
+        async with self.session.post(f"{self.base_url}/history", json={"delete": prompt_ids}) as response:
+            if response.status != 200:
+                raise Exception(f"删除历史记录失败，状态码: {response.status}")
+
+    async def wait_for_prompt(self, prompt_id: str, inactivity_timeout: float = 30) -> Dict[str, Any]:
+        """
+        等待prompt执行结束
+        
+        Args:
+            prompt_id: 提交工作流返回的ID
+            inactivity_timeout: 开始执行后无任何消息的超时时间（秒）
+            
+        Returns:
+            Dict: 各输出节点的结果 {node_id: output}
+        """
+        watcher = self.watch(prompt_id)
+        try:
+            return await watcher.wait(inactivity_timeout)
+        finally:
+            self.unwatch(prompt_id)
             
     async def check_connection(self) -> bool:
         """检查与ComfyUI服务器的连接"""
         try:
             if not self.session:
                 self.session = aiohttp.ClientSession()
+                self.owns_session = True
             async with self.session.get(f"{self.base_url}/system_stats") as response:
                 return response.status == 200
         except Exception as e:
             logger.error(f"检查连接失败: {str(e)}")
             return False
             
+    async def get_system_stats(self) -> Dict[str, Any]:
+        """获取服务器系统状态（显存、设备等）"""
+        async with self.session.get(f"{self.base_url}/system_stats") as response:
+            if response.status != 200:
+                raise Exception(f"获取系统状态失败，状态码: {response.status}")
+            return await response.json()
+
+    async def get_queue(self) -> Dict[str, Any]:
+        """获取服务器队列（queue_running / queue_pending）"""
+        async with self.session.get(f"{self.base_url}/queue") as response:
+            if response.status != 200:
+                raise Exception(f"获取队列失败，状态码: {response.status}")
+            return await response.json()
+            
     async def execute_workflow(self, workflow: Dict[str, Any]) -> Optional[str]:
         """执行工作流并返回生成的图像URL"""
         try:
-            # 生成唯一的client_id
-            self.client_id = f"pegaai_{int(time.time())}"
-            
             # 提交工作流
-            prompt_id = await self.submit_prompt(workflow, self.client_id)
+            prompt_id = await self.submit_prompt(workflow)
             if not prompt_id:
                 raise Exception("提交工作流失败")
                 
-            # 连接WebSocket
-            if not await self.connect_websocket(self.client_id):
-                raise Exception("WebSocket连接失败")
-                
-            # 等待执行完成
-            last_status_time = time.time()
-            while True:
-                result = await self.listen_websocket()
-                current_time = time.time()
-                
-                if isinstance(result, dict):
-                    if result.get("type") == "executing" and result.get("data", {}).get("node") is None:
-                        # 执行完成，等待1秒后获取图像
-                        await asyncio.sleep(1)
-                        return await self.get_latest_image()
-                        
-                # 超时检查
-                if current_time - last_status_time > 30:
-                    raise Exception("执行超时")
-                    
-                await asyncio.sleep(0.1)
+            # 通过共享WebSocket等待执行完成，直接取本任务的输出
+            images = await self.wait_for_images(prompt_id)
+            return self.get_image_url(images[0]) if images else None
                 
+        except asyncio.TimeoutError:
+            logger.error("执行工作流失败: 执行超时")
+            return None
         except Exception as e:
             logger.error(f"执行工作流失败: {str(e)}")
             return None
+
+    async def wait_for_images(self, prompt_id: str, inactivity_timeout: float = 30,
+                              output_nodes: Optional[List[str]] = None,
+                              on_event: Optional[Callable[[Dict[str, Any]], None]] = None,
+                              execution_timeout: Optional[float] = None,
+                              queue_timeout: Optional[float] = DEFAULT_QUEUE_TIMEOUT) -> List[Dict[str, Any]]:
+        """
+        等待prompt执行结束并返回它的全部输出图像，on_event 逐条接收执行过程中的消息
+
+        等待超时、超过执行期限或被取消（调用方断开、所有等待者离开）时从ComfyUI队列删除或中断该prompt；
+        应用关闭（事件流已 detach）导致的取消除外。
+        """
+        watcher = self.watch(prompt_id, output_nodes)
+        try:
+            async for event in watcher.iter_events(inactivity_timeout, queue_timeout, execution_timeout):
+                if on_event:
+                    on_event(event)
+        except asyncio.CancelledError:
+            if not self._get_events().detached:
+                # shield：再次取消也不会打断已发出的取消请求
+                await asyncio.shield(self.cancel_prompt(prompt_id))
+            raise
+        except asyncio.TimeoutError:
+            await asyncio.shield(self.cancel_prompt(prompt_id))
+            raise
+        except PromptExecutionError:
+            self.release_prompt(prompt_id)
+            raise
+        finally:
+            self.unwatch(prompt_id)
+        return await self.collect_images(watcher)
+
+    async def collect_images(self, watcher: PromptWatcher) -> List[Dict[str, Any]]:
+        """汇总任务的输出图像：WebSocket直接回传的图像带 data 字段，其余为 /view 下载信息"""
+        if watcher.binary_images:
+            return list(watcher.binary_images)
+        return await self.get_prompt_images(watcher.prompt_id, watcher.outputs)
+
+    async def read_image(self, image: Dict[str, Any]) -> bytes:
+        """读取输出图像的二进制数据，已通过WebSocket回传的无需再请求 /view"""
+        if "data" in image:
+            return image["data"]
+        return await self.get_image(image["filename"], image.get("subfolder", ""), image.get("type", "output"))
+
+    async def stream_image(self, image: Dict[str, Any], sink, chunk_size: int = DOWNLOAD_CHUNK_SIZE):
+        """
+        把输出图像流式写入sink，不在内存中缓存整张图
+        
+        Args:
+            image: get_prompt_images/collect_images 返回的图像信息
+            sink: app.utils.image_sinks 中的写入目标
+            chunk_size: 每块的字节数
             
-    async def get_latest_image(self) -> Optional[str]:
-        """获取最新生成的图像URL"""
+        Returns:
+            传入的sink
+        """
         try:
-            async with self.session.get(f"{self.base_url}/history") as response:
-                if response.status == 200:
-                    history = await response.json()
-                    if history:
-                        latest_output = list(history.values())[-1]["outputs"]
-                        if latest_output:
-                            node_id = list(latest_output.keys())[0]
-                            image_data = latest_output[node_id]["images"][0]
-                            return f"{self.base_url}/view?filename={image_data['filename']}"
-                return None
+            if "data" in image:
+                # 已通过WebSocket回传
+                sink.write(image["data"])
+            else:
+                async with self.session.get(self.get_image_url(image)) as response:
+                    if response.status != 200:
+                        raise Exception(f"获取图片失败，状态码: {response.status}")
+                    async for chunk in response.content.iter_chunked(chunk_size):
+                        sink.write(chunk)
         except Exception as e:
-            logger.error(f"获取最新图像失败: {str(e)}")
-            return None
+            logger.error(f"下载图片失败: {str(e)}")
+            raise
+        finally:
+            sink.close()
+        return sink
+            
+    async def get_prompt_images(self, prompt_id: str,
+                                outputs: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        获取指定prompt的全部输出图像
+        
+        优先使用WebSocket executed 消息中收集到的输出，缺失时（如整图命中
+        ComfyUI缓存或断线重连）再查询 /history/{prompt_id}。
+        
+        Args:
+            prompt_id: 提交工作流返回的ID
+            outputs: 已收集到的输出 {node_id: output}
+            
+        Returns:
+            List[Dict]: 图像信息列表，每项包含 node、filename、subfolder、type
+        """
+        if not outputs:
+            entry = await self.get_history(prompt_id)
+            outputs = entry.get("outputs", {}) if entry else {}
+        images = []
+        for node_id, output in outputs.items():
+            for image in output.get("images", []):
+                images.append({"node": node_id, **image})
+        return images
+
+    def get_image_url(self, image: Dict[str, Any]) -> str:
+        """根据图像信息构造 /view 下载地址"""
+        params = urllib.parse.urlencode({
+            "filename": image["filename"],
+            "subfolder": image.get("subfolder", ""),
+            "type": image.get("type", "output"),
+        })
+        return f"{self.base_url}/view?{params}"
             
     async def connect_websocket(self, client_id=None):
         """连接到WebSocket服务器"""
@@ -126,6 +966,12 @@ class ComfyUIClient:
         """提交工作流到服务器"""
         if client_id:
             self.client_id = client_id
+        else:
+            # 使用共享WebSocket的client_id，执行事件才会推送到该连接
+            events = self._get_events()
+            if not await events.wait_connected():
+                logger.warning("WebSocket尚未连接，将在重连后通过历史记录获取结果")
+            self.client_id = events.client_id
         
         try:
             data = {
@@ -139,6 +985,10 @@ class ComfyUIClient:
                 else:
                     logger.error(f"提交工作流失败，状态码: {response.status}")
                     return None
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            # 连接不上后端与工作流本身有误不同，调用方可以换后端重试
+            logger.error(f"提交工作流时无法连接服务器: {str(e)}")
+            raise BackendUnavailableError(f"无法连接ComfyUI服务器 {self.base_url}: {str(e)}") from e
         except Exception as e:
             logger.error(f"提交工作流时出错: {str(e)}")
             return None
@@ -153,6 +1003,11 @@ class ComfyUIClient:
             msg = await self.ws.receive()
             if msg.type == aiohttp.WSMsgType.TEXT:
                 return json.loads(msg.data)
+            elif msg.type == aiohttp.WSMsgType.BINARY:
+                # 采样过程中的预览帧
+                frame = parse_binary_message(msg.data)
+                if frame:
+                    return {"type": "preview", "data": {"format": frame[0], "image": frame[1]}}
             elif msg.type == aiohttp.WSMsgType.CLOSED:
                 return {"type": "error", "error": "WebSocket closed"}
             elif msg.type == aiohttp.WSMsgType.ERROR:
@@ -163,18 +1018,21 @@ class ComfyUIClient:
         
         return None
             
-    async def get_image(self, filename: str) -> bytes:
+    async def get_image(self, filename: str, subfolder: str = "", image_type: str = "output") -> bytes:
         """
         获取生成的图片
         
         Args:
             filename: 图片文件名
+            subfolder: 图片所在子目录
+            image_type: 图片类型（output/temp/input）
             
         Returns:
             bytes: 图片二进制数据
         """
+        url = self.get_image_url({"filename": filename, "subfolder": subfolder, "type": image_type})
         try:
-            async with self.session.get(f"{self.base_url}/view?filename={filename}") as response:
+            async with self.session.get(url) as response:
                 if response.status == 200:
                     return await response.read()
                 else:
@@ -183,19 +1041,24 @@ class ComfyUIClient:
             logger.error(f"获取图片失败: {str(e)}")
             raise
             
-    async def get_history(self) -> Dict[str, Any]:
+    async def get_history(self, prompt_id: Optional[str] = None) -> Dict[str, Any]:
         """
         获取历史记录
         
+        Args:
+            prompt_id: 指定时只查询该prompt的记录，避免拉取整个历史
+            
         Returns:
-            Dict: 历史记录数据
+            Dict: 指定prompt_id时为该prompt的记录（不存在时为空字典），否则为全部历史记录
         """
+        url = f"{self.base_url}/history/{prompt_id}" if prompt_id else f"{self.base_url}/history"
         try:
-            async with self.session.get(f"{self.base_url}/history") as response:
+            async with self.session.get(url) as response:
                 if response.status == 200:
-                    return await response.json()
+                    history = await response.json()
+                    return history.get(prompt_id, {}) if prompt_id else history
                 else:
                     raise Exception(f"获取历史记录失败，状态码: {response.status}")
         except Exception as e:
             logger.error(f"获取历史记录失败: {str(e)}")
-            raise 
\ No newline at end of file
+            raise
@@ -0,0 +1,193 @@
+import aiohttp
+import logging
+from functools import lru_cache
+from typing import Dict, Any, Optional, List
+from app.core.config import get_settings
+from app.utils.comfyui_client import ComfyUIClient, ComfyUIEventStream, ComfyUIHistoryJanitor
+
+logger = logging.getLogger(__name__)
+
+
+class ComfyUIClientRegistry:
+    """进程级ComfyUI客户端注册表
+
+    所有ComfyUI请求共用同一个长连接的 aiohttp.ClientSession，每个后端只保持
+    一条常驻WebSocket，避免每次生成图像都重新建立TCP连接、DNS解析和WebSocket握手。
+    """
+
+    def __init__(self):
+        self.settings = get_settings()
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.event_streams: Dict[str, ComfyUIEventStream] = {}
+        self.janitors: Dict[str, ComfyUIHistoryJanitor] = {}
+        # 按后端统计的连接复用计数 {"host:port": {...}}
+        self.stats: Dict[str, Dict[str, int]] = {}
+
+    def _backend_stats(self, key: str) -> Dict[str, int]:
+        if key not in self.stats:
+            self.stats[key] = {
+                "requests": 0,
+                "connections_created": 0,
+                "connections_reused": 0,
+            }
+        return self.stats[key]
+
+    def _create_trace_config(self) -> aiohttp.TraceConfig:
+        """通过aiohttp的tracing钩子统计新建连接与复用连接的次数"""
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_request_start(session, ctx, params):
+            ctx.backend = f"{params.url.host}:{params.url.port}"
+            self._backend_stats(ctx.backend)["requests"] += 1
+
+        async def on_connection_create_end(session, ctx, params):
+            self._backend_stats(getattr(ctx, "backend", "unknown"))["connections_created"] += 1
+
+        async def on_connection_reuseconn(session, ctx, params):
+            self._backend_stats(getattr(ctx, "backend", "unknown"))["connections_reused"] += 1
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        return trace_config
+
+    def _create_session(self) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(
+            limit=self.settings.COMFYUI_POOL_LIMIT,
+            limit_per_host=self.settings.COMFYUI_POOL_LIMIT_PER_HOST,
+            keepalive_timeout=self.settings.COMFYUI_KEEPALIVE_TIMEOUT,
+            use_dns_cache=True,
+            ttl_dns_cache=self.settings.COMFYUI_DNS_CACHE_TTL,
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=None,  # 生成和下载耗时不固定，不设置总超时
+            connect=self.settings.COMFYUI_CONNECT_TIMEOUT,
+            sock_read=self.settings.COMFYUI_READ_TIMEOUT,
+        )
+        return aiohttp.ClientSession(
+            connector=connector,
+            timeout=timeout,
+            trace_configs=[self._create_trace_config()],
+        )
+
+    async def start(self):
+        """创建共享会话（FastAPI启动时调用）"""
+        if self.session is None or self.session.closed:
+            self.session = self._create_session()
+            logger.info("ComfyUI连接池已创建")
+
+    def detach(self):
+        """应用即将关闭：之后被取消的等待不再删除或中断已提交的prompt，重启后可以接管"""
+        for stream in self.event_streams.values():
+            stream.detached = True
+
+    async def close(self):
+        """关闭共享会话（FastAPI关闭时调用）"""
+        for stream in self.event_streams.values():
+            await stream.close()
+        self.event_streams.clear()
+        for janitor in self.janitors.values():
+            await janitor.close()
+        self.janitors.clear()
+        if self.session and not self.session.closed:
+            await self.session.close()
+            logger.info("ComfyUI连接池已关闭")
+        self.session = None
+
+    def get_client(self, host: str, port: int = 8188) -> ComfyUIClient:
+        """
+        借用一个绑定到共享会话的ComfyUI客户端
+
+        客户端对象本身很轻量，每个任务各取一个；退出 async with 时不会关闭共享会话。
+
+        Args:
+            host: ComfyUI服务器地址
+            port: 服务器端口
+
+        Returns:
+            ComfyUIClient: 使用共享连接池的客户端
+        """
+        return ComfyUIClient(host=host, port=port, session=self._get_session(),
+                             events=self.get_event_stream(host, port),
+                             janitor=self.get_janitor(host, port))
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            # 未经过FastAPI启动流程（如独立运行的Gradio界面）时按需创建
+            self.session = self._create_session()
+        return self.session
+
+    def get_event_stream(self, host: str, port: int = 8188) -> ComfyUIEventStream:
+        """获取后端的常驻WebSocket事件流，首次使用时建立连接"""
+        key = f"{host}:{port}"
+        stream = self.event_streams.get(key)
+        if stream is None or stream.session is not self._get_session():
+            stream = ComfyUIEventStream(
+                host, port, self._get_session(),
+                heartbeat=self.settings.COMFYUI_WS_HEARTBEAT,
+            )
+            self.event_streams[key] = stream
+        stream.start()
+        return stream
+
+    def get_janitor(self, host: str, port: int = 8188) -> ComfyUIHistoryJanitor:
+        """获取后端的历史记录清理器"""
+        key = f"{host}:{port}"
+        janitor = self.janitors.get(key)
+        if janitor is None or janitor.session is not self._get_session():
+            janitor = ComfyUIHistoryJanitor(
+                host, port, self._get_session(),
+                retention=self.settings.COMFYUI_HISTORY_RETENTION,
+                interval=self.settings.COMFYUI_HISTORY_PRUNE_INTERVAL,
+                batch_size=self.settings.COMFYUI_HISTORY_PRUNE_BATCH,
+            )
+            self.janitors[key] = janitor
+        return janitor
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取连接复用统计"""
+        result = {}
+        for backend, stats in self.stats.items():
+            connections = stats["connections_created"] + stats["connections_reused"]
+            result[backend] = {
+                **stats,
+                "websocket_connected": backend in self.event_streams and self.event_streams[backend].connected.is_set(),
+                "websocket_reconnects": self.event_streams[backend].reconnects if backend in self.event_streams else 0,
+                "reuse_rate": round(stats["connections_reused"] / connections, 4) if connections else 0.0,
+            }
+            if backend in self.janitors:
+                result[backend].update(self.janitors[backend].get_stats())
+        return result
+
+    def get_cancel_stats(self) -> Dict[str, Any]:
+        """取消的prompt数及估算节省的GPU时间，按后端及合计"""
+        backends = {key: stream.get_cancel_stats() for key, stream in self.event_streams.items()}
+        return {
+            "dequeued": sum(stats["dequeued"] for stats in backends.values()),
+            "interrupted": sum(stats["interrupted"] for stats in backends.values()),
+            "gpu_seconds_saved": round(sum(stats["gpu_seconds_saved"] for stats in backends.values()), 1),
+            "backends": backends,
+        }
+
+    def get_node_cache_stats(self, backends: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        ComfyUI报告的节点缓存命中情况，按后端及合计
+
+        Args:
+            backends: 只统计这些后端（"host:port"），None表示全部
+        """
+        streams = {key: stream for key, stream in self.event_streams.items() if backends is None or key in backends}
+        per_backend = {key: stream.get_cache_stats() for key, stream in streams.items()}
+        cached = sum(stats["cached_nodes"] for stats in per_backend.values())
+        executed = sum(stats["executed_nodes"] for stats in per_backend.values())
+        return {
+            "cached_nodes": cached,
+            "executed_nodes": executed,
+            "hit_ratio": round(cached / (cached + executed), 4) if cached + executed else 0.0,
+            "backends": per_backend,
+        }
+
+
+@lru_cache()
+def get_comfyui_registry() -> ComfyUIClientRegistry:
+    return ComfyUIClientRegistry()
@@ -0,0 +1,130 @@
+import bisect
+import itertools
+from typing import Dict, Any, Optional, List, Hashable, Iterator, Tuple
+
+
+class Priority:
+    """任务优先级类别"""
+    # 用户在页面上等待结果的请求
+    INTERACTIVE = "interactive"
+    # 大批量、可以慢慢跑的请求
+    BULK = "bulk"
+    ALL = (INTERACTIVE, BULK)
+
+
+# 各优先级类别的默认权重：交互请求获得更大的份额，但批量请求不会被饿死
+PRIORITY_WEIGHTS = {Priority.INTERACTIVE: 4.0, Priority.BULK: 1.0}
+
+
+class FairQueue:
+    """加权公平队列（自计时公平排队，SCFQ）
+
+    每个 (user_id, 优先级) 是一个流，流的权重由优先级决定。入队的条目获得虚拟完成时间
+    max(系统虚拟时间, 该流上一个条目的完成时间) + cost / 权重，按完成时间从小到大出队。
+    同一个用户连续提交200张图像只会排在自己的流里，其他用户的请求仍按份额穿插执行。
+    条目可以不按顺序取出（例如排在前面的条目暂时无法分配），不影响其他流的份额。
+
+    sjf 策略不累计流的完成时间，完成时间只取决于入队时的虚拟时间和代价：
+    同时等待的请求中预测执行时间短的先执行，而虚拟时间随出队推进，
+    等待已久的长任务不会被后来的短任务无限期推后。
+    """
+
+    FAIR = "fair"
+    SJF = "sjf"
+
+    def __init__(self, weights: Optional[Dict[str, float]] = None, policy: str = FAIR):
+        """
+        Args:
+            weights: 优先级类别 -> 权重
+            policy: fair 或 sjf
+        """
+        self.weights = {**PRIORITY_WEIGHTS, **(weights or {})}
+        self.policy = policy
+        self.virtual_time = 0.0
+        # 按 (完成时间, 入队序号) 排序的条目
+        self._entries: List[Tuple[float, int, Any]] = []
+        self._tags: Dict[int, Tuple[float, int]] = {}
+        self._flows: Dict[Any, float] = {}
+        self._info: Dict[int, Tuple[Hashable, str]] = {}
+        self._seq = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self) -> Iterator[Any]:
+        """按出队顺序遍历条目"""
+        return iter([item for _, _, item in self._entries])
+
+    def __contains__(self, item: Any) -> bool:
+        return id(item) in self._tags
+
+    def push(self, item: Any, user_id: Hashable = None, priority: str = Priority.INTERACTIVE, cost: float = 1):
+        """
+        加入队列
+
+        Args:
+            item: 条目（按对象身份区分）
+            user_id: 提交者，None表示匿名请求（共用一个流）
+            priority: 优先级类别
+            cost: 条目的代价（预测的执行秒数）
+        """
+        flow = (user_id, priority)
+        weight = self.weights.get(priority, 1.0)
+        start = self.virtual_time if self.policy == self.SJF else max(self.virtual_time, self._flows.get(flow, 0.0))
+        finish = start + cost / weight
+        self._flows[flow] = finish
+        entry = (finish, next(self._seq), item)
+        # 入队序号唯一，比较不会涉及条目本身
+        bisect.insort(self._entries, entry)
+        self._tags[id(item)] = entry[:2]
+        self._info[id(item)] = (user_id, priority)
+
+    def first(self) -> Optional[Any]:
+        return self._entries[0][2] if self._entries else None
+
+    def take(self, item: Any):
+        """条目出队执行，系统虚拟时间推进到它的完成时间"""
+        finish, _ = self._tags[id(item)]
+        self._discard(item)
+        self.virtual_time = max(self.virtual_time, finish)
+        # 完成时间已经落后于虚拟时间的流与新流等价，不再保留
+        self._flows = {flow: tag for flow, tag in self._flows.items() if tag > self.virtual_time}
+
+    def remove(self, item: Any) -> bool:
+        """
+        撤回条目（调用方取消），不推进虚拟时间
+
+        Returns:
+            bool: 条目是否在队列中
+        """
+        if id(item) not in self._tags:
+            return False
+        self._discard(item)
+        return True
+
+    def _discard(self, item: Any):
+        tag = self._tags.pop(id(item))
+        del self._info[id(item)]
+        index = bisect.bisect_left(self._entries, tag)
+        del self._entries[index]
+
+    def position(self, item: Any) -> Optional[int]:
+        """条目前面还有多少个条目，不在队列中时返回None"""
+        tag = self._tags.get(id(item))
+        if tag is None:
+            return None
+        return bisect.bisect_left(self._entries, tag)
+
+    def get_stats(self) -> Dict[str, Any]:
+        by_priority: Dict[str, int] = {}
+        by_user: Dict[str, int] = {}
+        for user_id, priority in self._info.values():
+            by_priority[priority] = by_priority.get(priority, 0) + 1
+            by_user[str(user_id)] = by_user.get(str(user_id), 0) + 1
+        return {
+            "policy": self.policy,
+            "waiting": len(self._entries),
+            "by_priority": by_priority,
+            "by_user": by_user,
+            "virtual_time": round(self.virtual_time, 4),
+        }
@@ -0,0 +1,109 @@
+import logging
+from collections import deque
+from functools import lru_cache
+from typing import Dict, Any
+from app.core.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+
+class HedgingPolicy:
+    """对冲提交策略
+
+    记录提交到ComfyUI后到开始执行的等待时间，主请求超过其分位数（默认p95）仍未开始执行时，
+    认为所在后端卡住了（模型加载慢、队列阻塞），在另一个健康后端上提交一份相同的请求，
+    先完成的胜出，另一份从队列删除或中断。
+    对冲次数受预算限制：每个请求积累 budget 个令牌、最多积累 burst 个，每次对冲消耗一个，
+    额外增加的GPU负载不超过请求数的 budget 倍。
+    """
+
+    # 保留的最近等待时间样本数
+    WINDOW = 200
+
+    def __init__(self, enabled: bool = False, quantile: float = 0.95, min_delay: float = 2,
+                 default_delay: float = 30, min_samples: int = 20, budget: float = 0.1, burst: float = 5):
+        """
+        Args:
+            enabled: 是否启用对冲
+            quantile: 对冲阈值取开始执行等待时间的哪个分位数
+            min_delay: 对冲阈值下限（秒）
+            default_delay: 样本不足时的对冲阈值（秒）
+            min_samples: 按分位数计算阈值所需的最少样本数
+            budget: 每个请求积累的对冲令牌数（对冲请求占比上限）
+            burst: 最多积累的对冲令牌数
+        """
+        self.enabled = enabled
+        self.quantile = quantile
+        self.min_delay = min_delay
+        self.default_delay = default_delay
+        self.min_samples = min_samples
+        self.budget = budget
+        self.burst = burst
+        self.tokens = burst
+        self.samples = deque(maxlen=self.WINDOW)
+        self.requests = 0
+        self.hedged = 0
+        self.denied = 0
+        self.hedge_wins = 0
+
+    @classmethod
+    def from_settings(cls) -> "HedgingPolicy":
+        settings = get_settings()
+        return cls(
+            enabled=settings.HEDGING_ENABLED,
+            quantile=settings.HEDGING_QUANTILE,
+            min_delay=settings.HEDGING_MIN_DELAY,
+            default_delay=settings.HEDGING_DEFAULT_DELAY,
+            min_samples=settings.HEDGING_MIN_SAMPLES,
+            budget=settings.HEDGING_BUDGET,
+            burst=settings.HEDGING_BURST,
+        )
+
+    def observe_start(self, seconds: float):
+        """记录一次从提交到开始执行的等待时间"""
+        self.samples.append(seconds)
+
+    def delay(self) -> float:
+        """主请求提交后等待多久仍未开始执行时发起对冲（秒）"""
+        if len(self.samples) < self.min_samples:
+            return max(self.default_delay, self.min_delay)
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(self.quantile * len(ordered)))
+        return max(ordered[index], self.min_delay)
+
+    def record_request(self):
+        """新的请求积累对冲预算"""
+        self.requests += 1
+        self.tokens = min(self.burst, self.tokens + self.budget)
+
+    def try_hedge(self) -> bool:
+        """预算足够时扣除一个令牌并允许对冲"""
+        if self.tokens < 1:
+            self.denied += 1
+            return False
+        self.tokens -= 1
+        self.hedged += 1
+        return True
+
+    def record_win(self, hedge: bool):
+        """对冲后先完成的一方"""
+        if hedge:
+            self.hedge_wins += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "delay": round(self.delay(), 2),
+            "samples": len(self.samples),
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "hedge_ratio": round(self.hedged / self.requests, 4) if self.requests else 0.0,
+            "hedge_wins": self.hedge_wins,
+            "denied_by_budget": self.denied,
+            "tokens": round(self.tokens, 2),
+        }
+
+
+@lru_cache()
+def get_hedging_policy() -> HedgingPolicy:
+    return HedgingPolicy.from_settings()
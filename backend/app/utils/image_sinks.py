@@ -0,0 +1,94 @@
+import base64
+import tempfile
+from pathlib import Path
+from typing import Iterator
+
+
+class ImageSink:
+    """图像数据的写入目标
+
+    ComfyUIClient.stream_image 把 /view 的响应按块写入sink，
+    单个任务占用的内存只与块大小有关，与图像大小无关。
+    """
+
+    def write(self, chunk: bytes):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class FileSink(ImageSink):
+    """直接写入磁盘文件"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.size = 0
+        self._file = None
+
+    def write(self, chunk: bytes):
+        if self._file is None:
+            self._file = open(self.path, "wb")
+        self._file.write(chunk)
+        self.size += len(chunk)
+
+    def close(self):
+        if self._file is None:
+            # 空结果也要生成文件，与直接写文件的行为一致
+            self._file = open(self.path, "wb")
+        self._file.close()
+
+
+class SpooledSink(ImageSink):
+    """内存缓冲，超过阈值后自动落盘到临时文件"""
+
+    def __init__(self, max_memory: int = 4 * 1024 * 1024):
+        """
+        Args:
+            max_memory: 内存中最多缓存的字节数，超过后转存到临时文件
+        """
+        self._file = tempfile.SpooledTemporaryFile(max_size=max_memory)
+        self.size = 0
+
+    def write(self, chunk: bytes):
+        self._file.write(chunk)
+        self.size += len(chunk)
+
+    def iter_chunks(self, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+        """从头开始按块读取已写入的数据"""
+        self._file.seek(0)
+        while True:
+            chunk = self._file.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def getvalue(self) -> bytes:
+        return b"".join(self.iter_chunks())
+
+    def to_base64(self, chunk_size: int = 48 * 1024) -> str:
+        """分块编码为base64，块大小为3的倍数时各段可以直接拼接"""
+        chunk_size -= chunk_size % 3
+        return "".join(base64.b64encode(chunk).decode() for chunk in self.iter_chunks(chunk_size))
+
+    def close(self):
+        # 数据还要被读取，由 release() 释放
+        pass
+
+    def release(self):
+        self._file.close()
+
+
+class TeeSink(ImageSink):
+    """把同一份数据同时写入多个sink"""
+
+    def __init__(self, *sinks: ImageSink):
+        self.sinks = sinks
+
+    def write(self, chunk: bytes):
+        for sink in self.sinks:
+            sink.write(chunk)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
@@ -0,0 +1,109 @@
+import asyncio
+import io
+import logging
+from typing import Optional, Tuple
+from PIL import Image
+from app.core.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# 编码格式 -> MIME类型
+PREVIEW_MIME_TYPES = {"WEBP": "image/webp", "JPEG": "image/jpeg", "PNG": "image/png"}
+
+
+class PreviewBuffer:
+    """采样过程中的预览帧缓冲
+
+    只保留最新的一帧，新帧直接覆盖旧帧；解码、缩小和重新编码在线程池中进行，
+    并且只在有人读取时才处理，同一帧的处理结果在所有读取者之间共享。
+    采样速度再快也不会让预览帧在内存或事件循环中堆积。
+    """
+
+    def __init__(self, max_size: int = 512, image_format: str = "WEBP", quality: int = 75):
+        """
+        Args:
+            max_size: 预览图最长边（像素），0表示不缩小
+            image_format: 重新编码的格式（WEBP、JPEG 或 PNG）
+            quality: 有损编码的质量
+        """
+        self.max_size = max_size
+        self.image_format = image_format.upper()
+        self.quality = quality
+        # 收到的帧数，同时作为当前帧的版本号
+        self.version = 0
+        self._raw: Optional[bytes] = None
+        self._encoded: Optional[bytes] = None
+        self._encoded_version = 0
+        self._image: Optional[Image.Image] = None
+        self._image_version = 0
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    def from_settings(cls) -> "PreviewBuffer":
+        settings = get_settings()
+        return cls(settings.PREVIEW_MAX_SIZE, settings.PREVIEW_FORMAT, settings.PREVIEW_QUALITY)
+
+    @property
+    def media_type(self) -> str:
+        return PREVIEW_MIME_TYPES.get(self.image_format, "application/octet-stream")
+
+    def update(self, image: bytes):
+        """收到新的预览帧（ComfyUI回传的JPEG/PNG数据），覆盖尚未处理的旧帧"""
+        self._raw = image
+        self.version += 1
+
+    def clear(self):
+        """任务结束后释放预览数据"""
+        self._raw = None
+        self._encoded = None
+        self._image = None
+
+    def _decode(self, raw: bytes) -> Image.Image:
+        image = Image.open(io.BytesIO(raw))
+        image.load()
+        if self.max_size and max(image.size) > self.max_size:
+            image.thumbnail((self.max_size, self.max_size))
+        return image
+
+    def _encode(self, raw: bytes) -> bytes:
+        image = self._decode(raw)
+        if image.mode not in ("RGB", "RGBA") or (self.image_format == "JPEG" and image.mode != "RGB"):
+            image = image.convert("RGB")
+        output = io.BytesIO()
+        image.save(output, format=self.image_format, quality=self.quality)
+        return output.getvalue()
+
+    async def get(self) -> Optional[Tuple[int, bytes]]:
+        """
+        获取重新编码后的最新预览帧
+
+        Returns:
+            Optional[Tuple[int, bytes]]: (版本号, 编码后的图像数据)，还没有收到预览帧时返回None
+        """
+        async with self._lock:
+            if self._raw is None:
+                return None
+            if self._encoded_version != self.version:
+                version, raw = self.version, self._raw
+                try:
+                    encoded = await asyncio.get_running_loop().run_in_executor(None, self._encode, raw)
+                except Exception as e:
+                    logger.error(f"预览帧编码失败: {str(e)}")
+                    return None
+                self._encoded, self._encoded_version = encoded, version
+            return self._encoded_version, self._encoded
+
+    async def get_image(self) -> Optional[Image.Image]:
+        """获取缩小后的最新预览帧（PIL图像），供Gradio等直接显示图像对象的界面使用"""
+        async with self._lock:
+            if self._raw is None:
+                return None
+            if self._image_version != self.version:
+                version, raw = self.version, self._raw
+                try:
+                    image = await asyncio.get_running_loop().run_in_executor(None, self._decode, raw)
+                except Exception as e:
+                    logger.error(f"预览帧解码失败: {str(e)}")
+                    return None
+                self._image, self._image_version = image, version
+            return self._image
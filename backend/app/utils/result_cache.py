@@ -0,0 +1,233 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import uuid
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Any, Optional, List, Tuple
+from app.core.config import get_settings
+from app.utils.image_sinks import ImageSink, FileSink
+
+logger = logging.getLogger(__name__)
+
+# 不影响生成结果的输入，计算缓存键时忽略
+IGNORED_INPUTS = {"filename_prefix"}
+
+
+class CacheEntrySink(FileSink):
+    """写入缓存目录中的临时文件，ResultCache.commit 后才对外可见"""
+
+    def __init__(self, key: str, index: int, path: Path):
+        super().__init__(path)
+        self.key = key
+        self.index = index
+
+
+class ResultCache:
+    """按工作流内容寻址的生成结果缓存
+
+    缓存键是填好参数后完整工作流（模型、提示词、种子、步数、尺寸、采样器等）
+    规范化JSON的SHA-256。种子固定时相同的工作流必然生成相同的图像，
+    命中后直接返回磁盘上的结果，不再占用GPU。一次执行输出多张图像（batch）时
+    按输出顺序保存为 {键}-{序号}.png。
+    磁盘总大小超过上限时按最近最少使用淘汰；内存中只保存 键 -> (图像数, 总大小) 的索引。
+    缓存目录在第一次使用时才创建和扫描；读写、复制、删除文件都在线程池中执行，不阻塞事件循环，
+    索引只在事件循环中修改。
+    """
+
+    def __init__(self, directory: Path, max_bytes: int = 1024 * 1024 * 1024):
+        """
+        Args:
+            directory: 缓存目录
+            max_bytes: 缓存文件总大小上限（字节）
+        """
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.index: "OrderedDict[str, Tuple[int, int]]" = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._loaded = False
+        self._loading: Optional[asyncio.Lock] = None
+
+    @staticmethod
+    def key_for(workflow: Dict[str, Any]) -> str:
+        """计算工作流的规范化哈希"""
+        canonical = {
+            node_id: {
+                "class_type": node["class_type"],
+                "inputs": {name: value for name, value in node["inputs"].items() if name not in IGNORED_INPUTS},
+            }
+            for node_id, node in workflow.items()
+        }
+        data = json.dumps(canonical, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def path_for(self, key: str, index: int = 0) -> Path:
+        return self.directory / f"{key}-{index}.png"
+
+    def paths_for(self, key: str) -> List[Path]:
+        count, _ = self.index[key]
+        return [self.path_for(key, i) for i in range(count)]
+
+    async def _ensure_loaded(self):
+        """第一次使用时创建缓存目录并扫描已有条目"""
+        if self._loaded:
+            return
+        if self._loading is None:
+            self._loading = asyncio.Lock()
+        async with self._loading:
+            if self._loaded:
+                return
+            entries = await asyncio.to_thread(self._scan)
+            for key, count, size in entries:
+                self.index[key] = (count, size)
+                self.size += size
+            self._loaded = True
+        await self._evict()
+
+    def _scan(self) -> List[Tuple[str, int, int]]:
+        """
+        扫描缓存目录，按修改时间（即最近使用时间）返回LRU顺序的 (键, 图像数, 总大小)
+
+        只认从序号0开始连续的图像，中间缺失时（例如删除或写入中断）之后的文件无法对应输出顺序，一并删除。
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        for path in self.directory.glob("*.tmp"):
+            # 上次进程退出时未写完的条目
+            path.unlink(missing_ok=True)
+        files: Dict[str, Dict[int, Path]] = {}
+        for path in self.directory.glob("*-*.png"):
+            key, _, index = path.stem.rpartition("-")
+            if index.isdigit():
+                files.setdefault(key, {})[int(index)] = path
+        entries = []
+        for key, paths in files.items():
+            count = 0
+            while count in paths:
+                count += 1
+            for index, path in paths.items():
+                if index >= count:
+                    path.unlink(missing_ok=True)
+            if count == 0:
+                continue
+            stats = [paths[index].stat() for index in range(count)]
+            entries.append((max(stat.st_mtime for stat in stats), key, count, sum(stat.st_size for stat in stats)))
+        return [(key, count, size) for _, key, count, size in sorted(entries)]
+
+    async def get(self, key: str) -> Optional[List[Path]]:
+        """
+        查询缓存
+
+        Returns:
+            Optional[List[Path]]: 命中时按输出顺序返回缓存文件路径
+        """
+        await self._ensure_loaded()
+        if key in self.index:
+            paths = self.paths_for(key)
+            try:
+                # 记录最近使用时间，重启后LRU顺序不丢失
+                await asyncio.to_thread(self._touch, paths)
+            except OSError:
+                if key in self.index:
+                    await self._remove(key)
+            else:
+                # 等待期间可能已被淘汰
+                if key in self.index:
+                    self.index.move_to_end(key)
+                    self.hits += 1
+                    return paths
+        self.misses += 1
+        return None
+
+    @staticmethod
+    def _touch(paths: List[Path]):
+        for path in paths:
+            os.utime(path)
+
+    async def open_entry(self, key: str, index: int = 0) -> CacheEntrySink:
+        """创建写入新条目（第index张图像）的sink"""
+        await self._ensure_loaded()
+        return CacheEntrySink(key, index, self.directory / f"{key}-{index}.{uuid.uuid4().hex}.tmp")
+
+    async def commit(self, entries: List[CacheEntrySink]):
+        """同一个键的全部图像写入完成后加入缓存"""
+        key = entries[0].key
+        if key in self.index:
+            await self._remove(key)
+        await asyncio.to_thread(self._publish, key, entries)
+        size = sum(entry.size for entry in entries)
+        self.index[key] = (len(entries), size)
+        self.size += size
+        await self._evict()
+
+    def _publish(self, key: str, entries: List[CacheEntrySink]):
+        for entry in entries:
+            os.replace(entry.path, self.path_for(key, entry.index))
+
+    def discard(self, entry: CacheEntrySink):
+        """丢弃写入失败的条目（取消时也要执行，不经过线程池）"""
+        entry.close()
+        entry.path.unlink(missing_ok=True)
+
+    async def _remove(self, key: str):
+        # 先从索引移除，删除文件期间不会再被查到
+        paths = self.paths_for(key)
+        _, size = self.index.pop(key)
+        self.size -= size
+        await asyncio.to_thread(self._unlink, paths)
+
+    @staticmethod
+    def _unlink(paths: List[Path]):
+        for path in paths:
+            path.unlink(missing_ok=True)
+
+    async def _evict(self):
+        victims = []
+        while self.size > self.max_bytes and self.index:
+            key = next(iter(self.index))
+            victims.extend(self.paths_for(key))
+            _, size = self.index.pop(key)
+            self.size -= size
+            self.evictions += 1
+        if victims:
+            await asyncio.to_thread(self._unlink, victims)
+
+    async def deliver(self, path: Path, sink: ImageSink, chunk_size: int = 64 * 1024) -> ImageSink:
+        """把缓存文件按块写入调用方的sink（在线程池中读取）"""
+        return await asyncio.to_thread(self._copy, path, sink, chunk_size)
+
+    @staticmethod
+    def _copy(path: Path, sink: ImageSink, chunk_size: int) -> ImageSink:
+        try:
+            with open(path, "rb") as f:
+                while True:
+                    chunk = f.read(chunk_size)
+                    if not chunk:
+                        break
+                    sink.write(chunk)
+        finally:
+            sink.close()
+        return sink
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": len(self.index),
+            "size_bytes": self.size,
+            "max_bytes": self.max_bytes,
+        }
+
+
+@lru_cache()
+def get_result_cache() -> ResultCache:
+    settings = get_settings()
+    return ResultCache(Path(settings.RESULT_CACHE_DIR), settings.RESULT_CACHE_MAX_BYTES)
@@ -0,0 +1,171 @@
+import logging
+from functools import lru_cache
+from typing import Dict, Any, Optional, Tuple
+from app.core.config import get_settings
+from app.utils.workflow_templates import PARAMETER_ROLES
+
+logger = logging.getLogger(__name__)
+
+# 加载模型的节点及其模型文件输入，模型不同执行时间差别很大
+MODEL_LOADERS = {"UNETLoader": "unet_name", "CheckpointLoaderSimple": "ckpt_name"}
+
+# 默认预计时间对应的工作量：1024x1024、20步、单张（百万像素·步）
+REFERENCE_WORK = 1024 * 1024 * 20 / 1e6
+
+
+def workflow_features(workflow: Dict[str, Any]) -> Tuple[float, Optional[str]]:
+    """
+    提取决定执行时间的特征
+
+    Returns:
+        Tuple[float, Optional[str]]: (工作量 = 宽×高×batch×步数 / 10^6, 模型文件名)
+    """
+    values: Dict[str, Any] = {}
+    for role in ("width", "height", "batch_size", "steps"):
+        for class_type, input_name in PARAMETER_ROLES[role]:
+            for node in workflow.values():
+                if node["class_type"] == class_type and isinstance(node["inputs"].get(input_name), (int, float)):
+                    values.setdefault(role, node["inputs"][input_name])
+    model = None
+    for node in workflow.values():
+        input_name = MODEL_LOADERS.get(node["class_type"])
+        if input_name and isinstance(node["inputs"].get(input_name), str):
+            model = node["inputs"][input_name]
+            break
+    work = values.get("width", 1024) * values.get("height", 1024) * values.get("batch_size", 1) \
+        * values.get("steps", 20) / 1e6
+    return work, model
+
+
+class _Regression:
+    """带遗忘因子的一元线性回归 duration = a + b * work，近期样本权重更大"""
+
+    def __init__(self, decay: float = 0.95):
+        self.decay = decay
+        self.weight = 0.0
+        self.sum_x = 0.0
+        self.sum_y = 0.0
+        self.sum_xx = 0.0
+        self.sum_xy = 0.0
+        self.samples = 0
+
+    def add(self, x: float, y: float):
+        for name in ("weight", "sum_x", "sum_y", "sum_xx", "sum_xy"):
+            setattr(self, name, getattr(self, name) * self.decay)
+        self.weight += 1
+        self.sum_x += x
+        self.sum_y += y
+        self.sum_xx += x * x
+        self.sum_xy += x * y
+        self.samples += 1
+
+    def coefficients(self) -> Optional[Tuple[float, float]]:
+        """(a, b)；工作量都相同时退化为按比例缩放（a=0）"""
+        if not self.weight or not self.sum_x:
+            return None
+        variance = self.weight * self.sum_xx - self.sum_x ** 2
+        if self.samples >= 3 and variance > 1e-9 * self.weight ** 2:
+            b = (self.weight * self.sum_xy - self.sum_x * self.sum_y) / variance
+            a = (self.sum_y - b * self.sum_x) / self.weight
+            if b > 0 and a >= 0:
+                return a, b
+        return 0.0, self.sum_y / self.sum_x
+
+    def predict(self, x: float) -> Optional[float]:
+        coefficients = self.coefficients()
+        if coefficients is None:
+            return None
+        a, b = coefficients
+        return a + b * x
+
+
+class RuntimeModel:
+    """按已完成任务学习的执行时间模型
+
+    对每个 (后端, 模型文件) 拟合 执行时间 ≈ a + b × (宽×高×batch×步数)，
+    a 近似模型加载、文本编码、VAE解码等固定开销。某个后端或模型还没有样本时
+    依次退回到所有后端上该模型的拟合、全局拟合，最后按默认时间和工作量比例估算。
+    预测结果用于ETA、每个任务的超时期限以及调度代价。
+    """
+
+    def __init__(self, default_seconds: float = 20, deadline_factor: float = 3, deadline_grace: float = 30,
+                 inactivity_ratio: float = 0.5, inactivity_min: float = 15, inactivity_max: float = 300):
+        """
+        Args:
+            default_seconds: 没有任何样本时 1024x1024、20步、单张的预计执行时间（秒）
+            deadline_factor: 执行期限 = 预测时间 × deadline_factor + deadline_grace
+            deadline_grace: 执行期限的固定余量（秒）
+            inactivity_ratio: 无消息超时 = 预测时间 × inactivity_ratio，限制在 [inactivity_min, inactivity_max]
+            inactivity_min: 无消息超时下限（秒）
+            inactivity_max: 无消息超时上限（秒）
+        """
+        self.default_seconds = default_seconds
+        self.deadline_factor = deadline_factor
+        self.deadline_grace = deadline_grace
+        self.inactivity_ratio = inactivity_ratio
+        self.inactivity_min = inactivity_min
+        self.inactivity_max = inactivity_max
+        # (后端, 模型) -> 回归，后端或模型为None表示汇总
+        self.regressions: Dict[Tuple[Optional[str], Optional[str]], _Regression] = {}
+
+    @classmethod
+    def from_settings(cls) -> "RuntimeModel":
+        settings = get_settings()
+        return cls(
+            default_seconds=settings.RUNTIME_DEFAULT_SECONDS,
+            deadline_factor=settings.RUNTIME_DEADLINE_FACTOR,
+            deadline_grace=settings.RUNTIME_DEADLINE_GRACE,
+            inactivity_ratio=settings.RUNTIME_INACTIVITY_RATIO,
+            inactivity_min=settings.RUNTIME_INACTIVITY_MIN,
+            inactivity_max=settings.RUNTIME_INACTIVITY_MAX,
+        )
+
+    def observe(self, workflow: Dict[str, Any], backend: Optional[str], duration: float):
+        """记录一次完成的执行（从开始执行到输出完成的秒数）"""
+        work, model = workflow_features(workflow)
+        if work <= 0 or duration <= 0:
+            return
+        for key in {(backend, model), (None, model), (None, None)}:
+            self.regressions.setdefault(key, _Regression()).add(work, duration)
+
+    def predict(self, workflow: Dict[str, Any], backend: Optional[str] = None) -> float:
+        """预测工作流在某个后端（None表示任意后端）上的执行秒数"""
+        work, model = workflow_features(workflow)
+        for key in ((backend, model), (None, model), (None, None)):
+            regression = self.regressions.get(key)
+            if regression:
+                predicted = regression.predict(work)
+                if predicted:
+                    return predicted
+        return self.default_seconds * work / REFERENCE_WORK
+
+    def timeouts(self, workflow: Dict[str, Any], backend: Optional[str] = None) -> Tuple[float, float]:
+        """
+        按预测时间计算超时
+
+        Returns:
+            Tuple[float, float]: (两条消息之间的最长间隔, 开始执行后的最长执行时间)，单位秒
+        """
+        predicted = self.predict(workflow, backend)
+        inactivity = min(max(predicted * self.inactivity_ratio, self.inactivity_min), self.inactivity_max)
+        return inactivity, predicted * self.deadline_factor + self.deadline_grace
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = {}
+        for (backend, model), regression in self.regressions.items():
+            coefficients = regression.coefficients()
+            if coefficients is None:
+                continue
+            a, b = coefficients
+            stats[f"{backend or '*'}|{model or '*'}"] = {
+                "samples": regression.samples,
+                "overhead_seconds": round(a, 3),
+                "seconds_per_megapixel_step": round(b, 5),
+                "reference_seconds": round(a + b * REFERENCE_WORK, 2),
+            }
+        return stats
+
+
+@lru_cache()
+def get_runtime_model() -> RuntimeModel:
+    return RuntimeModel.from_settings()
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import Dict, Any, Optional, List, Callable, Awaitable, AsyncIterator
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    def __init__(self, task: asyncio.Task, release: Optional[Callable[[Any], None]] = None):
+        self.task = task
+        self.release = release
+        self.waiters = 0
+        self.released = False
+        self.listeners: List[Callable[[Dict[str, Any]], None]] = []
+
+    def release_result(self):
+        """任务成功且没有调用方在使用结果时释放结果，只释放一次"""
+        if self.released or self.waiters or not self.task.done() or self.task.cancelled():
+            return
+        if self.task.exception() is None and self.release:
+            self.released = True
+            self.release(self.task.result())
+
+
+class SingleFlight:
+    """相同任务合并执行
+
+    同一个键的任务正在排队或执行时，后来的调用方直接等待同一个结果，
+    N个相同请求只占用一次GPU。共享任务用 asyncio.shield 保护，
+    单个调用方取消不会影响其他调用方；所有调用方都离开后才取消任务。
+    """
+
+    def __init__(self):
+        self.flights: Dict[str, _Flight] = {}
+        # 实际执行次数、被合并的调用次数、因无人等待而取消的任务数
+        self.executions = 0
+        self.coalesced = 0
+        self.abandoned = 0
+
+    @asynccontextmanager
+    async def join(self, key: str, factory: Callable[[], Awaitable[Any]],
+                   release: Optional[Callable[[Any], None]] = None,
+                   listener: Optional[Callable[[Dict[str, Any]], None]] = None) -> AsyncIterator[Any]:
+        """
+        加入（或发起）键为key的任务并等待结果
+
+        结果在 async with 块内有效；最后一个调用方退出时调用 release(result) 释放资源。
+
+        Args:
+            key: 任务的规范化键
+            factory: 没有进行中的任务时用于发起任务的协程函数
+            release: 释放结果的回调
+            listener: 接收任务执行过程事件（见 emit）的回调
+        """
+        flight = self.flights.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(factory()), release)
+            self.flights[key] = flight
+            self.executions += 1
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+        else:
+            self.coalesced += 1
+            logger.info(f"合并相同任务: {key[:12]}，当前等待数 {flight.waiters + 1}")
+        flight.waiters += 1
+        if listener:
+            flight.listeners.append(listener)
+        try:
+            yield await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if listener:
+                flight.listeners.remove(listener)
+            if flight.waiters == 0:
+                if not flight.task.done():
+                    # 任务取消后的清理（例如从ComfyUI队列删除prompt）还要一段时间，
+                    # 先移除，期间加入的调用方发起新的任务，而不是等待一个已取消的任务
+                    self._forget(key, flight)
+                    flight.task.cancel()
+                    self.abandoned += 1
+                flight.release_result()
+
+    def emit(self, key: str, event: Dict[str, Any]):
+        """把任务的执行事件转发给所有等待者"""
+        flight = self.flights.get(key)
+        if flight is None:
+            return
+        for listener in list(flight.listeners):
+            try:
+                listener(event)
+            except Exception as e:
+                logger.error(f"处理任务事件失败: {str(e)}")
+
+    def _forget(self, key: str, flight: _Flight):
+        if self.flights.get(key) is flight:
+            del self.flights[key]
+        # 取消请求送达前任务已经完成的情况
+        flight.release_result()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self.flights),
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "abandoned": self.abandoned,
+        }
+
+
+@lru_cache()
+def get_single_flight() -> SingleFlight:
+    return SingleFlight()
@@ -0,0 +1,23 @@
+from typing import Dict, Any
+from app.utils.workflow_templates import WorkflowTemplate
+
+# 预热只需要让ComfyUI加载模型，输出改为不落盘的临时预览
+WARMUP_OUTPUT_NODES = {"SaveImage": "PreviewImage"}
+
+
+def warmup_workflow(template: WorkflowTemplate, size: int = 64, steps: int = 1) -> Dict[str, Any]:
+    """
+    生成模板的预热版本：极小分辨率、单张、极少步数，模型加载节点与原模板相同
+
+    Args:
+        template: 工作流模板
+        size: 宽高（像素）
+        steps: 采样步数
+    """
+    params = {"width": size, "height": size, "batch_size": 1, "steps": steps}
+    workflow = template.render(**{role: value for role, value in params.items() if role in template.roles})
+    for node_id, node in workflow.items():
+        class_type = WARMUP_OUTPUT_NODES.get(node["class_type"])
+        if class_type:
+            workflow[node_id] = {**node, "class_type": class_type, "inputs": {"images": node["inputs"]["images"]}}
+    return workflow
@@ -0,0 +1,193 @@
+import json
+import logging
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Any, Optional, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 默认工作流模板目录
+WORKFLOW_DIR = Path(__file__).parent.parent / "config" / "workflows"
+
+# 参数角色 -> 可承载该参数的 (节点类型, 输入名)
+PARAMETER_ROLES: Dict[str, List[Tuple[str, str]]] = {
+    "width": [("EmptyLatentImage", "width"), ("EmptySD3LatentImage", "width")],
+    "height": [("EmptyLatentImage", "height"), ("EmptySD3LatentImage", "height")],
+    "batch_size": [("EmptyLatentImage", "batch_size"), ("EmptySD3LatentImage", "batch_size")],
+    "seed": [("RandomNoise", "noise_seed"), ("KSampler", "seed"), ("KSamplerAdvanced", "noise_seed")],
+    "steps": [("BasicScheduler", "steps"), ("KSampler", "steps"), ("KSamplerAdvanced", "steps")],
+    "sampler": [("KSamplerSelect", "sampler_name"), ("KSampler", "sampler_name"),
+                ("KSamplerAdvanced", "sampler_name")],
+    "guidance": [("FluxGuidance", "guidance"), ("CFGGuider", "cfg"), ("KSampler", "cfg"),
+                 ("KSamplerAdvanced", "cfg")],
+    "filename_prefix": [("SaveImage", "filename_prefix")],
+}
+
+# 文本编码节点，按是否连接到采样器的 negative 输入区分正/负向提示词
+PROMPT_NODES = {"CLIPTextEncode": "text"}
+
+# 输出图像的节点
+OUTPUT_NODES = {"SaveImage", "SaveImageWebsocket", "PreviewImage"}
+
+
+class WorkflowTemplateError(Exception):
+    """工作流模板无效或不存在"""
+
+
+def _is_link(value: Any) -> bool:
+    return isinstance(value, list) and len(value) == 2 and isinstance(value[0], str) and isinstance(value[1], int)
+
+
+class WorkflowTemplate:
+    """
+    解析并校验过的工作流模板
+
+    加载时按 class_type 和参数角色建立节点索引；render() 只复制被修改的节点，
+    其余节点与模板共享，调用方不能原地修改渲染结果中的节点。
+    """
+
+    def __init__(self, name: str, workflow: Dict[str, Any], mtime: Optional[float] = None):
+        self.name = name
+        self.workflow = workflow
+        self.mtime = mtime
+        self.validate()
+        self.nodes_by_class: Dict[str, List[str]] = {}
+        for node_id, node in workflow.items():
+            self.nodes_by_class.setdefault(node["class_type"], []).append(node_id)
+        self.roles: Dict[str, List[Tuple[str, str]]] = {}
+        for role, targets in PARAMETER_ROLES.items():
+            for class_type, input_name in targets:
+                for node_id in self.nodes_by_class.get(class_type, []):
+                    if input_name in workflow[node_id]["inputs"]:
+                        self.roles.setdefault(role, []).append((node_id, input_name))
+        self._index_prompts()
+        self.output_nodes = [node_id for node_id, node in workflow.items() if node["class_type"] in OUTPUT_NODES]
+
+    @classmethod
+    def load(cls, path: Path) -> "WorkflowTemplate":
+        """从JSON文件加载模板"""
+        path = Path(path)
+        try:
+            with open(path, encoding="utf-8") as f:
+                workflow = json.load(f)
+        except (OSError, ValueError) as e:
+            raise WorkflowTemplateError(f"加载工作流失败 {path.name}: {str(e)}") from e
+        return cls(path.stem, workflow, path.stat().st_mtime)
+
+    def validate(self):
+        """检查节点结构和节点间的连接"""
+        if not isinstance(self.workflow, dict) or not self.workflow:
+            raise WorkflowTemplateError(f"工作流 {self.name} 为空或格式错误")
+        for node_id, node in self.workflow.items():
+            if not isinstance(node, dict) or not isinstance(node.get("class_type"), str) \
+                    or not isinstance(node.get("inputs"), dict):
+                raise WorkflowTemplateError(f"工作流 {self.name} 的节点 {node_id} 缺少 class_type 或 inputs")
+            for input_name, value in node["inputs"].items():
+                if _is_link(value) and value[0] not in self.workflow:
+                    raise WorkflowTemplateError(
+                        f"工作流 {self.name} 的节点 {node_id}.{input_name} 连接到不存在的节点 {value[0]}")
+        if not any(node["class_type"] in OUTPUT_NODES for node in self.workflow.values()):
+            raise WorkflowTemplateError(f"工作流 {self.name} 没有输出节点")
+
+    def _index_prompts(self):
+        negative = {
+            value[0]
+            for node in self.workflow.values()
+            for input_name, value in node["inputs"].items()
+            if input_name == "negative" and _is_link(value)
+        }
+        for class_type, input_name in PROMPT_NODES.items():
+            for node_id in self.nodes_by_class.get(class_type, []):
+                role = "negative_prompt" if node_id in negative else "prompt"
+                self.roles.setdefault(role, []).append((node_id, input_name))
+
+    def render(self, overrides: Optional[Dict[str, Dict[str, Any]]] = None, **params) -> Dict[str, Any]:
+        """
+        生成填好参数的工作流
+
+        Args:
+            overrides: 按节点ID直接覆盖的输入 {node_id: {input_name: value}}
+            **params: 按角色设置的参数（prompt、negative_prompt、width、height、
+                batch_size、seed、steps、sampler、guidance、filename_prefix），值为None时保持模板默认值
+
+        Returns:
+            Dict: 新的工作流，只有被修改的节点是新对象
+
+        Raises:
+            WorkflowTemplateError: 模板中没有承载该参数的节点
+        """
+        patches: Dict[str, Dict[str, Any]] = {}
+        for role, value in params.items():
+            if value is None:
+                continue
+            targets = self.roles.get(role)
+            if not targets:
+                raise WorkflowTemplateError(f"工作流 {self.name} 不支持参数 {role}")
+            for node_id, input_name in targets:
+                patches.setdefault(node_id, {})[input_name] = value
+        for node_id, inputs in (overrides or {}).items():
+            if node_id not in self.workflow:
+                raise WorkflowTemplateError(f"工作流 {self.name} 中不存在节点 {node_id}")
+            patches.setdefault(node_id, {}).update(inputs)
+
+        workflow = dict(self.workflow)
+        for node_id, inputs in patches.items():
+            node = workflow[node_id]
+            workflow[node_id] = {**node, "inputs": {**node["inputs"], **inputs}}
+        return workflow
+
+
+class WorkflowTemplateRegistry:
+    """工作流模板注册表
+
+    每个模板文件只解析一次，get() 时比较文件修改时间，文件变化后自动重新加载。
+    """
+
+    def __init__(self, directory: Path = WORKFLOW_DIR):
+        self.directory = Path(directory)
+        self.templates: Dict[str, WorkflowTemplate] = {}
+
+    def names(self) -> List[str]:
+        return sorted(path.stem for path in self.directory.glob("*.json"))
+
+    def get(self, name: str) -> WorkflowTemplate:
+        """
+        获取模板
+
+        Args:
+            name: 模板名（不含 .json 扩展名）
+
+        Raises:
+            WorkflowTemplateError: 模板不存在或无效
+        """
+        path = self.directory / f"{name}.json"
+        try:
+            mtime = path.stat().st_mtime
+        except OSError:
+            self.templates.pop(name, None)
+            raise WorkflowTemplateError(f"工作流模板不存在: {name}")
+        template = self.templates.get(name)
+        if template is None or template.mtime != mtime:
+            template = WorkflowTemplate.load(path)
+            if name in self.templates:
+                logger.info(f"工作流模板已重新加载: {name}")
+            self.templates[name] = template
+        return template
+
+    def render(self, name: str, overrides: Optional[Dict[str, Dict[str, Any]]] = None, **params) -> Dict[str, Any]:
+        """按模板名生成填好参数的工作流"""
+        return self.get(name).render(overrides, **params)
+
+    def load_all(self) -> Dict[str, WorkflowTemplate]:
+        """加载并校验目录中的全部模板，无效模板记录日志后跳过"""
+        for name in self.names():
+            try:
+                self.get(name)
+            except WorkflowTemplateError as e:
+                logger.error(str(e))
+        return self.templates
+
+
+@lru_cache()
+def get_workflow_registry() -> WorkflowTemplateRegistry:
+    return WorkflowTemplateRegistry()
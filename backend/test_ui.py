@@ -17,9 +17,23 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 sys.path.append(str(Path(__file__).parent))
-from app.utils.comfyui_client import ComfyUIClient
+from app.core.config import get_settings
+from app.utils.cache_affinity import cache_signature
+from app.utils.comfyui_backends import get_backend_pool
+from app.utils.image_sinks import FileSink
+from app.utils.previews import PreviewBuffer
+from app.utils.runtime_model import get_runtime_model
+from app.utils.workflow_templates import get_workflow_registry
 import time
 
+# 所有生成任务共用的ComfyUI后端池，按负载选择后端
+backend_pool = get_backend_pool()
+# 工作流模板只加载一次，文件修改后自动重新加载
+workflow_templates = get_workflow_registry()
+# 按已完成任务学习的执行时间，决定每个任务的超时
+runtime_model = get_runtime_model()
+settings = get_settings()
+
 # 获取当前文件所在目录
 CURRENT_DIR = Path(__file__).parent
 STATIC_DIR = CURRENT_DIR / "static"
@@ -88,212 +102,121 @@ async def generate_image(prompt, negative_prompt, steps, guidance):
         timestamp = int(time.time())
         short_id = str(timestamp)[-6:]
         
-        # 创建工作流
-        workflow = {
-            "5": {
-                "class_type": "EmptyLatentImage",
-                "inputs": {
-                    "width": 1024,
-                    "height": 1024,
-                    "batch_size": 1
-                }
-            },
-            "22": {
-                "class_type": "BasicGuider",
-                "inputs": {
-                    "model": ["12", 0],
-                    "conditioning": ["6", 0],
-                    "guidance_scale": guidance  # 使用传入的guidance参数
-                }
-            },
-            "8": {
-                "class_type": "VAEDecode",
-                "inputs": {
-                    "samples": ["13", 0],
-                    "vae": ["10", 0]
-                }
-            },
-            "25": {
-                "class_type": "RandomNoise",
-                "inputs": {
-                    "noise_seed": timestamp  # 使用相同的时间戳作为随机种子
-                }
-            },
-            "11": {
-                "class_type": "DualCLIPLoader",
-                "inputs": {
-                    "clip_name1": "t5xxl_fp16.safetensors",
-                    "clip_name2": "clip_l.safetensors",
-                    "type": "flux"
-                }
-            },
-            "10": {
-                "class_type": "VAELoader",
-                "inputs": {
-                    "vae_name": "ae.sft"
-                }
-            },
-            "9": {
-                "class_type": "SaveImage",
-                "inputs": {
-                    "images": ["8", 0],
-                    "filename_prefix": f"img_{short_id}"  # 使用简短的文件名前缀
-                }
-            },
-            "17": {
-                "class_type": "BasicScheduler",
-                "inputs": {
-                    "model": ["12", 0],
-                    "steps": steps,  # 使用传入的steps参数
-                    "scheduler": "normal",
-                    "denoise": 1
-                }
-            },
-            "16": {
-                "class_type": "KSamplerSelect",
-                "inputs": {
-                    "sampler_name": "euler"
-                }
-            },
-            "13": {
-                "class_type": "SamplerCustomAdvanced",
-                "inputs": {
-                    "noise": ["25", 0],
-                    "guider": ["22", 0],
-                    "sampler": ["16", 0],
-                    "sigmas": ["17", 0],
-                    "latent_image": ["5", 0]
-                }
-            },
-            "6": {
-                "class_type": "CLIPTextEncode",
-                "inputs": {
-                    "clip": ["11", 0],
-                    "text": translated_prompt
-                }
-            },
-            "12": {
-                "class_type": "UNETLoader",
-                "inputs": {
-                    "unet_name": "FLUX\\flux1-dev.sft",
-                    "weight_dtype": "fp8_e4m3fn"
-                }
-            }
-        }
-        
-        # 创建ComfyUI客户端
-        client = ComfyUIClient(host="101.126.152.137", port=8188)
-        yield None, 0.2, "正在连接ComfyUI服务器..."
+        # 基于缓存的 txt2img 模板，只复制被修改的节点
+        workflow = workflow_templates.render(
+            "txt2img",
+            prompt=translated_prompt,
+            seed=timestamp,
+            steps=steps,
+            filename_prefix=f"img_{short_id}",
+            overrides={"22": {"guidance_scale": guidance}},
+        )
         
-        # 检查连接
-        if not await client.check_connection():
-            yield None, 0, "连接服务器失败，请重试"
-            return
+        # 选择负载最低的健康后端（熔断的后端不参与路由，全部不可用时立即失败），
+        # 借用共享连接池中的客户端
+        assignment = {"model_load": False}
+        async with backend_pool.acquire(signature=cache_signature(workflow),
+                                        on_assigned=lambda model_load: assignment.update(model_load=model_load)) as backend:
+            client = backend.client()
+            yield None, 0.2, "正在连接ComfyUI服务器..."
             
-        yield None, 0.3, "正在准备生成参数..."
+            yield None, 0.3, "正在准备生成参数..."
         
-        # 执行工作流
-        try:
-            client_id = f"p_{short_id}"
-            
-            # 提交工作流
-            prompt_id = await client.submit_prompt(workflow, client_id)
-            if not prompt_id:
-                yield None, 0, "提交工作流失败，请重试"
-                return
+            # 执行工作流
+            try:
+                output_nodes = None
+                if settings.COMFYUI_WS_OUTPUT:
+                    workflow, output_nodes = await client.apply_websocket_output(workflow)
                 
-            yield None, 0.4, "正在生成图像..."
-            
-            # 连接WebSocket
-            if not await client.connect_websocket(client_id):
-                yield None, 0, "连接WebSocket失败，请重试"
-                return
+                # 提交工作流
+                prompt_id = await client.submit_prompt(workflow)
+                if not prompt_id:
+                    yield None, 0, "提交工作流失败，请重试"
+                    return
                 
-            # 等待执行完成
-            last_status_time = time.time()
-            last_progress = 0
-            current_progress = 0.4
+                yield None, 0.4, "正在生成图像..."
             
-            while True:
-                result = await client.listen_websocket()
-                current_time = time.time()
-                
-                if isinstance(result, dict):
-                    if result.get("type") == "progress":
-                        progress = result.get("data", {})
-                        current_step = progress.get("value", 0)
-                        total_steps = progress.get("max", 0)
-                        if total_steps > 0:
-                            percentage = (current_step / total_steps) * 100
-                            current_progress = 0.4 + (percentage / 100 * 0.5)
-                            if percentage > last_progress:
-                                yield None, current_progress, f"正在生成图像... {percentage:.1f}% ({current_step}/{total_steps})"
-                                last_progress = percentage
-                            last_status_time = current_time
-                            
-                    elif result.get("type") == "executing":
-                        node_id = result.get("data", {}).get("node")
-                        if node_id:
-                            node_name = workflow.get(node_id, {}).get("class_type", "未知节点")
-                            yield None, current_progress, f"正在执行: {node_name}"
-                        elif result.get("data", {}).get("node") is None:
-                            yield None, 0.9, "正在保存图像..."
-                            await asyncio.sleep(1)
-                            image_url = await client.get_latest_image()
-                            if image_url:
-                                async with client.session.get(image_url) as response:
-                                    if response.status == 200:
-                                        image_data = await response.read()
-                                        temp_dir = tempfile.gettempdir()
-                                        temp_file = os.path.join(temp_dir, f"img_{short_id}.png")
-                                        with open(temp_file, "wb") as f:
-                                            f.write(image_data)
-                                        # 保存到作品库
-                                        gallery_path = gallery_dir / f"{int(time.time())}.png"
-                                        shutil.copy(temp_file, gallery_path)
-                                        logger.info(f"[文生图] 已保存到作品库: {gallery_path}")
-                                        yield temp_file, 1.0, "生成完成！"
-                                        return
-                                    else:
-                                        yield None, 0, "保存图像失败，请重试"
-                            else:
-                                yield None, 0, "获取图像失败，请重试"
-                                return
-                
-                # 超时检查
-                if current_time - last_status_time > 30:
+                # 通过共享WebSocket接收本任务的事件
+                watcher = client.watch(prompt_id, output_nodes)
+                last_progress = 0
+                current_progress = 0.4
+                # 采样预览帧只保留最新一帧，随进度一起显示
+                preview = PreviewBuffer.from_settings()
+            
+                inactivity_timeout, execution_timeout = runtime_model.timeouts(workflow, backend.key)
+                if not backend_pool.is_warm(backend) or assignment["model_load"]:
+                    # 后端尚未预热或所需模型可能不在显存中，开始执行后要先加载模型，期间没有任何消息
+                    inactivity_timeout = max(inactivity_timeout, settings.COMFYUI_WARMUP_TIMEOUT)
+                    execution_timeout += settings.COMFYUI_WARMUP_TIMEOUT
+            
+                try:
+                    async for result in watcher.iter_events(inactivity_timeout, execution_timeout=execution_timeout):
+                        if result.get("type") == "preview":
+                            preview.update(result["data"]["image"])
+                        elif result.get("type") == "progress":
+                            progress = result.get("data", {})
+                            current_step = progress.get("value", 0)
+                            total_steps = progress.get("max", 0)
+                            if total_steps > 0:
+                                percentage = (current_step / total_steps) * 100
+                                current_progress = 0.4 + (percentage / 100 * 0.5)
+                                if percentage > last_progress:
+                                    yield await preview.get_image(), current_progress, f"正在生成图像... {percentage:.1f}% ({current_step}/{total_steps})"
+                                    last_progress = percentage
+                                
+                        elif result.get("type") == "executing":
+                            node_id = result.get("data", {}).get("node")
+                            if node_id:
+                                node_name = workflow.get(node_id, {}).get("class_type", "未知节点")
+                                yield await preview.get_image(), current_progress, f"正在执行: {node_name}"
+                except asyncio.TimeoutError:
                     yield None, 0, "生成超时，请重试"
                     return
-                    
-                await asyncio.sleep(0.1)
+                finally:
+                    client.unwatch(prompt_id)
+                    if not watcher.done.done():
+                        # 超时、点击停止或关闭页面时不再占用GPU
+                        await asyncio.shield(client.cancel_prompt(prompt_id))
+                    elif watcher.done.exception():
+                        # 执行失败的prompt同样留有历史记录
+                        client.release_prompt(prompt_id)
                 
-        except Exception as e:
-            logger.error(f"工作流执行错误: {str(e)}")
-            yield None, 0, f"生成失败：{str(e)}"
+                yield None, 0.9, "正在保存图像..."
+                images = await client.collect_images(watcher)
+                if images:
+                    temp_file = await save_image_to_gallery(client, images[0], short_id, "[文生图]")
+                    client.release_prompt(prompt_id)
+                    if temp_file:
+                        yield temp_file, 1.0, "生成完成！"
+                    else:
+                        yield None, 0, "保存图像失败，请重试"
+                else:
+                    client.release_prompt(prompt_id)
+                    yield None, 0, "获取图像失败，请重试"
+                
+            except Exception as e:
+                logger.error(f"工作流执行错误: {str(e)}")
+                yield None, 0, f"生成失败：{str(e)}"
             
     except Exception as e:
         logger.error(f"生成图像时发生错误: {str(e)}")
         yield None, 0, f"生成失败：{str(e)}"
 
-async def get_latest_image(client):
-    """获取最新生成的图像"""
+async def save_image_to_gallery(client, image, short_id, tag):
+    """下载生成的图像到临时目录并保存到作品库，返回临时文件路径"""
+    temp_dir = tempfile.gettempdir()
+    temp_file = os.path.join(temp_dir, f"img_{short_id}.png")
     try:
-        async with client.session.get(f"{client.base_url}/history") as response:
-            if response.status == 200:
-                history = await response.json()
-                if history:
-                    latest_output = list(history.values())[-1]["outputs"]
-                    if latest_output:
-                        node_id = list(latest_output.keys())[0]
-                        image_data = latest_output[node_id]["images"][0]
-                        return f"{client.base_url}/view?filename={image_data['filename']}"
-                else:
-                    logger.warning("未找到图像输出")
-            else:
-                logger.warning("历史记录为空")
+        # 按块写入临时文件，不在内存中缓存整张图
+        await client.stream_image(image, FileSink(temp_file), settings.COMFYUI_DOWNLOAD_CHUNK_SIZE)
     except Exception as e:
-        logger.error(f"获取图像时出错: {str(e)}")
-    return None
+        logger.error(f"{tag} 获取图像失败: {str(e)}")
+        return None
+    # 保存到作品库
+    gallery_path = gallery_dir / f"{int(time.time())}.png"
+    shutil.copy(temp_file, gallery_path)
+    logger.info(f"{tag} 已保存到作品库: {gallery_path}")
+    return temp_file
 
 async def generate_variation(image, prompt, negative_prompt, strength, steps, guidance):
     try:
@@ -321,120 +244,50 @@ async def generate_variation(image, prompt, negative_prompt, strength, steps, gu
         short_id = str(timestamp)[-6:]
         logger.info(f"[图生图] short_id: {short_id}")
         
-        # 创建工作流
-        workflow = {
-            "5": {
-                "class_type": "EmptyLatentImage",
-                "inputs": {
-                    "width": 1024,
-                    "height": 1024,
-                    "batch_size": 1
-                }
-            },
-            "22": {
-                "class_type": "BasicGuider",
-                "inputs": {
-                    "model": ["12", 0],
-                    "conditioning": ["6", 0]
-                }
-            },
-            "8": {
-                "class_type": "VAEDecode",
-                "inputs": {
-                    "samples": ["13", 0],
-                    "vae": ["10", 0]
-                }
-            },
-            "25": {
-                "class_type": "RandomNoise",
-                "inputs": {
-                    "noise_seed": 782619153058034
-                }
-            },
-            "11": {
-                "class_type": "DualCLIPLoader",
-                "inputs": {
-                    "clip_name1": "t5xxl_fp16.safetensors",
-                    "clip_name2": "clip_l.safetensors",
-                    "type": "flux"
-                }
-            },
-            "10": {
-                "class_type": "VAELoader",
-                "inputs": {
-                    "vae_name": "ae.sft"
-                }
-            },
-            "9": {
-                "class_type": "SaveImage",
-                "inputs": {
-                    "images": ["8", 0],
-                    "filename_prefix": f"img_{short_id}"  # 使用简短的文件名前缀
-                }
-            },
-            "17": {
-                "class_type": "BasicScheduler",
-                "inputs": {
-                    "model": ["12", 0],
-                    "steps": 20,
-                    "scheduler": "normal",
-                    "denoise": 1
-                }
-            },
-            "16": {
-                "class_type": "KSamplerSelect",
-                "inputs": {
-                    "sampler_name": "euler"
-                }
-            },
-            "13": {
-                "class_type": "SamplerCustomAdvanced",
-                "inputs": {
-                    "noise": ["25", 0],
-                    "guider": ["22", 0],
-                    "sampler": ["16", 0],
-                    "sigmas": ["17", 0],
-                    "latent_image": ["5", 0]
-                }
-            },
-            "6": {
-                "class_type": "CLIPTextEncode",
-                "inputs": {
-                    "clip": ["11", 0],
-                    "text": translated_prompt
-                }
-            },
-            "12": {
-                "class_type": "UNETLoader",
-                "inputs": {
-                    "unet_name": "FLUX\\flux1-dev.sft",
-                    "weight_dtype": "fp8_e4m3fn"
-                }
-            }
-        }
+        # 基于缓存的 txt2img 模板，只复制被修改的节点
+        workflow = workflow_templates.render(
+            "txt2img",
+            prompt=translated_prompt,
+            filename_prefix=f"img_{short_id}",
+        )
         
         logger.info("[图生图] 正在连接ComfyUI服务器...")
         yield None, 0.2, "正在连接ComfyUI服务器..."
         
-        async with ComfyUIClient(host="101.126.152.137", port=8188) as client:
+        assignment = {"model_load": False}
+        async with backend_pool.acquire(signature=cache_signature(workflow),
+                                        on_assigned=lambda model_load: assignment.update(model_load=model_load)) as backend, backend.client() as client:
+            output_nodes = None
+            if settings.COMFYUI_WS_OUTPUT:
+                workflow, output_nodes = await client.apply_websocket_output(workflow)
+            
             logger.info("[图生图] 提交工作流...")
             prompt_id = await client.submit_prompt(workflow)
             logger.info(f"[图生图] 工作流已提交，ID: {prompt_id}")
+            if not prompt_id:
+                yield None, 0, "提交工作流失败，请重试"
+                return
             yield None, 0.3, "工作流已提交，正在生成图像..."
             
-            logger.info("[图生图] 连接WebSocket...")
-            await client.connect_websocket()
-            
-            last_status_time = time.time()
+            # 通过共享WebSocket接收本任务的事件
+            watcher = client.watch(prompt_id, output_nodes)
             last_progress = 0
             current_progress = 0.3
+            # 采样预览帧只保留最新一帧，随进度一起显示
+            preview = PreviewBuffer.from_settings()
             
-            while True:
-                result = await client.listen_websocket()
-                logger.info(f"[图生图] WebSocket返回: {result}")
-                current_time = time.time()
-                
-                if isinstance(result, dict):
+            inactivity_timeout, execution_timeout = runtime_model.timeouts(workflow, backend.key)
+            if not backend_pool.is_warm(backend) or assignment["model_load"]:
+                # 后端尚未预热或所需模型可能不在显存中，开始执行后要先加载模型，期间没有任何消息
+                inactivity_timeout = max(inactivity_timeout, settings.COMFYUI_WARMUP_TIMEOUT)
+                execution_timeout += settings.COMFYUI_WARMUP_TIMEOUT
+            
+            try:
+                async for result in watcher.iter_events(inactivity_timeout, execution_timeout=execution_timeout):
+                    if result.get("type") == "preview":
+                        preview.update(result["data"]["image"])
+                        continue
+                    logger.info(f"[图生图] WebSocket返回: {result}")
                     if result.get("type") == "progress":
                         progress = result.get("data", {})
                         current_step = progress.get("value", 0)
@@ -444,107 +297,43 @@ async def generate_variation(image, prompt, negative_prompt, strength, steps, gu
                             current_progress = 0.3 + (percentage / 100 * 0.6)
                             if percentage > last_progress:
                                 logger.info(f"[图生图] 生成进度: {percentage:.1f}%")
-                                yield None, current_progress, f"正在生成图像... {percentage:.1f}% ({current_step}/{total_steps})"
+                                yield await preview.get_image(), current_progress, f"正在生成图像... {percentage:.1f}% ({current_step}/{total_steps})"
                                 last_progress = percentage
-                            last_status_time = current_time
                     
                     elif result.get("type") == "executing":
                         node_id = result.get("data", {}).get("node")
                         logger.info(f"[图生图] executing node_id: {node_id}")
                         if node_id:
                             node_name = workflow.get(node_id, {}).get("class_type", "未知节点")
-                            yield None, current_progress, f"正在执行: {node_name}"
-                        elif result.get("data", {}).get("node") is None:
-                            logger.info("[图生图] 执行完成，等待1秒后获取图像...")
-                            yield None, 0.9, "执行完成，正在获取图像..."
-                            await asyncio.sleep(1)
-                            image_url = await get_latest_image(client)
-                            logger.info(f"[图生图] 获取到的image_url: {image_url}")
-                            if image_url:
-                                # 获取图像数据
-                                async with client.session.get(image_url) as response:
-                                    logger.info(f"[图生图] 拉取图片状态码: {response.status}")
-                                    if response.status == 200:
-                                        image_data = await response.read()
-                                        # 将图片保存到系统临时目录
-                                        temp_dir = tempfile.gettempdir()
-                                        temp_file = os.path.join(temp_dir, f"img_{short_id}.png")
-                                        with open(temp_file, "wb") as f:
-                                            f.write(image_data)
-                                        # 保存到作品库
-                                        gallery_path = gallery_dir / f"{int(time.time())}.png"
-                                        shutil.copy(temp_file, gallery_path)
-                                        logger.info(f"[图生图] 已保存到作品库: {gallery_path}")
-                                        yield temp_file, 1.0, "生成完成！"
-                                        return
-                                    else:
-                                        logger.error(f"[图生图] 获取图像失败，状态码: {response.status}")
-                                        yield None, 0, f"获取图像失败，状态码: {response.status}"
-                            else:
-                                logger.warning("[图生图] 未能获取到图像，继续等待...")
-                
-                    # 新增：处理 status 队列清空
-                    elif result.get("type") == "status":
-                        exec_info = result.get("data", {}).get("status", {}).get("exec_info", {})
-                        if exec_info.get("queue_remaining", 1) == 0:
-                            logger.info("[图生图] 队列已清空，尝试获取图片")
-                            yield None, 0.95, "队列已清空，正在获取图像..."
-                            await asyncio.sleep(1)
-                            image_url = await get_latest_image(client)
-                            logger.info(f"[图生图] 队列清空后获取到的image_url: {image_url}")
-                            if image_url:
-                                async with client.session.get(image_url) as response:
-                                    logger.info(f"[图生图] 队列清空后拉取图片状态码: {response.status}")
-                                    if response.status == 200:
-                                        image_data = await response.read()
-                                        temp_dir = tempfile.gettempdir()
-                                        temp_file = os.path.join(temp_dir, f"img_{short_id}.png")
-                                        with open(temp_file, "wb") as f:
-                                            f.write(image_data)
-                                        # 保存到作品库
-                                        gallery_path = gallery_dir / f"{int(time.time())}.png"
-                                        shutil.copy(temp_file, gallery_path)
-                                        logger.info(f"[图生图] 已保存到作品库: {gallery_path}")
-                                        yield temp_file, 1.0, "生成完成！"
-                                        return
-                                    else:
-                                        logger.error(f"[图生图] 队列清空后获取图像失败，状态码: {response.status}")
-                                        yield None, 0, f"获取图像失败，状态码: {response.status}"
-                            else:
-                                logger.error("[图生图] 队列清空后未能获取到图片")
-                                yield None, 0, "未能获取到图片"
-                            return
-                
-                # 超时检查
-                if current_time - last_status_time > 30:
-                    logger.warning("[图生图] 等待超时，尝试最后一次获取结果...")
-                    image_url = await get_latest_image(client)
-                    logger.info(f"[图生图] 超时后获取到的image_url: {image_url}")
-                    if image_url:
-                        # 获取图像数据
-                        async with client.session.get(image_url) as response:
-                            logger.info(f"[图生图] 超时拉取图片状态码: {response.status}")
-                            if response.status == 200:
-                                image_data = await response.read()
-                                # 将图片保存到系统临时目录
-                                temp_dir = tempfile.gettempdir()
-                                temp_file = os.path.join(temp_dir, f"img_{short_id}.png")
-                                with open(temp_file, "wb") as f:
-                                    f.write(image_data)
-                                # 保存到作品库
-                                gallery_path = gallery_dir / f"{int(time.time())}.png"
-                                shutil.copy(temp_file, gallery_path)
-                                logger.info(f"[图生图] 已保存到作品库: {gallery_path}")
-                                yield temp_file, 1.0, "生成完成！"
-                            else:
-                                logger.error(f"[图生图] 超时后获取图像失败，状态码: {response.status}")
-                                yield None, 0, f"获取图像失败，状态码: {response.status}"
-                    else:
-                        logger.error("[图生图] 生成超时，未能获取到图片")
-                        yield None, 0, "生成超时，请重试"
-                    return
+                            yield await preview.get_image(), current_progress, f"正在执行: {node_name}"
+                            
+                logger.info("[图生图] 执行完成，获取图像...")
+                yield None, 0.9, "执行完成，正在获取图像..."
+            except asyncio.TimeoutError:
+                logger.warning("[图生图] 等待超时，尝试最后一次获取结果...")
+            finally:
+                client.unwatch(prompt_id)
+                if not watcher.done.done():
+                    # 超时、点击停止或关闭页面时不再占用GPU
+                    await asyncio.shield(client.cancel_prompt(prompt_id))
+                elif watcher.done.exception():
+                    # 执行失败的prompt同样留有历史记录
+                    client.release_prompt(prompt_id)
                 
-                await asyncio.sleep(0.1)
+            # 超时时任务可能已经结束，按prompt_id查询一次历史记录
+            images = await client.collect_images(watcher)
+            logger.info(f"[图生图] 获取到的图像数: {len(images)}")
+            if images:
+                temp_file = await save_image_to_gallery(client, images[0], short_id, "[图生图]")
+                client.release_prompt(prompt_id)
+                if temp_file:
+                    yield temp_file, 1.0, "生成完成！"
+                else:
+                    yield None, 0, "获取图像失败，请重试"
+            else:
+                client.release_prompt(prompt_id)
+                logger.error("[图生图] 未能获取到图片")
+                yield None, 0, "生成超时，请重试"
                 
     except Exception as e:
         logger.error(f"[图生图] 发生错误: {str(e)}")
@@ -666,6 +455,8 @@ with gr.Blocks(title="PegaAI", css="""
                     with gr.Row():
                         with gr.Column(scale=3):
                             gen_button = gr.Button("生成", variant="primary")
+                        with gr.Column(scale=1):
+                            gen_stop_button = gr.Button("停止")
                         with gr.Column(scale=1):
                             clear_button = gr.Button("清除")
                     gen_progress = gr.Slider(
@@ -708,7 +499,11 @@ with gr.Blocks(title="PegaAI", css="""
                         var_strength = gr.Slider(minimum=0, maximum=1, value=0.75, step=0.01, label="转换强度")
                         var_steps = gr.Slider(minimum=1, maximum=100, value=20, step=1, label="推理步数")
                         var_guidance = gr.Slider(minimum=1, maximum=20, value=7, step=0.1, label="提示词引导系数")
-                    var_button = gr.Button("生成变体", variant="primary")
+                    with gr.Row():
+                        with gr.Column(scale=3):
+                            var_button = gr.Button("生成变体", variant="primary")
+                        with gr.Column(scale=1):
+                            var_stop_button = gr.Button("停止")
                     var_progress = gr.Slider(
                         minimum=0,
                         maximum=1,
@@ -756,18 +551,21 @@ with gr.Blocks(title="PegaAI", css="""
     """)
 
     # 修改事件绑定
-    gen_button.click(
+    gen_event = gen_button.click(
         fn=generate_image,
         inputs=[prompt, negative_prompt, steps, guidance],
         outputs=[output_image, gen_progress, gen_status],
         api_name="generate"
     )
-    var_button.click(
+    var_event = var_button.click(
         fn=generate_variation,
         inputs=[input_image, var_prompt, var_negative_prompt, var_strength, var_steps, var_guidance],
         outputs=[var_image, var_progress, var_status],
         api_name="variation"
     )
+    # 停止时取消生成器，生成器退出时删除或中断ComfyUI上的任务
+    gen_stop_button.click(fn=None, inputs=None, outputs=None, cancels=[gen_event])
+    var_stop_button.click(fn=None, inputs=None, outputs=None, cancels=[var_event])
     clear_button.click(
         fn=lambda: (None, 0, ""),
         inputs=[],
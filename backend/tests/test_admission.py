@@ -0,0 +1,65 @@
+import math
+import pytest
+from app.services import admission
+from app.services.admission import AdmissionController, AdmissionRejected, TokenBucket
+from app.services.job_manager import JobManager
+from app.utils.comfyui_backends import ComfyUIBackend, ComfyUIBackendPool
+
+
+def make_controller(monkeypatch, **kwargs):
+    manager = JobManager(workers=0)
+    monkeypatch.setattr(admission, "get_job_manager", lambda: manager)
+    backend = ComfyUIBackend("127.0.0.1", 8188, max_concurrency=2)
+    pool = ComfyUIBackendPool([backend], warmup=False)
+    return AdmissionController(pool, **kwargs), backend
+
+
+def test_token_bucket_reports_wait_without_taking_tokens():
+    bucket = TokenBucket(rate=2, capacity=4)
+
+    assert bucket.take(3) == 0
+    assert bucket.take(3) == pytest.approx(1, abs=0.01)
+    assert bucket.tokens == pytest.approx(1, abs=0.01)
+    # 超过容量的请求按容量计费，不会永远等不到
+    assert TokenBucket(rate=1, capacity=2).take(10) == 0
+
+
+def test_user_over_quota_gets_429_other_users_are_admitted(monkeypatch):
+    controller, _ = make_controller(monkeypatch, user_rate=0.5, user_burst=4)
+
+    controller.admit(1, cost=4)
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.admit(1, cost=1)
+    assert rejected.value.status_code == 429
+    assert rejected.value.headers["Retry-After"] == "2"
+
+    controller.admit(2, cost=4)
+    assert controller.admitted == 2
+    assert controller.rejected_rate == 1
+
+
+def test_backlog_over_budget_gets_503(monkeypatch):
+    controller, backend = make_controller(monkeypatch, default_prompt_seconds=20)
+    backend.queue_size = 5
+
+    assert controller.estimate_wait() == 100
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.admit(1, latency_budget=60)
+    assert rejected.value.status_code == 503
+    assert rejected.value.headers["Retry-After"] == "40"
+    # 被拒绝的请求不扣除用户配额
+    assert 1 not in controller.buckets
+
+    controller.admit(1, latency_budget=120)
+
+
+def test_no_healthy_backend_gets_503(monkeypatch):
+    controller, backend = make_controller(monkeypatch)
+    for _ in range(backend.health.failure_threshold):
+        backend.record_failure()
+
+    assert math.isinf(controller.estimate_wait())
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.admit(1)
+    assert rejected.value.status_code == 503
+    assert controller.rejected_overload == 1
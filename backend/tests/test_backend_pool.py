@@ -0,0 +1,199 @@
+import asyncio
+import time
+import pytest
+from app.utils.cache_affinity import CacheSignature
+from app.utils.comfyui_backends import CircuitBreaker, ComfyUIBackend, ComfyUIBackendPool, NoBackendAvailableError
+
+
+def signature(model, prompt="a cat"):
+    return CacheSignature((("ckpt_name", model),), (prompt,), (512, 512))
+
+
+def make_pool(*backends, **kwargs):
+    pool = ComfyUIBackendPool(list(backends), warmup=False, **kwargs)
+    # 不启动健康检查任务
+    pool.start = lambda: None
+    return pool
+
+
+def test_circuit_opens_after_threshold_and_recovers_through_half_open():
+    breaker = CircuitBreaker(failure_threshold=3, recovery_timeout=0.05)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    # 失败不连续，不熔断
+    assert breaker.allow_request()
+
+    assert breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow_request()
+    # open 期间的成功不提前恢复
+    assert not breaker.record_success()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    time.sleep(0.06)
+    assert not breaker.allow_request()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.record_success()
+    assert breaker.allow_request()
+
+
+def test_failed_half_open_probe_reopens_circuit():
+    breaker = CircuitBreaker(failure_threshold=3, recovery_timeout=0.05)
+    for _ in range(3):
+        breaker.record_failure()
+    time.sleep(0.06)
+    breaker.allow_request()
+
+    assert breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_waiting_requests_fail_when_the_last_backend_opens():
+    backend = ComfyUIBackend("127.0.0.1", 8188, max_concurrency=1)
+    pool = make_pool(backend)
+
+    async def run():
+        backend.in_flight = 1
+
+        async def request():
+            async with pool.acquire():
+                pass
+
+        waiting = asyncio.ensure_future(request())
+        await asyncio.sleep(0)
+        for _ in range(backend.health.failure_threshold):
+            backend.record_failure()
+        pool._dispatch()
+        with pytest.raises(NoBackendAvailableError):
+            await waiting
+        assert len(pool.waiting) == 0
+
+    asyncio.run(run())
+
+
+def test_requests_are_assigned_in_fair_order():
+    backend = ComfyUIBackend("127.0.0.1", 8188, max_concurrency=1)
+    pool = make_pool(backend)
+    order = []
+
+    async def request(name, user_id):
+        async with pool.acquire(user_id=user_id):
+            order.append(name)
+            await asyncio.sleep(0)
+
+    async def run():
+        backend.in_flight = 1
+        tasks = [asyncio.ensure_future(request(f"a{index}", "a")) for index in range(3)]
+        tasks.append(asyncio.ensure_future(request("b0", "b")))
+        await asyncio.sleep(0)
+        pool._release(backend)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    assert order == ["a0", "b0", "a1", "a2"]
+    assert backend.in_flight == 0
+
+
+def test_cache_window_groups_matching_requests_with_bounded_overtakes():
+    backend = ComfyUIBackend("127.0.0.1", 8188, max_concurrency=1)
+    pool = make_pool(backend, cache_window=2)
+    order = []
+
+    async def request(name, sig):
+        async with pool.acquire(signature=sig):
+            order.append(name)
+            await asyncio.sleep(0)
+
+    async def run():
+        backend.in_flight = 1
+        backend.last_signature = signature("sdxl.safetensors")
+        tasks = [asyncio.ensure_future(request("other", signature("flux.safetensors")))]
+        tasks += [asyncio.ensure_future(request(f"same{index}", signature("sdxl.safetensors"))) for index in range(4)]
+        await asyncio.sleep(0)
+        pool._release(backend)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    # 与后端上一个任务相同的请求提前执行，但最多越过 cache_window 次
+    assert order == ["same0", "same1", "other", "same2", "same3"]
+    assert pool.grouped == 2
+
+
+def test_model_affinity_prefers_backend_with_models_loaded():
+    loaded = ComfyUIBackend("127.0.0.1", 8188, max_concurrency=4)
+    empty = ComfyUIBackend("127.0.0.1", 8189, max_concurrency=4)
+    pool = make_pool(empty, loaded, affinity_max_extra_load=1)
+    loaded.note_models(["sdxl.safetensors"])
+
+    assert pool.select(models=["sdxl.safetensors"]) is loaded
+    loaded.in_flight = 1
+    assert pool.select(models=["sdxl.safetensors"]) is loaded
+    # 负载超出最空闲后端 affinity_max_extra_load 以上时退回到按负载选择
+    loaded.in_flight = 2
+    assert pool.select(models=["sdxl.safetensors"]) is empty
+
+
+def test_model_affinity_decays_with_unrelated_assignments():
+    backend = ComfyUIBackend("127.0.0.1", 8188, max_concurrency=1)
+    backend.note_models(["sdxl.safetensors"])
+    assert backend.model_affinity(["sdxl.safetensors"]) == 1
+
+    backend.note_models(["flux.safetensors"])
+    assert backend.model_affinity(["sdxl.safetensors"]) == 0.5
+    assert backend.model_affinity(["sdxl.safetensors", "missing.safetensors"]) == 0.25
+
+
+class FakeClient:
+    """预热用的ComfyUI客户端，failing 中的工作流执行失败"""
+
+    def __init__(self, failing):
+        self.failing = failing
+
+    async def submit_prompt(self, workflow):
+        return workflow["1"]["inputs"]["ckpt_name"]
+
+    async def wait_for_prompt(self, prompt_id, timeout):
+        if prompt_id in self.failing:
+            raise Exception("缺少模型")
+
+    def release_prompt(self, prompt_id):
+        pass
+
+
+def warmup_workflows(*names):
+    return {name: {"1": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": name}}} for name in names}
+
+
+def test_warm_up_with_every_template_failing_stays_cold():
+    backend = ComfyUIBackend("127.0.0.1", 8188, max_concurrency=1)
+    backend.client = lambda: FakeClient({"sdxl", "flux"})
+
+    assert not asyncio.run(backend.warm_up(warmup_workflows("sdxl", "flux")))
+    assert not backend.warm
+    assert set(backend.warmup_errors) == {"sdxl", "flux"}
+
+
+def test_warm_up_with_one_template_working_is_warm():
+    backend = ComfyUIBackend("127.0.0.1", 8188, max_concurrency=1)
+    backend.client = lambda: FakeClient({"flux"})
+
+    assert asyncio.run(backend.warm_up(warmup_workflows("sdxl", "flux")))
+    assert backend.warm
+    assert set(backend.warmup_errors) == {"flux"}
+    assert backend.model_affinity(["sdxl"]) > 0
+
+
+def test_warm_up_does_not_take_a_slot_from_a_full_backend():
+    backend = ComfyUIBackend("127.0.0.1", 8188, max_concurrency=1)
+    pool = ComfyUIBackendPool([backend], warmup=True)
+
+    async def run():
+        backend.in_flight = 1
+        pool._start_warmups()
+        assert backend.key not in pool._warmups
+        await pool._warm_up(backend)
+        assert backend.in_flight == 1
+
+    asyncio.run(run())
@@ -0,0 +1,82 @@
+from app.utils.fair_queue import FairQueue, Priority
+
+
+def drain(queue):
+    order = []
+    while len(queue):
+        item = queue.first()
+        queue.take(item)
+        order.append(item)
+    return order
+
+
+def test_flows_of_different_users_are_interleaved():
+    queue = FairQueue()
+    for index in range(10):
+        queue.push(f"a{index}", user_id="a")
+    # 后提交的用户不需要等前一个用户的批量请求全部执行完
+    queue.push("b0", user_id="b")
+    queue.push("b1", user_id="b")
+
+    assert drain(queue)[:4] == ["a0", "b0", "a1", "b1"]
+
+
+def test_priority_weights_set_the_share_of_each_class():
+    queue = FairQueue()
+    for index in range(8):
+        queue.push(f"bulk{index}", user_id=1, priority=Priority.BULK)
+    for index in range(8):
+        queue.push(f"interactive{index}", user_id=1, priority=Priority.INTERACTIVE)
+
+    first = drain(queue)[:5]
+    # 权重 4:1
+    assert sum(item.startswith("interactive") for item in first) == 4
+    assert sum(item.startswith("bulk") for item in first) == 1
+
+
+def test_cost_is_charged_to_the_flow():
+    queue = FairQueue()
+    queue.push("heavy", user_id="a", cost=8)
+    queue.push("heavy2", user_id="a", cost=8)
+    for index in range(4):
+        queue.push(f"light{index}", user_id="b", cost=1)
+
+    order = drain(queue)
+    assert order.index("light3") < order.index("heavy")
+
+
+def test_position_and_remove():
+    queue = FairQueue()
+    for item in ("x", "y", "z"):
+        queue.push(item, user_id=1)
+
+    assert queue.position("z") == 2
+    assert queue.remove("y")
+    assert not queue.remove("y")
+    assert queue.position("z") == 1
+    assert queue.position("y") is None
+    assert "y" not in queue
+    assert queue.virtual_time == 0
+
+
+def test_sjf_runs_short_requests_first():
+    queue = FairQueue(policy=FairQueue.SJF)
+    queue.push("long", user_id=1, cost=10)
+    queue.push("short", user_id=2, cost=1)
+
+    assert drain(queue) == ["short", "long"]
+
+
+def test_sjf_does_not_starve_long_requests():
+    queue = FairQueue(policy=FairQueue.SJF)
+    queue.push("long", user_id=1, cost=10)
+    # 短任务源源不断地到达，长任务的完成时间固定，虚拟时间推进后最终轮到它
+    for index in range(20):
+        queue.push(f"short{index}", user_id=2, cost=1)
+        item = queue.first()
+        queue.take(item)
+        if item == "long":
+            break
+    else:
+        raise AssertionError("长任务一直没有执行")
+    assert index <= 10
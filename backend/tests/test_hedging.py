@@ -0,0 +1,48 @@
+from app.utils.hedging import HedgingPolicy
+
+
+def test_burst_is_spent_then_hedges_are_denied():
+    policy = HedgingPolicy(enabled=True, budget=0.5, burst=2)
+
+    assert policy.try_hedge()
+    assert policy.try_hedge()
+    assert not policy.try_hedge()
+    assert policy.get_stats()["denied_by_budget"] == 1
+
+
+def test_requests_accrue_budget_up_to_burst():
+    policy = HedgingPolicy(enabled=True, budget=0.5, burst=2)
+    policy.try_hedge()
+    policy.try_hedge()
+
+    policy.record_request()
+    assert not policy.try_hedge()
+    policy.record_request()
+    assert policy.try_hedge()
+
+    for _ in range(100):
+        policy.record_request()
+    assert policy.tokens == 2
+
+
+def test_hedge_ratio_is_bounded_by_budget():
+    policy = HedgingPolicy(enabled=True, budget=0.1, burst=1)
+    for _ in range(1000):
+        policy.record_request()
+        policy.try_hedge()
+
+    # 额外的GPU负载不超过请求数的 budget 倍（加上初始的突发）
+    assert policy.hedged <= 0.1 * 1000 + 1
+
+
+def test_delay_uses_quantile_once_enough_samples():
+    policy = HedgingPolicy(enabled=True, quantile=0.95, min_delay=2, default_delay=30, min_samples=20)
+    assert policy.delay() == 30
+
+    for seconds in range(1, 101):
+        policy.observe_start(seconds)
+    assert policy.delay() == 96
+
+    fast = HedgingPolicy(enabled=True, min_delay=2, min_samples=1)
+    fast.observe_start(0.1)
+    assert fast.delay() == 2
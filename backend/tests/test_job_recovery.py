@@ -0,0 +1,102 @@
+import asyncio
+import threading
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.database import Base
+from app.models import job as job_model
+from app.models.user import User
+from app.services import job_manager
+from app.services.job_manager import JobManager, JobState
+
+PARAMS = {"prompt": "a cat", "n": 1, "width": 512, "height": 512, "seed": 1, "steps": 4}
+
+
+def use_database(monkeypatch, tmp_path, create_tables=True):
+    """任务记录写入临时SQLite数据库"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'jobs.db'}", connect_args={"check_same_thread": False})
+    if create_tables:
+        Base.metadata.create_all(bind=engine, tables=[User.__table__, job_model.JobRecord.__table__])
+    session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    monkeypatch.setattr(job_manager, "SessionLocal", session)
+    return session
+
+
+def test_queued_job_is_persisted_as_queued(monkeypatch, tmp_path):
+    session = use_database(monkeypatch, tmp_path)
+
+    async def run():
+        # 没有worker，任务一直排队
+        manager = JobManager(workers=0)
+        submitted = manager.submit(1, PARAMS)
+        await manager._flush_records()
+        return submitted
+
+    submitted = asyncio.run(run())
+    db = session()
+    try:
+        record = db.get(job_model.JobRecord, submitted.id)
+        assert record.state == JobState.QUEUED
+    finally:
+        db.close()
+
+
+def test_recover_restores_queued_and_running_jobs(monkeypatch, tmp_path):
+    use_database(monkeypatch, tmp_path)
+
+    async def run():
+        manager = JobManager(workers=0)
+        queued = manager.submit(1, PARAMS)
+        running = manager.submit(1, {**PARAMS, "prompt": "a dog"})
+        # 模拟已开始执行并提交了prompt的任务
+        manager._persist(running, state=JobState.RUNNING,
+                         submissions='{"0": [["127.0.0.1:8188", "prompt-1"]]}')
+        await manager._flush_records()
+
+        # 应用重启：新的管理器只能从数据库恢复任务
+        restarted = JobManager(workers=0)
+        restarted.recover()
+        return queued, running, restarted
+
+    queued, running, restarted = asyncio.run(run())
+    assert restarted.get(queued.id) is not None
+    assert restarted.get(queued.id).state == JobState.QUEUED
+    assert restarted.get(running.id).submissions == {0: [("127.0.0.1:8188", "prompt-1")]}
+    # 已经在执行的任务排在最前面
+    assert restarted.queue.first() is restarted.get(running.id)
+    assert len(restarted.queue) == 2
+
+
+def test_jobs_table_is_created_without_create_all(monkeypatch, tmp_path):
+    # 不经过 main.py 的入口没有执行 create_all
+    use_database(monkeypatch, tmp_path, create_tables=False)
+
+    async def run():
+        manager = JobManager(workers=0)
+        submitted = manager.submit(1, PARAMS)
+        await manager._flush_records()
+        restarted = JobManager(workers=0)
+        restarted.recover()
+        return submitted, restarted
+
+    submitted, restarted = asyncio.run(run())
+    assert restarted.get(submitted.id).state == JobState.QUEUED
+
+
+def test_records_are_written_off_the_event_loop(monkeypatch, tmp_path):
+    use_database(monkeypatch, tmp_path)
+    threads = []
+    save_job = job_manager.save_job
+
+    def recording_save_job(db, job_id, **fields):
+        threads.append(threading.get_ident())
+        return save_job(db, job_id, **fields)
+
+    monkeypatch.setattr(job_manager, "save_job", recording_save_job)
+
+    async def run():
+        manager = JobManager(workers=0)
+        manager.submit(1, PARAMS)
+        await manager._flush_records()
+
+    asyncio.run(run())
+    assert threads and threading.get_ident() not in threads
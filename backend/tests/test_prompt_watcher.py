@@ -0,0 +1,65 @@
+import asyncio
+import time
+import pytest
+from app.utils.comfyui_client import PromptWatcher
+
+STATUS = {"type": "status", "data": {"status": {"exec_info": {"queue_remaining": 3}}}}
+
+
+async def consume(watcher: PromptWatcher, **timeouts):
+    async for _ in watcher.iter_events(**timeouts):
+        pass
+
+
+async def flood_status(watcher: PromptWatcher, interval: float = 0.02):
+    """模拟其他prompt不断改变队列：状态广播直接投递给每个订阅者"""
+    while True:
+        watcher.events.put_nowait(STATUS)
+        await asyncio.sleep(interval)
+
+
+def run_with_flood(watcher_setup, **timeouts) -> float:
+    async def run():
+        watcher = PromptWatcher("p1")
+        watcher_setup(watcher)
+        flood = asyncio.ensure_future(flood_status(watcher))
+        started = time.monotonic()
+        try:
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(consume(watcher, **timeouts), 2)
+        finally:
+            flood.cancel()
+        return time.monotonic() - started
+
+    return asyncio.run(run())
+
+
+def test_queue_timeout_is_not_reset_by_status_broadcasts():
+    elapsed = run_with_flood(lambda watcher: None, inactivity_timeout=10, queue_timeout=0.2)
+    assert elapsed < 0.5
+
+
+def test_inactivity_timeout_is_not_reset_by_status_broadcasts():
+    elapsed = run_with_flood(
+        lambda watcher: watcher.feed({"type": "execution_start", "data": {"prompt_id": "p1"}}),
+        inactivity_timeout=0.2, queue_timeout=None,
+    )
+    assert elapsed < 0.5
+
+
+def test_messages_for_the_prompt_keep_it_alive():
+    async def run():
+        watcher = PromptWatcher("p1")
+
+        async def progress():
+            for step in range(5):
+                await asyncio.sleep(0.1)
+                watcher.feed({"type": "progress", "data": {"prompt_id": "p1", "value": step + 1, "max": 5}})
+            watcher.feed({"type": "executing", "data": {"prompt_id": "p1", "node": None}})
+
+        producer = asyncio.ensure_future(progress())
+        await consume(watcher, inactivity_timeout=0.3, queue_timeout=0.3)
+        await producer
+        return watcher.done.result()
+
+    assert asyncio.run(run()) == {}
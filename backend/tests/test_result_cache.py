@@ -0,0 +1,74 @@
+import asyncio
+from app.utils.image_sinks import SpooledSink
+from app.utils.result_cache import ResultCache
+
+
+async def store(cache: ResultCache, key: str, images):
+    entries = []
+    for index, data in enumerate(images):
+        entry = await cache.open_entry(key, index)
+        entry.write(data)
+        entry.close()
+        entries.append(entry)
+    await cache.commit(entries)
+
+
+def test_directory_is_created_on_first_use(tmp_path):
+    directory = tmp_path / "results"
+    cache = ResultCache(directory)
+    assert not directory.exists()
+    assert asyncio.run(cache.get("missing")) is None
+    assert directory.is_dir()
+
+
+def test_commit_then_get_returns_outputs_in_order(tmp_path):
+    cache = ResultCache(tmp_path)
+
+    async def run():
+        await store(cache, "k", [b"first", b"second"])
+        sinks = [await cache.deliver(path, SpooledSink()) for path in await cache.get("k")]
+        data = [sink.getvalue() for sink in sinks]
+        for sink in sinks:
+            sink.release()
+        return data
+
+    assert asyncio.run(run()) == [b"first", b"second"]
+    assert cache.get_stats()["hits"] == 1
+
+
+def test_least_recently_used_entry_is_evicted(tmp_path):
+    cache = ResultCache(tmp_path, max_bytes=10)
+
+    async def run():
+        await store(cache, "old", [b"12345"])
+        await store(cache, "new", [b"12345"])
+        await cache.get("old")
+        await store(cache, "newest", [b"12345"])
+        return await cache.get("new"), await cache.get("old")
+
+    evicted, kept = asyncio.run(run())
+    assert evicted is None
+    assert kept is not None
+    assert not (tmp_path / "new-0.png").exists()
+
+
+def test_index_is_rebuilt_from_files_on_disk(tmp_path):
+    (tmp_path / "whole-0.png").write_bytes(b"a")
+    (tmp_path / "whole-1.png").write_bytes(b"b")
+    # 序号1缺失：序号2无法对应输出顺序
+    (tmp_path / "gap-0.png").write_bytes(b"a")
+    (tmp_path / "gap-2.png").write_bytes(b"c")
+    # 序号0缺失：整个条目无效
+    (tmp_path / "headless-1.png").write_bytes(b"b")
+    (tmp_path / "partial-0.abc.tmp").write_bytes(b"x")
+    cache = ResultCache(tmp_path)
+
+    async def run():
+        return await cache.get("whole"), await cache.get("gap"), await cache.get("headless")
+
+    whole, gap, headless = asyncio.run(run())
+    assert [path.name for path in whole] == ["whole-0.png", "whole-1.png"]
+    assert [path.name for path in gap] == ["gap-0.png"]
+    assert headless is None
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["gap-0.png", "whole-0.png", "whole-1.png"]
+    assert cache.size == 3
@@ -0,0 +1,99 @@
+import asyncio
+from app.utils.single_flight import SingleFlight
+
+
+def test_concurrent_callers_share_one_execution():
+    flights = SingleFlight()
+    runs = []
+
+    async def work():
+        runs.append(1)
+        await asyncio.sleep(0.05)
+        return "image"
+
+    async def caller():
+        async with flights.join("k", work) as result:
+            return result
+
+    async def run():
+        return await asyncio.gather(*[caller() for _ in range(3)])
+
+    assert asyncio.run(run()) == ["image"] * 3
+    assert len(runs) == 1
+    assert flights.get_stats()["coalesced"] == 2
+
+
+def test_one_caller_leaving_does_not_cancel_the_others():
+    flights = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.1)
+        return "image"
+
+    async def caller():
+        async with flights.join("k", work) as result:
+            return result
+
+    async def run():
+        leaving = asyncio.ensure_future(caller())
+        staying = asyncio.ensure_future(caller())
+        await asyncio.sleep(0.02)
+        leaving.cancel()
+        return await staying
+
+    assert asyncio.run(run()) == "image"
+
+
+def test_joining_while_an_abandoned_flight_is_cleaning_up_starts_a_fresh_run():
+    flights = SingleFlight()
+    runs = []
+
+    async def work():
+        runs.append(1)
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            # 模拟被取消后从ComfyUI删除prompt的HTTP请求
+            await asyncio.shield(asyncio.sleep(0.2))
+            raise
+        return "stale"
+
+    async def fresh_work():
+        runs.append(2)
+        return "fresh"
+
+    async def caller(factory):
+        async with flights.join("k", factory) as result:
+            return result
+
+    async def run():
+        first = asyncio.ensure_future(caller(work))
+        await asyncio.sleep(0.02)
+        # 用户关闭页面后马上重新提交相同的请求
+        first.cancel()
+        await asyncio.sleep(0)
+        return await caller(fresh_work)
+
+    assert asyncio.run(run()) == "fresh"
+    assert runs == [1, 2]
+
+
+def test_result_is_released_after_the_last_caller_leaves():
+    flights = SingleFlight()
+    released = []
+
+    async def work():
+        await asyncio.sleep(0.02)
+        return ["buffer"]
+
+    async def caller(hold):
+        async with flights.join("k", work, release=released.append):
+            await asyncio.sleep(hold)
+            return list(released)
+
+    async def run():
+        return await asyncio.gather(caller(0), caller(0.05))
+
+    # 先离开的调用方不能释放另一个调用方仍在使用的结果
+    assert asyncio.run(run()) == [[], []]
+    assert released == [["buffer"]]